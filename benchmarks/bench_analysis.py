@@ -0,0 +1,99 @@
+''' bench_analysis.py
+
+    Benchmarks of the analysis: reordering by hidden state, inter-spike intervals, spike statistics,
+    spike-triggered averages, cross-correlation and the mutual information estimation.
+'''
+import numpy as np
+from common import check_size, synthetic_hidden_state, synthetic_spiketrain, synthetic_input, DURATIONS
+from code.foundations.MI_calculation import analyze_exp, calc_MI_input, calc_MI_ideal, reorder_x
+from code.foundations.helpers import get_spike_intervals, get_on_off_isi
+from code.foundations.STA_calculation import get_spike_index, get_sta, get_cross_correlation
+from code.foundations.spike_statistics import get_cv, get_lv, get_fano_factor, get_bursts, get_state_rates, pack_trials, batch_spike_statistics
+
+SAMPLING_RATE = 5
+TAU = 50
+FACTOR_RON_ROFF = 2
+N_TRIALS = 100
+STA_WINDOW = 500      # samples before and after the spike
+MAX_LAG = 5000        # samples
+
+
+class Analysis:
+    params = [DURATIONS]
+    param_names = ['duration']
+
+    def setup(self, duration):
+        self.dt = 1./SAMPLING_RATE
+        self.n_samples = int(round(duration*SAMPLING_RATE))
+        check_size(self.n_samples)
+        self.ron = 1./(TAU*(1+FACTOR_RON_ROFF))
+        self.roff = FACTOR_RON_ROFF*self.ron
+        self.x = synthetic_hidden_state(duration, SAMPLING_RATE, TAU, FACTOR_RON_ROFF)
+        self.spiketrain = synthetic_spiketrain(self.x, self.dt)
+        self.input_theory = synthetic_input(self.x)
+        self.spiketimes = np.where(self.spiketrain[0] == 1)[0]*self.dt
+
+
+class ReorderX(Analysis):
+    def setup(self, duration):
+        # reorder_x allocates ten times the number of samples per state
+        check_size(10*duration*SAMPLING_RATE)
+        Analysis.setup(self, duration)
+
+    def time_reorder_x(self, duration):
+        reorder_x(self.x, self.spiketrain)
+
+    def peakmem_reorder_x(self, duration):
+        reorder_x(self.x, self.spiketrain)
+
+
+class SpikeIntervals(Analysis):
+    def time_get_spike_intervals(self, duration):
+        get_spike_intervals(self.spiketimes)
+
+
+class OnOffIntervals(Analysis):
+    def time_get_on_off_isi(self, duration):
+        get_on_off_isi(self.spiketimes, self.x, self.dt)
+
+
+class SpikeStatistics(Analysis):
+    def time_spike_statistics(self, duration):
+        get_cv(self.spiketimes)
+        get_lv(self.spiketimes)
+        get_fano_factor(self.spiketimes, duration, 100)
+        get_bursts(self.spiketimes, 10)
+        get_state_rates(self.spiketimes, self.x, self.dt)
+
+
+class BatchSpikeStatistics(Analysis):
+    def setup(self, duration):
+        Analysis.setup(self, duration)
+        self.spike_times, self.offsets = pack_trials([self.spiketimes]*N_TRIALS)
+
+    def time_batch_spike_statistics(self, duration):
+        batch_spike_statistics(self.spike_times, self.offsets, duration)
+
+
+class SpikeTriggeredAverage(Analysis):
+    def time_get_sta(self, duration):
+        get_sta(self.input_theory, get_spike_index(self.spiketimes, self.dt), STA_WINDOW, STA_WINDOW)
+
+
+class CrossCorrelation(Analysis):
+    def time_get_cross_correlation(self, duration):
+        get_cross_correlation(self.x, self.input_theory, MAX_LAG)
+
+
+class MutualInformation(Analysis):
+    def time_calc_MI_input(self, duration):
+        calc_MI_input(self.ron, self.roff, self.input_theory, 0.5, self.x, self.dt)
+
+    def time_calc_MI_ideal(self, duration):
+        calc_MI_ideal(self.ron, self.roff, self.spiketrain, self.x, self.dt)
+
+    def time_analyze_exp(self, duration):
+        analyze_exp(self.ron, self.roff, self.x, self.input_theory, self.dt, 0.5, self.spiketrain)
+
+    def peakmem_analyze_exp(self, duration):
+        analyze_exp(self.ron, self.roff, self.x, self.input_theory, self.dt, 0.5, self.spiketrain)
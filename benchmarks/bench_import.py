@@ -0,0 +1,79 @@
+''' bench_import.py
+
+    Import time of the modules that worker processes use to generate stimuli and analyse results.
+    Every import is measured in a new interpreter, after importing numpy (which every worker needs),
+    so the time is that of the module itself. Run this file directly to check that the modules
+    import within IMPORT_BUDGET_MS and don't load brian2, matplotlib, pandas, scipy or numba.
+'''
+import os,sys
+import json
+import subprocess
+from common import repo_dir
+
+LIGHT_MODULES = ['code.foundations.input', 'code.foundations.dynamic_clamp', 'code.foundations.population',
+                 'code.foundations.make_dynamic_experiments', 'code.foundations.MI_calculation',
+                 'code.foundations.MI_bootstrap', 'code.foundations.helpers', 'code.foundations.result_store',
+                 'code.foundations.stimulus_cache', 'code.foundations.shared_arrays',
+                 'code.foundations.spike_statistics', 'code.foundations.STA_calculation']
+HEAVY_MODULES = ['brian2', 'matplotlib', 'pandas', 'scipy', 'numba']
+
+# Largest accepted import time of a light module in ms
+IMPORT_BUDGET_MS = 100
+
+_SCRIPT = '''
+import sys, time, json
+sys.path.insert(0, %r)
+import numpy
+start = time.perf_counter()
+import %s
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms':1000*elapsed, 'loaded':[name for name in %r if name in sys.modules]}))
+'''
+
+
+def measure_import(module, repeat=3):
+    ''' Import a module in new interpreters.
+
+        INPUT
+        module (str): name of the module, e.g. 'code.foundations.input'
+        repeat (int): number of interpreters, the fastest import is returned
+
+        OUTPUT
+        ms, loaded (float, list): import time in ms and the heavy modules that were loaded
+    '''
+    script = _SCRIPT % (repo_dir, module, HEAVY_MODULES)
+    results = [json.loads(subprocess.check_output([sys.executable, '-c', script], cwd=repo_dir, text=True))
+               for _ in range(repeat)]
+    return min(result['ms'] for result in results), results[0]['loaded']
+
+
+class ImportTime:
+    params = [LIGHT_MODULES]
+    param_names = ['module']
+
+    def track_import(self, module):
+        return measure_import(module)[0]
+    track_import.unit = 'ms'
+
+    def track_heavy_modules(self, module):
+        return len(measure_import(module, repeat=1)[1])
+    track_heavy_modules.unit = 'modules'
+
+
+def check_imports(budget_ms=IMPORT_BUDGET_MS):
+    ''' Check the import time and the heavy modules of every light module.
+
+        OUTPUT
+        passed (bool): whether all modules are within the budget and load no heavy modules
+    '''
+    passed = True
+    for module in LIGHT_MODULES:
+        ms, loaded = measure_import(module)
+        ok = ms <= budget_ms and not loaded
+        passed = passed and ok
+        print('%-40s %8.1f ms %-30s %s' % (module, ms, ', '.join(loaded), 'ok' if ok else 'FAILED'))
+    return passed
+
+
+if __name__ == '__main__':
+    sys.exit(0 if check_imports() else 1)
@@ -0,0 +1,65 @@
+''' bench_input.py
+
+    Benchmarks of the input generation: hidden state and the input of the artificial neural network.
+'''
+import numpy as np
+from common import check_size, synthetic_hidden_state, DURATIONS, N_NEURONS, SAMPLING_RATES
+from code.foundations.input import Input
+from code.foundations.dynamic_clamp import get_g0
+
+
+def make_input(duration, sampling_rate, N, tau=50, factor_ron_roff=2, mean_firing_rate=0.0005, seed=0):
+    ''' Input object set up as in make_dynamic_experiments.
+    '''
+    input_bayes = Input()
+    input_bayes.dt = 1./sampling_rate
+    input_bayes.T = duration
+    input_bayes.kernel = 'exponential'
+    input_bayes.kerneltau = 5
+    input_bayes.ron = 1./(tau*(1+factor_ron_roff))
+    input_bayes.roff = factor_ron_roff*input_bayes.ron
+    input_bayes.seed = seed
+    input_bayes.xseed = seed
+    stdq = np.sqrt(1/8)*mean_firing_rate
+    [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff_balanced(N, mean_firing_rate, stdq, seed)
+    input_bayes.get_all()
+    return input_bayes
+
+
+class HiddenState:
+    params = [DURATIONS, SAMPLING_RATES]
+    param_names = ['duration', 'sampling_rate']
+
+    def setup(self, duration, sampling_rate):
+        check_size(duration*sampling_rate)
+        self.input_bayes = make_input(duration, sampling_rate, 1)
+
+    def time_markov_hiddenstate(self, duration, sampling_rate):
+        self.input_bayes.markov_hiddenstate()
+
+    def peakmem_markov_hiddenstate(self, duration, sampling_rate):
+        self.input_bayes.markov_hiddenstate()
+
+
+class ANNInput:
+    params = [DURATIONS, N_NEURONS, SAMPLING_RATES]
+    param_names = ['duration', 'N', 'sampling_rate']
+
+    def setup(self, duration, N, sampling_rate):
+        check_size(duration*sampling_rate*N)
+        self.input_bayes = make_input(duration, sampling_rate, N)
+        self.input_bayes.x = synthetic_hidden_state(duration, sampling_rate, n_samples=self.input_bayes.length)
+        self.g0_exc, self.g0_inh = get_g0(-65, self.input_bayes.w, 0, -75)
+
+    def time_markov_input_current(self, duration, N, sampling_rate):
+        self.input_bayes.markov_input()
+
+    def time_markov_input_dynamic(self, duration, N, sampling_rate):
+        self.input_bayes.markov_input(self.g0_exc)
+        self.input_bayes.markov_input(self.g0_inh)
+
+    def peakmem_markov_input_current(self, duration, N, sampling_rate):
+        self.input_bayes.markov_input()
+
+    def time_get_g0(self, duration, N, sampling_rate):
+        get_g0(-65, self.input_bayes.w, 0, -75)
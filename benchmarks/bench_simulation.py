@@ -0,0 +1,104 @@
+''' bench_simulation.py
+
+    Benchmarks of the input scaling and the simulation of the model neurons in both clamp types.
+'''
+import numpy as np
+from common import check_size, synthetic_hidden_state, synthetic_input, DURATIONS, SAMPLING_RATES, SIMULATION_COST
+from code.foundations.helpers import scale_input_theory, ScaledInput
+from code.models.models import Barrel_PC, Barrel_IN, run_native
+from code.models.native import TABLE_DV
+
+SCALES = np.arange(2.5, 27.5, 2.5)
+
+
+class Scaling:
+    params = [DURATIONS, SAMPLING_RATES]
+    param_names = ['duration', 'sampling_rate']
+
+    def setup(self, duration, sampling_rate):
+        check_size(duration*sampling_rate)
+        self.dt = 1./sampling_rate
+        hidden_state = synthetic_hidden_state(duration, sampling_rate)
+        self.input_theory = synthetic_input(hidden_state)
+        self.dynamic_theory = (abs(self.input_theory), abs(synthetic_input(hidden_state, seed=1)))
+
+    def time_scale_input_theory_current(self, duration, sampling_rate):
+        for scale in SCALES:
+            scale_input_theory(self.input_theory, 'current', 0, scale, self.dt)
+
+    def time_scale_input_theory_dynamic(self, duration, sampling_rate):
+        for scale in SCALES:
+            scale_input_theory(self.dynamic_theory, 'dynamic', 0, scale, self.dt)
+
+    def time_scaled_input_dynamic(self, duration, sampling_rate):
+        base_input = ScaledInput(self.dynamic_theory, 'dynamic', self.dt)
+        for scale in SCALES:
+            base_input.with_scale(scale).get_timed_arrays()
+
+    def peakmem_scale_input_theory_dynamic(self, duration, sampling_rate):
+        scale_input_theory(self.dynamic_theory, 'dynamic', 0, SCALES[0], self.dt)
+
+
+class Simulation:
+    params = [['PC', 'IN'], ['current', 'dynamic'], DURATIONS]
+    param_names = ['model', 'clamp_type', 'duration']
+    sampling_rate = 5
+    scales = {'current':10., 'dynamic':10.}
+
+    def setup(self, model, clamp_type, duration):
+        check_size(duration*self.sampling_rate, SIMULATION_COST)
+        dt = 1./self.sampling_rate
+        hidden_state = synthetic_hidden_state(duration, self.sampling_rate)
+        if clamp_type == 'current':
+            input_theory = synthetic_input(hidden_state)
+        else:
+            input_theory = (abs(synthetic_input(hidden_state))*1e-3, abs(synthetic_input(hidden_state, seed=1))*1e-3)
+        self.inj_input = ScaledInput(input_theory, clamp_type, dt, self.scales[clamp_type])
+
+        model_class = Barrel_PC if model == 'PC' else Barrel_IN
+        self.neuron = model_class(clamp_type, dt=dt)
+        self.neuron.store()
+
+        # Generate and compile the code before timing
+        self.neuron.run(self.inj_input, 10, 0)
+
+    def time_run(self, model, clamp_type, duration):
+        self.neuron.restore()
+        self.neuron.run(self.inj_input, duration, 0)
+
+    def peakmem_run(self, model, clamp_type, duration):
+        self.neuron.restore()
+        self.neuron.run(self.inj_input, duration, 0)
+
+
+class NativeSimulation:
+    ''' The native engine with analytic (tabulate None) and tabulated gating rates, for one neuron
+        and for a batch of scales of one neuron as scale_to_freq runs.
+    '''
+    params = [['PC', 'IN'], ['current', 'dynamic'], DURATIONS, [None, TABLE_DV]]
+    param_names = ['model', 'clamp_type', 'duration', 'tabulate']
+    sampling_rate = 5
+    scales = {'current':10., 'dynamic':10.}
+
+    def setup(self, model, clamp_type, duration, tabulate):
+        check_size(duration*self.sampling_rate, SIMULATION_COST)
+        dt = 1./self.sampling_rate
+        hidden_state = synthetic_hidden_state(duration, self.sampling_rate)
+        if clamp_type == 'current':
+            input_theory = synthetic_input(hidden_state)
+        else:
+            input_theory = (abs(synthetic_input(hidden_state))*1e-3, abs(synthetic_input(hidden_state, seed=1))*1e-3)
+        self.inj_input = ScaledInput(input_theory, clamp_type, dt, self.scales[clamp_type])
+
+        model_class = Barrel_PC if model == 'PC' else Barrel_IN
+        self.neuron = model_class(clamp_type, dt=dt, engine='native', tabulate=tabulate)
+
+        # Compile the kernels before timing
+        self.neuron.run(self.inj_input, 10, 0)
+        run_native(self.neuron, self.inj_input, 10, 0, scales=SCALES)
+
+    def time_run(self, model, clamp_type, duration, tabulate):
+        self.neuron.run(self.inj_input, duration, 0)
+
+    def time_run_scales(self, model, clamp_type, duration, tabulate):
+        run_native(self.neuron, self.inj_input, duration, 0, scales=SCALES)
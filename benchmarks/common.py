@@ -0,0 +1,74 @@
+''' common.py
+
+    Shared setup of the benchmarks: makes the code importable, limits the problem size and
+    generates synthetic stimuli and spike trains so that the analysis benchmarks don't depend
+    on the simulations.
+'''
+import os,sys
+repo_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, repo_dir)
+
+import numpy as np
+
+# Largest number of time steps (times the number of ANN neurons for input generation) that is run,
+# larger parameter combinations are skipped. Set BENCH_MAX_SIZE to run the full grid.
+MAX_SIZE = float(os.environ.get('BENCH_MAX_SIZE', 2e7))
+
+# Parameter grids, durations in ms and sampling rates in kHz
+DURATIONS = [1000, 10000, 100000, 1000000]
+N_NEURONS = [100, 1000, 10000]
+SAMPLING_RATES = [5, 20, 50]
+
+# A simulated time step loops over the model equations in Python or generated code, which costs
+# far more than an element of a vectorized array operation. With the default MAX_SIZE the
+# simulations run up to 100 s at 5 kHz
+SIMULATION_COST = 20
+
+
+def check_size(size, cost=1):
+    ''' Skip a parameter combination that is larger than MAX_SIZE (asv convention).
+
+        INPUT
+        size (float): number of time steps, times the number of ANN neurons for input generation
+        cost (float): cost of one unit of size relative to one element of a vectorized array
+                      operation, e.g. SIMULATION_COST for a simulated time step
+    '''
+    if size*cost > MAX_SIZE:
+        raise NotImplementedError('Larger than BENCH_MAX_SIZE')
+
+
+def synthetic_hidden_state(duration, sampling_rate, tau=50, factor_ron_roff=2, seed=0, n_samples=None):
+    ''' Hidden state with the statistics of Input.markov_hiddenstate, generated from exponentially
+        distributed ON and OFF durations without a loop over time steps.
+    '''
+    rng = np.random.default_rng(seed)
+    dt = 1./sampling_rate
+    if n_samples is None:
+        n_samples = int(round(duration/dt))
+    ron = 1./(tau*(1+factor_ron_roff))
+    roff = factor_ron_roff*ron
+
+    # Alternating OFF and ON blocks until the duration is covered
+    n_blocks = int(2*duration*(ron+roff)) + 10
+    mean_durations = np.tile([1./ron, 1./roff], n_blocks//2 + 1)[:n_blocks]
+    lengths = np.maximum(1, np.round(rng.exponential(mean_durations)/dt)).astype(int)
+    states = np.tile([0., 1.], n_blocks//2 + 1)[:n_blocks]
+    hidden_state = np.repeat(states, lengths)
+    while len(hidden_state) < n_samples:
+        hidden_state = np.concatenate([hidden_state, hidden_state])
+    return hidden_state[:n_samples]
+
+
+def synthetic_spiketrain(hidden_state, dt, rate_on=0.01, rate_off=0.002, seed=0):
+    ''' Binary (1, n) spiketrain with a higher firing rate (kHz) during the ON state.
+    '''
+    rng = np.random.default_rng(seed)
+    rate = np.where(hidden_state == 1, rate_on, rate_off)
+    return (rng.random(len(hidden_state)) < rate*dt).astype(int)[np.newaxis, :]
+
+
+def synthetic_input(hidden_state, seed=0):
+    ''' Input theory that is larger during the ON state.
+    '''
+    rng = np.random.default_rng(seed)
+    return 0.5*hidden_state + 0.1*rng.standard_normal(len(hidden_state))
@@ -0,0 +1,178 @@
+''' run.py
+
+    Runs the benchmarks in this folder and writes the results to a JSON file. The benchmarks follow
+    the asv conventions: classes with params/param_names, a setup that raises NotImplementedError to
+    skip a parameter combination, time_* methods that are timed, peakmem_* methods of which the
+    peak memory (of allocations traced by tracemalloc) is measured and track_* methods of which the
+    returned value is recorded, in the unit given by their unit attribute.
+
+    Usage:
+    python benchmarks/run.py                      # all benchmarks up to BENCH_MAX_SIZE
+    python benchmarks/run.py --quick              # smallest parameter combination only
+    python benchmarks/run.py -b MutualInformation # benchmarks matching a regular expression
+    python benchmarks/run.py --compare old.json   # compare with earlier results
+'''
+import os,sys
+bench_dir = os.path.dirname(os.path.abspath(__file__))
+repo_dir = os.path.dirname(bench_dir)
+sys.path.insert(0, bench_dir)
+
+import re
+import gc
+import json
+import time
+import inspect
+import argparse
+import platform
+import itertools
+import importlib
+import subprocess
+import statistics
+import tracemalloc
+
+
+def discover(pattern=None):
+    ''' Find the benchmark methods in the bench_*.py files.
+
+        INPUT
+        pattern (str): regular expression that the name of the benchmark has to match
+
+        OUTPUT
+        benchmarks (list): (name, class, method name) of every benchmark
+    '''
+    benchmarks = []
+    for file_name in sorted(os.listdir(bench_dir)):
+        if not (file_name.startswith('bench_') and file_name.endswith('.py')):
+            continue
+        module_name = file_name[:-3]
+        try:
+            module = importlib.import_module(module_name)
+        except ImportError as error:
+            print('Skipping %s: %s' % (module_name, error))
+            continue
+
+        for class_name, cls in inspect.getmembers(module, inspect.isclass):
+            if cls.__module__ != module_name:
+                continue
+            for method_name in sorted(dir(cls)):
+                if not method_name.startswith(('time_', 'peakmem_', 'track_')):
+                    continue
+                name = '%s.%s.%s' % (module_name, class_name, method_name)
+                if pattern is None or re.search(pattern, name):
+                    benchmarks.append((name, cls, method_name))
+    return benchmarks
+
+
+def get_param_combinations(cls, quick=False):
+    params = getattr(cls, 'params', [])
+    param_names = getattr(cls, 'param_names', [])
+    if params and not isinstance(params[0], (list, tuple)):
+        params = [params]
+    if quick:
+        params = [values[:1] for values in params]
+    for combination in itertools.product(*params):
+        yield dict(zip(param_names, combination)), combination
+
+
+def measure(cls, method_name, combination, repeat):
+    ''' Run one benchmark for one parameter combination.
+
+        OUTPUT
+        result (dict or None): measured value and unit, None when the combination is skipped
+    '''
+    instance = cls()
+    try:
+        if hasattr(instance, 'setup'):
+            instance.setup(*combination)
+    except NotImplementedError:
+        return None
+    method = getattr(instance, method_name)
+
+    try:
+        if method_name.startswith('time_'):
+            times = []
+            for _ in range(repeat):
+                gc.collect()
+                start = time.perf_counter()
+                method(*combination)
+                times.append(time.perf_counter() - start)
+            result = {'value':min(times), 'median':statistics.median(times), 'unit':'s'}
+        elif method_name.startswith('track_'):
+            result = {'value':method(*combination), 'unit':getattr(method, 'unit', '')}
+        else:
+            gc.collect()
+            tracemalloc.start()
+            method(*combination)
+            peak = tracemalloc.get_traced_memory()[1]
+            tracemalloc.stop()
+            result = {'value':peak/1024**2, 'unit':'MB'}
+    finally:
+        if hasattr(instance, 'teardown'):
+            instance.teardown(*combination)
+    return result
+
+
+def get_machine_info():
+    try:
+        commit = subprocess.check_output(['git', 'rev-parse', 'HEAD'], cwd=repo_dir, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {'commit':commit, 'python':platform.python_version(), 'machine':platform.machine(),
+            'processor':platform.processor(), 'system':platform.platform(), 'cpu_count':os.cpu_count()}
+
+
+def load_results(path):
+    with open(path) as f:
+        return {(entry['benchmark'], json.dumps(entry['params'], sort_keys=True)):entry
+                for entry in json.load(f)['results']}
+
+
+def compare(results, old, threshold=1.1):
+    ''' Print the ratio of new to old values of benchmarks that were run in both.
+    '''
+    print('\n%-70s %12s %12s %8s' % ('benchmark', 'old', 'new', 'ratio'))
+    for entry in results:
+        key = (entry['benchmark'], json.dumps(entry['params'], sort_keys=True))
+        if key not in old or not old[key]['value']:
+            continue
+        ratio = entry['value'] / old[key]['value']
+        flag = ' slower' if ratio > threshold else (' faster' if ratio < 1/threshold else '')
+        print('%-70s %12.4g %12.4g %8.2f%s' % (key[0] + str(entry['params']), old[key]['value'],
+                                                entry['value'], ratio, flag))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Run the benchmarks')
+    parser.add_argument('-b', '--bench', default=None, help='regular expression selecting benchmarks')
+    parser.add_argument('--quick', action='store_true', help='only run the smallest parameter combination')
+    parser.add_argument('--repeat', type=int, default=3, help='number of repeats of time benchmarks')
+    parser.add_argument('-o', '--output', default=os.path.join(bench_dir, 'results', 'results.json'))
+    parser.add_argument('--compare', default=None, help='earlier results file to compare with')
+    args = parser.parse_args()
+
+    # Read the earlier results before they can be overwritten
+    old = load_results(args.compare) if args.compare else None
+
+    # The models load their parameters relative to the repository
+    os.chdir(repo_dir)
+
+    results = []
+    for name, cls, method_name in discover(args.bench):
+        for params, combination in get_param_combinations(cls, args.quick):
+            result = measure(cls, method_name, combination, args.repeat)
+            if result is None:
+                continue
+            result.update(benchmark=name, params=params)
+            results.append(result)
+            print('%-70s %-40s %10.4g %s' % (name, params, result['value'], result['unit']))
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump({'machine':get_machine_info(), 'results':results}, f, indent=1, default=str)
+
+    if old is not None:
+        compare(results, old)
+
+
+if __name__ == '__main__':
+    main()
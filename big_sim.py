@@ -1,126 +1,135 @@
 ''' big_sim.py
+
+    Simulation campaign of the Pyramidal Cell and the Interneuron in current and dynamic clamp.
+    The stimulus of every (cell, run, seed) and the simulation of every (cell, clamp type, run, seed)
+    is a task of the campaign in results/big_sim. Every result is stored as soon as its task is
+    finished, so a campaign that is stopped continues with the missing tasks when it is started again.
 '''
 
-import os,sys,inspect
-current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-parent_dir = os.path.dirname(current_dir)
-sys.path.insert(0, parent_dir)
+import os,sys
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, repo_dir)
 
-from code.foundations.helpers import scale_input_theory
+from code.foundations.helpers import ScaledInput
 from brian2 import clear_cache, uA, mV, ms
-from code.models.models import Barrel_PC, Barrel_IN
+from code.models.models import Barrel_PC, Barrel_IN, run_checkpointed
 from code.foundations.helpers import scale_to_freq
 from code.foundations.make_dynamic_experiments import make_dynamic_experiments
+from code.foundations.calibration import CalibrationCache
+from code.foundations.campaign import Campaign
 import numpy as np
-import pandas as pd
 
 # Set Parameters
-baseline = 0  
-theta = 0     
-factor_ron_roff = 2    
-tau_PC = 250
-ron_PC = 1./(tau_PC*(1+factor_ron_roff))
-roff_PC = factor_ron_roff*ron_PC
-mean_firing_rate_PC = (0.1)/1000  
-duration_PC = 100000
-tau_IN = 50               
-ron_IN = 1./(tau_IN*(1+factor_ron_roff))
-roff_IN = factor_ron_roff*ron_IN
-mean_firing_rate_IN = (0.5)/1000
-duration_IN = 20000 
-sampling_rate = 5      
-dt = 1/sampling_rate 
+baseline = 0
+theta = 0
+factor_ron_roff = 2
+sampling_rate = 5
+dt = 1/sampling_rate
 qon_qoff_type = 'balanced'
 Er_exc, Er_inh = (0, -75)
-target_PC = 1.4233
-target_IN = 6.6397
 on_off_ratio = 1.5
 scale_list = np.append([1], np.arange(2.5, 302.5, 2.5))
-scales = {'CC_PC':19, 'DC_PC':30, 'CC_IN':17, 'DC_IN':6}
+calibrate = False   # Find the scales with scale_to_freq instead of using the scales below
+calibration_cache = CalibrationCache('calibration_cache.json')
 N_runs = 1
-
-print('Starting Simulation...')
-# Initiate Pyramidal cell models
-PC_i = 35
-current_PC = Barrel_PC('current', dt=dt)
-dynamic_PC = Barrel_PC('dynamic', dt=dt)
-current_PC.store()
-dynamic_PC.store()
-
-# Create results DataFrame
-vars_to_track = ['input_theory', 'dynamic_theory', 'hidden_state',
-                 'inj_current', 'current_volt', 'current_spikes',
-                 'inj_dynamic', 'dynamic_volt', 'dynamic_spikes', 'dynamic_g']
-results_PC = pd.DataFrame(columns=vars_to_track)
-
-# Pyramidal Cell simulation
-for _ in range(N_runs):
-    # Make input theory and hidden state for Pyramidal Cell
-    [input_theory, dynamic_theory, hidden_state] = make_dynamic_experiments(qon_qoff_type, baseline, tau_PC, factor_ron_roff, mean_firing_rate_PC, sampling_rate, duration_PC)
+seed = 0                    # Run r uses seed + r
+checkpoint_interval = None  # Snapshot the simulations every this many ms, None to run them at once
+cells = {'PC':{'model':Barrel_PC, 'Ni':35, 'tau':250, 'mean_firing_rate':(0.1)/1000, 'duration':100000,
+               'target':1.4233, 'scales':{'current':19, 'dynamic':30}},
+         'IN':{'model':Barrel_IN, 'Ni':11, 'tau':50, 'mean_firing_rate':(0.5)/1000, 'duration':20000,
+               'target':6.6397, 'scales':{'current':17, 'dynamic':6}}}
+campaign = Campaign('results/big_sim')
+
+
+def make_stimulus(cell, run_seed):
+    ''' Make the input theory and hidden state of a run.
+    '''
+    setup = cells[cell]
+    input_theory, (g_exc, g_inh), hidden_state = make_dynamic_experiments(qon_qoff_type, baseline, setup['tau'], factor_ron_roff,
+                                                                          setup['mean_firing_rate'], sampling_rate,
+                                                                          setup['duration'], run_seed)
+    return {'input_theory':input_theory, 'g_exc':g_exc, 'g_inh':g_inh, 'hidden_state':hidden_state}, {'dt':dt}
+
+
+def simulate(neuron, cell, clamp_type, stimulus_id, task_id):
+    ''' Scale the input of a run and simulate the neuron. The arrays are named as the plotter reads
+        them, the hidden state stays in the stimulus run that the meta data refers to.
+    '''
+    setup = cells[cell]
+    meta = {'clamp_type':clamp_type, 'dt':dt, 'stimulus':stimulus_id}
+    stimulus = {name:campaign.store.load(stimulus_id, name) for name in campaign.store.names(stimulus_id)}
+    hidden_state = stimulus['hidden_state']
+    if clamp_type == 'current':
+        input_theory = stimulus['input_theory']
+    else:
+        input_theory = (stimulus['g_exc'], stimulus['g_inh'])
 
     # Scale input
-    inj_current = scale_input_theory(input_theory, 'current', 0, scales['CC_PC'], dt)
-    inj_dynamic = scale_input_theory(dynamic_theory, 'dynamic', 0, scales['DC_PC'], dt)
-  
-    # Run Pyramidal Cell
-    current_PC.restore()
-    dynamic_PC.restore()
-    current_PC_M, current_PC_S = current_PC.run(inj_current, duration_PC, PC_i)
-    dynamic_PC_M, dynamic_PC_S = dynamic_PC.run(inj_dynamic, duration_PC, PC_i)
-
-    # Store results       
-    data = np.array([input_theory, dynamic_theory, hidden_state,
-                    current_PC_M.I_inj[0]/uA, current_PC_M.v[0]/mV, current_PC_S.t/ms,
-                    dynamic_PC_M.I_inj[0]/uA, dynamic_PC_M.v[0]/mV, dynamic_PC_S.t/ms, (inj_dynamic[0].values, inj_dynamic[1].values)], dtype=list)
-    data = pd.DataFrame(data=data, index=vars_to_track).T
-    results_PC = results_PC.append(data, ignore_index=True)
-
-# Keep it clean
-try:
-    clear_cache('cython')
-except:
-    pass
-
-# Initiate Interneuron models
-IN_i = 11
-current_IN = Barrel_IN('current', dt=dt)
-dynamic_IN = Barrel_PC('dynamic', dt=dt)
-current_IN.store()
-dynamic_IN.store()
-
-# Create results DataFrame
-results_IN = pd.DataFrame(columns=vars_to_track)
-
-# Interneuron simulation
-for _ in range(N_runs):
-    # Make iput theory and hidden state for interneurons
-    [input_theory, dynamic_theory, hidden_state] = make_dynamic_experiments(qon_qoff_type, baseline, tau_IN, factor_ron_roff, mean_firing_rate_IN, sampling_rate, duration_IN)
-
-    # Scale input
-    inj_current = scale_input_theory(input_theory, 'current', 0, scales['CC_IN'], dt)
-    inj_dynamic= scale_input_theory(dynamic_theory, 'dynamic', 0, scales['DC_IN'], dt)
-
-    # Run Interneurons 
-    current_IN.restore()
-    dynamic_IN.restore()
-    current_IN_M, current_IN_S = current_IN.run(inj_current, duration_IN, IN_i)
-    dynamic_IN_M, dynamic_IN_S = dynamic_IN.run(inj_dynamic, duration_IN, IN_i)
-
-    # Store results       
-    data = np.array([input_theory, dynamic_theory, hidden_state,
-                    current_IN_M.I_inj[0]/uA, current_IN_M.v[0]/mV, current_IN_S.t/ms,
-                    dynamic_IN_M.I_inj[0]/uA, dynamic_IN_M.v[0]/mV, dynamic_IN_S.t/ms, (inj_dynamic[0].values, inj_dynamic[1].values)], dtype=list)
-    data = pd.DataFrame(data=data, index=vars_to_track).T
-    results_IN = results_IN.append(data, ignore_index=True)
-
-# Save data
-# results_PC.to_pickle('results/results_PC.pkl')
-# results_IN.to_pickle('results/results_IN.pkl')
-
-# Clean cache
-try:
-    clear_cache('cython')
-except:
-    pass
+    if calibrate:
+        inj_input = scale_to_freq(neuron, input_theory, setup['target'], on_off_ratio, clamp_type, setup['duration'],
+                                  hidden_state, scale_list, dt, setup['Ni'], cache=calibration_cache)
+        if inj_input is False:
+            print('No scale meets the ON/all ratio, skipping run')
+            return {}, dict(meta, accepted=False)
+    else:
+        inj_input = ScaledInput(input_theory, clamp_type, dt, setup['scales'][clamp_type])
+
+    # Run
+    neuron.restore()
+    if checkpoint_interval is None:
+        M, S = neuron.run(inj_input, setup['duration'], setup['Ni'])
+    else:
+        M, S = run_checkpointed(neuron, inj_input, setup['duration'], setup['Ni'],
+                                os.path.join(campaign.root, task_id + '.checkpoint'), checkpoint_interval)
+
+    if clamp_type == 'current':
+        arrays = {'inj_current':M.I_inj[0]/uA, 'current_volt':M.v[0]/mV, 'current_spikes':S.t/ms}
+    else:
+        g_exc, g_inh = inj_input.scaled_values()
+        arrays = {'inj_dynamic':M.I_inj[0]/uA, 'dynamic_volt':M.v[0]/mV, 'dynamic_spikes':S.t/ms,
+                  'g_exc':g_exc, 'g_inh':g_inh}
+    return arrays, dict(meta, accepted=True, scale=inj_input.scale)
+
+
+# Register the tasks, the stimulus of a run comes before its simulations
+for cell in cells:
+    for run in range(N_runs):
+        run_seed = seed + run
+        stimulus_id = campaign.add('%s_run%d_seed%d_stimulus' % (cell, run, run_seed),
+                                   {'cell':cell, 'run':run, 'seed':run_seed})
+        for clamp_type in ['current', 'dynamic']:
+            campaign.add('%s_run%d_seed%d_%s' % (cell, run, run_seed, clamp_type),
+                         {'cell':cell, 'clamp_type':clamp_type, 'run':run, 'seed':run_seed, 'stimulus':stimulus_id})
+print('Tasks:', campaign.summary())
 
+print('Starting Simulation...')
+for cell, setup in cells.items():
+    pending = [task_id for task_id in campaign.pending() if campaign.params(task_id)['cell'] == cell]
+    if not pending:
+        continue
+
+    # Initiate the models of the cell
+    neurons = {}
+    for clamp_type in ['current', 'dynamic']:
+        neurons[clamp_type] = setup['model'](clamp_type, dt=dt)
+        neurons[clamp_type].store()
+
+    for task_id in pending:
+        params = campaign.params(task_id)
+        if 'clamp_type' not in params:
+            campaign.run(task_id, make_stimulus, cell, params['seed'])
+        elif campaign.is_done(params['stimulus']):
+            neuron = neurons[params['clamp_type']]
+            if campaign.run(task_id, simulate, neuron, cell, params['clamp_type'], params['stimulus'], task_id):
+                checkpoint = os.path.join(campaign.root, task_id + '.checkpoint')
+                if os.path.exists(checkpoint):
+                    os.remove(checkpoint)
+
+    # Keep it clean
+    try:
+        clear_cache('cython')
+    except:
+        pass
+
+print('Tasks:', campaign.summary())
 print('Simulation Completed!')
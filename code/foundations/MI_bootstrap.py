@@ -0,0 +1,207 @@
+''' MI_bootstrap.py
+    File containing the uncertainty estimates of the mutual information (MI) between the hidden state and
+    the input or output spike train, computed from the log-likelihood L of a finished analysis.
+
+    Confidence intervals come from a block bootstrap: the hidden state is cut into its blocks of
+    constant state and whole blocks are resampled with replacement, which keeps the dependence
+    between the samples within a block. The entropy terms are summed per block once, so a resample
+    only sums block totals. The bias of the estimator is estimated by circularly shifting the hidden
+    state with respect to L, which keeps the statistics of both but destroys their relation.
+    Resamples are computed in a pool of threads or processes, processes read the large arrays
+    from shared memory.
+'''
+import os
+import functools
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import numpy as np
+from .helpers import get_state_blocks
+from .MI_calculation import log_sigmoid, binary_entropy
+from . import precision
+from .shared_arrays import SharedArrays, call_resolved
+
+# Number of bootstrap resamples per random stream
+RESAMPLE_CHUNK = 50
+
+
+def get_entropy_terms(L):
+    ''' Conditional entropy of every sample in bits, when the hidden state is 1 and when it is 0.
+        Computed with log-sigmoids, so saturated L doesn't give log2(0).
+
+        INPUT
+        L (array): log-likelihood of the hidden state being 1
+
+        OUTPUT
+        h_on, h_off (array, array): -log2 p(x=1|L) and -log2 p(x=0|L)
+    '''
+    L = np.asarray(L, dtype=precision.ACCUMULATE).ravel()
+    h_on = -log_sigmoid(L) / np.log(2)
+    h_off = -log_sigmoid(-L) / np.log(2)
+    return h_on, h_off
+
+
+def get_block_sums(Ls, x):
+    ''' Sums the conditional entropy of one or more L traces per block of constant hidden state.
+
+        INPUT
+        Ls (array or list of array): log-likelihood traces of the same hidden state
+        x (array): binary array representing the hidden state
+
+        OUTPUT
+        lengths, on (array, array): number of samples and number of ON samples per block
+        Hxy_sums (array): summed conditional entropy in bits, (number of traces, number of blocks)
+    '''
+    x = np.asarray(x).ravel()
+    Ls = np.atleast_2d(np.asarray(Ls, dtype=precision.ACCUMULATE))
+    if Ls.shape[1] != len(x):
+        raise AssertionError('L and hidden state don\'t correspond')
+
+    starts, stops, states = get_state_blocks(x)
+    lengths = stops - starts
+    on = np.where(states == 1, lengths, 0)
+
+    Hxy_sums = np.empty((len(Ls), len(starts)))
+    for idx, L in enumerate(Ls):
+        h_on, h_off = get_entropy_terms(L)
+        Hxy_sums[idx] = np.add.reduceat(np.where(x == 1, h_on, h_off), starts)
+    return lengths, on, Hxy_sums
+
+
+def bootstrap_MI(Ls, x, n_resamples=1000, seed=None, n_workers=None, executor='thread'):
+    ''' Block bootstrap of the MI. Every trace is resampled with the same blocks, so the
+        resamples of traces of the same hidden state (e.g. current and dynamic clamp) are paired.
+
+        INPUT
+        Ls (array or list of array): log-likelihood traces of the same hidden state
+        x (array): binary array representing the hidden state
+        n_resamples (int): number of bootstrap resamples
+        seed (int): seed of the random number generator, the resamples don't depend on n_workers
+        n_workers (int): number of threads or processes, defaults to the number of CPUs
+        executor (str): 'thread' or 'process'
+
+        OUTPUT
+        MI (array): MI of every resample and trace in bits, (n_resamples, number of traces)
+    '''
+    lengths, on, Hxy_sums = get_block_sums(Ls, x)
+    tasks = _split(n_resamples, seed)
+    results = _map(_resample_blocks, [(lengths, on, Hxy_sums, n, task_seed) for n, task_seed in tasks],
+                   n_workers, executor)
+    return np.concatenate(results)
+
+
+def shuffle_MI(Ls, x, n_shuffles=100, min_shift=None, seed=None, n_workers=None, executor='thread'):
+    ''' MI of the traces with circularly shifted hidden states, its mean estimates the bias of the MI.
+
+        INPUT
+        Ls (array or list of array): log-likelihood traces of the same hidden state
+        x (array): binary array representing the hidden state
+        n_shuffles (int): number of shifts
+        min_shift (int): smallest shift in samples, defaults to the longest block of the hidden state
+        seed (int): seed of the random number generator
+        n_workers (int): number of threads or processes, defaults to the number of CPUs
+        executor (str): 'thread' or 'process'
+
+        OUTPUT
+        MI (array): MI of every shift and trace in bits, (n_shuffles, number of traces)
+    '''
+    x = np.asarray(x, dtype=precision.ACCUMULATE).ravel()
+    Ls = np.atleast_2d(np.asarray(Ls, dtype=precision.ACCUMULATE))
+    if min_shift is None:
+        starts, stops, _ = get_state_blocks(x)
+        min_shift = int(np.max(stops - starts))
+    if 2*min_shift >= len(x):
+        raise ValueError('Hidden state too short for shifts of at least %d samples' % min_shift)
+
+    # Hxy of a shifted x is sum(h_off) + sum(x_shifted * (h_on - h_off))
+    h_off_sums = np.empty(len(Ls))
+    h_diffs = np.empty(Ls.shape)
+    for idx, L in enumerate(Ls):
+        h_on, h_off = get_entropy_terms(L)
+        h_off_sums[idx] = np.sum(h_off)
+        h_diffs[idx] = h_on - h_off
+    Hxx = binary_entropy(np.mean(x))
+
+    rng = np.random.default_rng(seed)
+    shifts = rng.integers(min_shift, len(x) - min_shift, n_shuffles, endpoint=True)
+    args = [(x, h_off_sums, h_diffs, Hxx, task_shifts)
+            for task_shifts in np.array_split(shifts, min(n_shuffles, _n_workers(n_workers)))]
+    return np.concatenate(_map(_shifted_MI, args, n_workers, executor))
+
+
+def MI_confidence(Ls, x, alpha=0.05, n_resamples=1000, n_shuffles=100, seed=None, n_workers=None, executor='thread'):
+    ''' Point estimate, bias corrected estimate and confidence interval of the MI.
+
+        INPUT
+        Ls (array or list of array): log-likelihood traces of the same hidden state, e.g. L_i and L
+                                     of analyze_exp or L of a current and a dynamic clamp run
+        x (array): binary array representing the hidden state
+        alpha (float): the confidence interval covers 1-alpha
+        n_resamples, n_shuffles (int): see bootstrap_MI and shuffle_MI
+        seed (int): seed of the random number generator
+        n_workers (int): number of threads or processes, defaults to the number of CPUs
+        executor (str): 'thread' or 'process'
+
+        OUTPUT
+        Output-dictionary with an array (one value per trace) for the keys:
+        MI          : MI of the whole recording in bits, as MI_est
+        bias        : mean MI of the shifted hidden states
+        MI_corrected: MI - bias
+        std         : standard deviation of the bootstrap MI
+        ci_low, ci_high: bias corrected percentile confidence interval
+        difference, difference_ci: MI of every trace minus the first trace and its confidence interval
+    '''
+    lengths, on, Hxy_sums = get_block_sums(Ls, x)
+    MI = binary_entropy(np.sum(on)/np.sum(lengths)) - np.sum(Hxy_sums, axis=1)/np.sum(lengths)
+
+    resamples = bootstrap_MI(Ls, x, n_resamples, seed, n_workers, executor)
+    seed_shuffle = None if seed is None else seed + 1
+    bias = np.mean(shuffle_MI(Ls, x, n_shuffles, None, seed_shuffle, n_workers, executor), axis=0)
+
+    percentiles = [100*alpha/2, 100*(1 - alpha/2)]
+    ci_low, ci_high = np.percentile(resamples - bias, percentiles, axis=0)
+    differences = resamples - resamples[:, [0]]
+    return {'MI':MI, 'bias':bias, 'MI_corrected':MI - bias, 'std':np.std(resamples, axis=0),
+            'ci_low':ci_low, 'ci_high':ci_high, 'difference':MI - MI[0],
+            'difference_ci':np.percentile(differences, percentiles, axis=0)}
+
+
+def _resample_blocks(lengths, on, Hxy_sums, n_resamples, seed):
+    rng = np.random.default_rng(seed)
+    n_blocks = len(lengths)
+    MI = np.empty((n_resamples, len(Hxy_sums)))
+    for idx in range(n_resamples):
+        blocks = rng.integers(0, n_blocks, n_blocks)
+        n_samples = np.sum(lengths[blocks])
+        MI[idx] = binary_entropy(np.sum(on[blocks])/n_samples) - np.sum(Hxy_sums[:, blocks], axis=1)/n_samples
+    return MI
+
+
+def _shifted_MI(x, h_off_sums, h_diffs, Hxx, shifts):
+    MI = np.empty((len(shifts), len(h_off_sums)))
+    for idx, shift in enumerate(shifts):
+        MI[idx] = Hxx - (h_off_sums + h_diffs @ np.roll(x, shift)) / len(x)
+    return MI
+
+
+def _n_workers(n_workers):
+    return n_workers if n_workers is not None else os.cpu_count()
+
+
+def _split(n, seed):
+    # Tasks of RESAMPLE_CHUNK resamples, every task with its own independent random stream. The tasks
+    # don't depend on the number of workers, so a seed gives the same resamples on every machine
+    sizes = [min(RESAMPLE_CHUNK, n - start) for start in range(0, max(n, 1), RESAMPLE_CHUNK)]
+    return list(zip(sizes, np.random.SeedSequence(seed).spawn(len(sizes))))
+
+
+def _map(func, args, n_workers, executor):
+    if _n_workers(n_workers) == 1 or len(args) == 1:
+        return [func(*arg) for arg in args]
+    if executor == 'thread':
+        with ThreadPoolExecutor(n_workers) as pool:
+            return list(pool.map(func, *zip(*args)))
+    elif executor == 'process':
+        # The arrays that every task uses are copied to shared memory once instead of pickled per task
+        with SharedArrays() as shared, ProcessPoolExecutor(n_workers) as pool:
+            return list(pool.map(functools.partial(call_resolved, func), *zip(*shared.share(args))))
+    else:
+        raise ValueError('executor must be \'thread\' or \'process\'')
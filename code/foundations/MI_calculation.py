@@ -8,10 +8,15 @@
     Frontiers in Computational Neuroscience, 11(June), 49. doi:10.3389/FNCOM.2017.00049
     Please cite this reference when using this method.
 '''
+import math
 import numpy as np
-import pandas as pd
-from scipy import stats, integrate
+from . import profiler
+from . import precision
 
+# Number of samples per chunk of the entropy reduction
+CHUNK_SIZE = 2**16
+
+@profiler.profiled('analyze_exp')
 def analyze_exp(ron, roff, x, input_theory, dt, theta, spiketrain): 
     ''' Analyzes the the hidden state and the input that was created by the ANN to
         create the Output dictionary.
@@ -33,18 +38,24 @@ def analyze_exp(ron, roff, x, input_theory, dt, theta, spiketrain):
         qon, qoff   : spike frequency during on, off state in spike train 
         xhatspikes  : array with hidden state estimate based on spike train
         MI          : mean-squared error between hidden state and hidden state estimate based on spike train
+
+        The estimates xhat_i and xhatspikes have the dtype of the precision policy, L and the
+        sums are computed in float64.
     '''
     Output = {}
     # Input
     Hxx, Hxy, Output['MI_i'], L_i = calc_MI_input(ron, roff, input_theory, theta, x , dt)
-    Output['xhat_i'] = 1. / (1 + np.exp(-L_i))
-    Output['MSE_i'] = np.sum((x - Output['xhat_i'])**2)
+    xhat_i = 1. / (1 + np.exp(-L_i))
+    Output['MSE_i'] = np.sum((x - xhat_i)**2, dtype=precision.ACCUMULATE)
+    Output['xhat_i'] = precision.as_dtype(xhat_i)
 
     # Output
     _, _, Output['MI'], L, Output['qon'], Output['qoff'] = calc_MI_ideal(ron, roff, spiketrain, x, dt)
-    Output['xhatspikes'] = 1./(1 + np.exp(-L))
-    Output['MSE'] = np.sum((x - Output['xhatspikes'])**2)
+    xhatspikes = 1./(1 + np.exp(-L))
+    Output['MSE'] = np.sum((x - xhatspikes)**2, dtype=precision.ACCUMULATE)
+    Output['xhatspikes'] = precision.as_dtype(xhatspikes)
 
+    import pandas as pd
     return pd.DataFrame.from_dict(Output, orient='index').T
 
 
@@ -53,14 +64,18 @@ def dLdt_input(L, ron, roff, I, theta):
         hidden state being 1 based on the input history.
         Equation 10.
     '''        
-    dLdt = ron * (1. + np.exp(-L)) - roff * (1. + np.exp(L)) + I - theta
+    expL = np.exp(L)
+    dLdt = ron * (1. + 1./expL) - roff * (1. + expL) + I - theta
 
     return dLdt
 
 
 def dLdt_spikes(L, ron, roff, I, w, theta):
-    'docstring'
-    dLdt = ron * (1. + np.exp(-L)) - roff * (1. + np.exp(L)) + w*I - theta
+    ''' Differential equation calculating the posterior Log-likelihood of the
+        hidden state being 1 based on the spike train, with I the spike train divided by dt.
+    '''
+    expL = np.exp(L)
+    dLdt = ron * (1. + 1./expL) - roff * (1. + expL) + w*I - theta
 
     return dLdt
 
@@ -72,13 +87,87 @@ def p_conditional(L):
     return 1. / (1 + np.exp(-L))
 
 
-def MI_est(L, x):
+def log_sigmoid(L):
+    ''' Natural logarithm of p_conditional(L), finite for saturated L.
+    '''
+    return -np.logaddexp(0, -L)
+
+
+def binary_entropy(p):
+    ''' Entropy in bits of a binary variable that is 1 with probability p, 0 for p = 0 or 1.
+    '''
+    p = np.asarray(p, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        H = - p * np.log2(p) - (1 - p) * np.log2(1 - p)
+    return np.where((p > 0) & (p < 1), H, 0.)
+
+
+def entropy_sums(L, x, chunk_size=CHUNK_SIZE):
+    ''' Summed conditional entropy of the hidden state given L, in nats, computed in chunks with
+        reused buffers. Uses -log p(x=1|L) = log(1+exp(-L)) and -log p(x=0|L) = log(1+exp(L)),
+        so saturated L gives no log(0), and x*a + (1-x)*b = b + x*(a-b).
+
+        INPUT
+        L (array): log-likelihood of the hidden state being 1
+        x (array): hidden state
+        chunk_size (int): number of samples per chunk
+
+        OUTPUT
+        Hxy_sum, x_sum (float, float): summed conditional entropy and summed hidden state
+    '''
+    L = np.asarray(L).ravel()
+    x = np.asarray(x).ravel()
+    if len(L) != len(x):
+        raise AssertionError('L and hidden state don\'t correspond')
+
+    buf_on = np.empty(min(chunk_size, len(L)), dtype=precision.ACCUMULATE)
+    buf_off = np.empty_like(buf_on)
+    Hxy_sum = 0.
+    x_sum = 0.
+    for start in range(0, len(L), chunk_size):
+        L_chunk = L[start:start+chunk_size]
+        x_chunk = x[start:start+chunk_size]
+        h_on = buf_on[:len(L_chunk)]
+        h_off = buf_off[:len(L_chunk)]
+        np.negative(L_chunk, out=h_on)
+        np.logaddexp(0, h_on, out=h_on)
+        np.logaddexp(0, L_chunk, out=h_off)
+        Hxy_sum += np.sum(h_off)
+        np.subtract(h_on, h_off, out=h_on)
+        Hxy_sum += np.dot(x_chunk, h_on)
+        x_sum += np.sum(x_chunk, dtype=precision.ACCUMULATE)
+    return float(Hxy_sum), float(x_sum)
+
+
+def MI_est(L, x, chunk_size=CHUNK_SIZE):
     ''' Calculates the mutual information (MI) based on the entorpy of the hidden state (Hxx)
         and the conditional entropy of the hidden state given the input (Hxy).
         Equations 4, 6 & 8  
     '''
-    Hxx = - np.mean(x) * np.log2(np.mean(x)) - (1 - np.mean(x)) * np.log2(1 - np.mean(x))
-    Hxy = - np.mean(x * np.log2(p_conditional(L)) + (1 - x) * np.log2(1 - p_conditional(L)))
+    return MI_est_chunks([(L, x)], chunk_size)
+
+
+def MI_est_chunks(chunks, chunk_size=CHUNK_SIZE):
+    ''' Same as MI_est for L and x given as chunks, e.g. read from a ResultStore, so the
+        traces don't have to be in memory at once.
+
+        INPUT
+        chunks (iterable): (L_chunk, x_chunk) pairs of the same length
+        chunk_size (int): number of samples per chunk of the reduction
+
+        OUTPUT
+        Hxx, Hxy, MI (float, float, float): entropy, conditional entropy and MI in bits
+    '''
+    Hxy_sum, x_sum, n = 0., 0., 0
+    for L_chunk, x_chunk in chunks:
+        chunk_Hxy, chunk_x = entropy_sums(L_chunk, x_chunk, chunk_size)
+        Hxy_sum += chunk_Hxy
+        x_sum += chunk_x
+        n += np.size(x_chunk)
+
+    p = x_sum / n
+    Hxx = float(binary_entropy(p))
+    Hxy = Hxy_sum / (n * np.log(2))
     MI = Hxx - Hxy
 
     return Hxx, Hxy, MI
@@ -92,7 +181,7 @@ def calc_MI_input(ron, roff, I, theta, x, dt):
         Note that information is calculated in bits. For nats use log instead of log2.
     '''
     # Integrate the posterior Log-likelihood
-    L = np.empty(len(x))
+    L = np.empty(len(x), dtype=precision.ACCUMULATE)
     L[0] = np.log(ron/roff)
     for i in range(len(x) - 1):
         L[i + 1] = L[i] + dLdt_input(L[i], ron, roff, I[i], theta) * dt
@@ -108,38 +197,220 @@ def calc_MI_input(ron, roff, I, theta, x, dt):
 
 def calc_MI_ideal(ron, roff, spiketrain, x, dt):
     ''' Calculate the (conditional) entropy, MI, and likelihood.
+
+        Single pass: qon and qoff are counted with a mask of the ON state, and L is integrated
+        while the conditional entropy is accumulated, so no reordered copies of the spike train
+        are made.
     '''
-    ## Calculate qon, qoff, w and theta
-    spikesup, spikesdown = reorder_x(x, spiketrain)
-    spikesup = np.squeeze(spikesup)
-    spikesdown = np.squeeze(spikesdown)
+    x = np.asarray(x, dtype=precision.ACCUMULATE)
+    xs = x.ravel()
+    spikes = np.asarray(spiketrain).ravel()
 
-    nspikesup = abs(np.nansum(np.nansum(spikesup)))
-    nspikesdown = abs(np.nansum(np.nansum(spikesdown)))
+    ## Calculate qon, qoff, w and theta
+    on = xs == 1
+    n_on = np.count_nonzero(on)
+    nspikesup = np.sum(spikes[on])
+    nspikesdown = np.sum(spikes[~on])
     if nspikesdown == 0:
         print('no down spikes, inventing one')
         nspikesdown = 1 
 
-    qon = nspikesup / (sum(x)*dt)
-    qoff = nspikesdown / ((len(x) - sum(x))*dt)
+    qon = nspikesup / (n_on*dt)
+    qoff = nspikesdown / ((len(xs) - n_on)*dt)
     w = np.log(qon/qoff)
     theta = qon-qoff
-    # print('w=', w, '; theta=', theta)
 
-    ## Integrate L
-    I = spiketrain/dt
-    L = np.empty(np.shape(x))
-    L[0] = np.log(ron/roff)
+    ## Integrate L and accumulate the conditional entropy
+    I = (spikes/dt).tolist()
+    x_list = xs.tolist()
+    L = np.empty(len(xs), dtype=precision.ACCUMULATE)
+    w, theta = float(w), float(theta)
+    Lnn = math.log(ron/roff)
+    Hxy_sum = 0.
+    n = len(xs)
+    for nn in range(len(xs)):
+        L[nn] = Lnn
+        # log p(x=1|L) and log p(x=0|L) as -softplus(-L) and -softplus(L)
+        softplus = math.log1p(math.exp(-abs(Lnn)))
+        Hxy_sum += x_list[nn] * (max(-Lnn, 0.) + softplus) + (1 - x_list[nn]) * (max(Lnn, 0.) + softplus)
+        if nn == len(xs) - 1:
+            break
+        try:
+            expL = math.exp(Lnn)
+            Lnn = Lnn + (ron * (1. + 1./expL) - roff * (1. + expL) + w*I[nn] - theta) * dt
+        except (OverflowError, ZeroDivisionError):
+            # As calc_MI_input, stop integrating; the MI is estimated from the samples before
+            print('L diverges weights too large')
+            L[nn+1:] = np.nan
+            n = nn + 1
+            break
 
-    for nn in range(len(x) - 1):
-        L[nn+1] = L[nn] + dLdt_spikes(L[nn], ron, roff, I[0][nn], w, theta) * dt
-        if abs(L[nn+1]) > 1000:
-            assert StopIteration('L diverges, weights too large')
-    
-    # Calculate MI
-    Hxx, Hxy, MI = MI_est(L, x)
+    ## Calculate MI
+    p = np.mean(xs[:n])
+    Hxx = float(binary_entropy(p))
+    Hxy = Hxy_sum / (n * math.log(2))
+    MI = Hxx - Hxy
+
+    return Hxx, Hxy, MI, L.reshape(np.shape(x)), qon, qoff
 
-    return Hxx, Hxy, MI, L, qon, qoff
+
+def _integrate_L(L0, ron, roff, drive, theta, dt):
+    ''' Integrates dL/dt = ron*(1 + exp(-L)) - roff*(1 + exp(L)) + drive - theta with scalar math,
+        as calc_MI_ideal, and stops where L diverges.
+
+        INPUT
+        L0 (float): L of the first sample
+        ron, roff (kHz): switching speed of the hidden state
+        drive (list): input of every sample, I or w times the spike train divided by dt
+        theta (float): theta of the input
+        dt (float): time step in ms
+
+        OUTPUT
+        L (array): L of every sample, NaN after the sample where L diverges
+        L_next (float): L of the sample after the last, None if L diverges
+        n (int): number of samples before L diverges
+    '''
+    L = np.full(len(drive), np.nan, dtype=precision.ACCUMULATE)
+    Lnn = float(L0)
+    for nn in range(len(drive)):
+        L[nn] = Lnn
+        try:
+            expL = math.exp(Lnn)
+            Lnn = Lnn + (ron * (1. + 1./expL) - roff * (1. + expL) + drive[nn] - theta) * dt
+        except (OverflowError, ZeroDivisionError):
+            return L, None, nn + 1
+    return L, Lnn, len(drive)
+
+
+class OnlineMI:
+    ''' Incremental estimate of the mutual information between the hidden state and the input, and
+        between the hidden state and the spike train. Feed it the data chunk by chunk, e.g. from
+        helpers.run_chunked or ResultStore.iter_chunks; it keeps only the last value of both
+        log-likelihoods L and running sums, so memory doesn't grow with the duration.
+
+        The input estimate equals calc_MI_input on the concatenated chunks. For the spike train, w
+        and theta depend on qon and qoff: when these are not given they are estimated from the spikes
+        seen so far, so early chunks are integrated with a preliminary w and theta and the estimate
+        converges to calc_MI_ideal as the recording grows.
+
+        Both L are integrated with the scalar math loop of calc_MI_ideal. When either diverges, the
+        estimate stops at that sample: later samples and chunks are ignored and result() reports
+        diverged=True.
+
+        INPUT
+        ron, roff (kHz): switching speed of the hidden state
+        dt (float): time step in ms
+        theta (float): theta of the input, as in analyze_exp
+        qon, qoff (kHz, optional): spike frequency of the neuron during the ON and OFF state
+    '''
+    def __init__(self, ron, roff, dt, theta, qon=None, qoff=None):
+        self.ron = ron
+        self.roff = roff
+        self.dt = dt
+        self.theta = theta
+        self.fixed_rates = (qon, qoff)
+
+        # Log-likelihood of the next sample
+        self.L_i = np.log(ron/roff)
+        self.L = np.log(ron/roff)
+
+        # Running sums
+        self.n_samples = 0
+        self.n_on = 0
+        self.spikes_on = 0
+        self.spikes_off = 0
+        self.Hxy_i_sum = 0.
+        self.Hxy_sum = 0.
+        self.MSE_i = 0.
+        self.MSE = 0.
+        self.diverged = False
+
+    def get_rates(self):
+        ''' Spike frequency during the ON and OFF state, estimated from the spikes seen so far
+            unless given. Until a spike has been seen in a state, one spike is assumed.
+
+            OUTPUT
+            qon, qoff (kHz)
+        '''
+        qon, qoff = self.fixed_rates
+        if qon is None:
+            qon = max(self.spikes_on, 1) / (max(self.n_on, 1)*self.dt)
+        if qoff is None:
+            qoff = max(self.spikes_off, 1) / (max(self.n_samples - self.n_on, 1)*self.dt)
+        return qon, qoff
+
+    def update(self, x_chunk, input_chunk, spikes_chunk):
+        ''' Integrates both log-likelihoods over the next chunk and adds it to the running sums.
+
+            INPUT
+            x_chunk (array): hidden state of the chunk
+            input_chunk (array): unscaled input current of the chunk
+            spikes_chunk (array): binary spike train of the chunk
+        '''
+        x = np.asarray(x_chunk, dtype=precision.ACCUMULATE).ravel()
+        I = np.asarray(input_chunk, dtype=precision.ACCUMULATE).ravel()
+        spikes = np.asarray(spikes_chunk).ravel()
+        if len(I) != len(x) or len(spikes) != len(x):
+            raise AssertionError('Hidden state, input and spike train chunks don\'t correspond')
+        if len(x) == 0 or self.diverged:
+            return
+
+        # Spike counts during the ON and OFF state
+        counts = (self.n_samples, self.n_on, self.spikes_on, self.spikes_off)
+        self._count(x, spikes)
+        qon, qoff = self.get_rates()
+        w = math.log(qon/qoff)
+        theta = qon-qoff
+
+        # Integrate L of the input and the spike train
+        L_i, L_i_next, n_i = _integrate_L(self.L_i, self.ron, self.roff, I.tolist(), self.theta, self.dt)
+        L, L_next, n = _integrate_L(self.L, self.ron, self.roff, (w*spikes/self.dt).tolist(), theta, self.dt)
+        if L_i_next is None or L_next is None:
+            # Only the samples before the divergence are part of the estimate
+            print('L diverges weights too large')
+            self.diverged = True
+            n = min(n_i, n)
+            x, L_i, L = x[:n], L_i[:n], L[:n]
+            self.n_samples, self.n_on, self.spikes_on, self.spikes_off = counts
+            self._count(x, spikes[:n])
+        self.L_i, self.L = L_i_next, L_next
+
+        # Add the conditional entropy and squared error of the chunk
+        Hxy_sum, MSE = self._sums(L_i, x)
+        self.Hxy_i_sum += Hxy_sum
+        self.MSE_i += MSE
+        Hxy_sum, MSE = self._sums(L, x)
+        self.Hxy_sum += Hxy_sum
+        self.MSE += MSE
+
+    def _count(self, x, spikes):
+        on = x == 1
+        self.n_samples += len(x)
+        self.n_on += int(np.count_nonzero(on))
+        self.spikes_on += int(np.sum(spikes[on]))
+        self.spikes_off += int(np.sum(spikes[~on]))
+
+    @staticmethod
+    def _sums(L, x):
+        Hxy_sum, _ = entropy_sums(L, x)
+        return Hxy_sum / np.log(2), np.sum((x - p_conditional(L))**2)
+
+    def result(self):
+        ''' Estimate of the data seen so far.
+
+            OUTPUT
+            Output-dictionary with the keys of analyze_exp except the xhat arrays:
+            MI_i, MSE_i, MI, MSE, qon, qoff, and Hxx, Hxy_i, Hxy, n_samples and diverged
+        '''
+        if self.n_samples == 0:
+            raise ValueError('No data, call update first')
+        p_on = self.n_on / self.n_samples
+        Hxx = float(binary_entropy(p_on))
+        Hxy_i = self.Hxy_i_sum / self.n_samples
+        Hxy = self.Hxy_sum / self.n_samples
+        qon, qoff = self.get_rates()
+        return {'MI_i':Hxx - Hxy_i, 'MSE_i':self.MSE_i, 'MI':Hxx - Hxy, 'MSE':self.MSE, 'qon':qon, 'qoff':qoff,
+                'Hxx':Hxx, 'Hxy_i':Hxy_i, 'Hxy':Hxy, 'n_samples':self.n_samples, 'diverged':self.diverged}
 
 
 def reorder_x(x, ordervecs):
@@ -0,0 +1,174 @@
+''' STA_calculation.py
+    File containing the spike-triggered averages of the input (input_theory, g_exc, g_inh) and the
+    cross-correlation between the hidden state, input and output, used to interpret the differences in
+    mutual information between current and dynamic clamp.
+
+    The windows around the spikes are gathered at once from a sliding window view and the
+    cross-correlation is computed with the FFT. Both also stream over the chunks of a recording in a
+    ResultStore, so a recording of 100 s or more is never loaded completely.
+'''
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+from . import spike_statistics
+
+# Number of samples per chunk when streaming over a ResultStore
+CHUNK_SIZE = 2**18
+
+
+def get_spike_index(spikes, dt):
+    ''' Get the time step of every spike.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): spike times in ms or a monitor
+        dt (float): time step of the recording in ms
+
+        OUTPUT
+        spike_index (array): index of the sample at every spike
+    '''
+    return np.round(spike_statistics.as_spike_times(spikes)/dt).astype(np.int64)
+
+
+def get_sta(signal, spike_index, n_before, n_after):
+    ''' Spike-triggered average of a signal. Spikes whose window doesn't fit in the signal are left out.
+
+        INPUT
+        signal (array): signal with time along the last axis, e.g. input_theory or (g_exc, g_inh)
+        spike_index (array): time step of every spike, see get_spike_index
+        n_before, n_after (int): number of samples before and after the spike in the window
+
+        OUTPUT
+        sta (array): average window with shape (..., n_before+n_after+1), the spike is at n_before
+        n_spikes (int): number of spikes in the average
+    '''
+    sta_sum, n_spikes = _sum_windows(np.asarray(signal), np.asarray(spike_index) - n_before, n_before + n_after + 1)
+    with np.errstate(invalid='ignore'):
+        return sta_sum/n_spikes, n_spikes
+
+
+def _sum_windows(signal, window_start, n_window):
+    ''' Sum of the windows of n_window samples starting at window_start.
+    '''
+    window_start = window_start[(window_start >= 0) & (window_start + n_window <= signal.shape[-1])]
+    sta_sum = np.zeros(signal.shape[:-1] + (n_window,), dtype=np.float64)
+    if len(window_start) == 0:
+        return sta_sum, 0
+
+    windows = sliding_window_view(signal, n_window, axis=-1)
+    sta_sum += windows[..., window_start, :].sum(axis=-2, dtype=np.float64)
+    return sta_sum, len(window_start)
+
+
+def sta_from_store(store, run_id, name, spike_index, n_before, n_after, chunk_size=CHUNK_SIZE):
+    ''' Spike-triggered average of an array in a ResultStore, streaming over its chunks. A window that
+        crosses a chunk boundary is completed with the end of the previous chunk.
+
+        INPUT
+        store (ResultStore): store with the recording
+        run_id (str): identifier of the run
+        name (str): name of the signal, e.g. 'input_theory'
+        spike_index (array): time step of every spike, see get_spike_index
+        n_before, n_after (int): number of samples before and after the spike in the window
+        chunk_size (int): number of samples read at once
+
+        OUTPUT
+        sta (array): average window with shape (..., n_before+n_after+1), the spike is at n_before
+        n_spikes (int): number of spikes in the average
+    '''
+    n_window = n_before + n_after + 1
+    window_start = np.sort(np.asarray(spike_index) - n_before)
+    window_start = window_start[window_start >= 0]
+
+    sta_sum, n_spikes = 0, 0
+    tail = None
+    for start, chunk in store.iter_chunks(run_id, name, chunk_size):
+        # The windows that end in this chunk
+        first, last = np.searchsorted(window_start + n_window - 1, [start, start + chunk.shape[-1]])
+        if tail is not None:
+            chunk_start = start - tail.shape[-1]
+            chunk = np.concatenate((tail, chunk), axis=-1)
+        else:
+            chunk_start = start
+        chunk_sum, n = _sum_windows(chunk, window_start[first:last] - chunk_start, n_window)
+        sta_sum, n_spikes = sta_sum + chunk_sum, n_spikes + n
+        tail = chunk[..., chunk.shape[-1] - min(n_window - 1, chunk.shape[-1]):]
+
+    with np.errstate(invalid='ignore'):
+        return sta_sum/n_spikes, n_spikes
+
+
+def get_cross_correlation(x, y, max_lag):
+    ''' Cross-correlation coefficient between two signals, computed with the FFT.
+
+        INPUT
+        x, y (array): signals of the same length, e.g. the hidden state and the membrane potential
+        max_lag (int): largest lag in samples
+
+        OUTPUT
+        lags (array): lags from -max_lag to max_lag in samples
+        cc (array): correlation of x[t] with y[t+lag] at every lag, normalized by the standard deviations
+    '''
+    x = np.asarray(x, dtype=np.float64).ravel()
+    y = np.asarray(y, dtype=np.float64).ravel()
+    if len(x) != len(y):
+        raise ValueError('x and y must have the same length')
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    cc = _correlate_block(x - x.mean(), 0, y - y.mean(), 0, lags)
+    return lags, cc/(len(x)*x.std()*y.std())
+
+
+def cross_correlation_from_store(store, run_id, x_name, y_name, max_lag, chunk_size=CHUNK_SIZE, y_run_id=None):
+    ''' Cross-correlation coefficient between two arrays in a ResultStore, streaming over the chunks
+        of x. The first pass gets the means and standard deviations, the second correlates every chunk
+        of x with the window of y that it overlaps at the lags.
+
+        INPUT
+        store (ResultStore): store with the recordings
+        run_id (str): identifier of the run of x
+        x_name, y_name (str): names of the signals, e.g. 'hidden_state' and 'current_volt'
+        max_lag (int): largest lag in samples
+        chunk_size (int): number of samples read at once
+        y_run_id (str, optional): identifier of the run of y if it differs, e.g. the stimulus of a simulation
+
+        OUTPUT
+        lags (array): lags from -max_lag to max_lag in samples
+        cc (array): correlation of x[t] with y[t+lag] at every lag, normalized by the standard deviations
+    '''
+    if y_run_id is None:
+        y_run_id = run_id
+    x_mean, x_std, n = _streaming_moments(store, run_id, x_name, chunk_size)
+    y_mean, y_std, n_y = _streaming_moments(store, y_run_id, y_name, chunk_size)
+    if n != n_y:
+        raise ValueError('%s and %s must have the same length' % (x_name, y_name))
+
+    lags = np.arange(-max_lag, max_lag + 1)
+    cc = np.zeros(len(lags))
+    for start, x_chunk in store.iter_chunks(run_id, x_name, chunk_size):
+        y_start = max(0, start - max_lag)
+        y_chunk = store.window(y_run_id, y_name, y_start, min(n, start + x_chunk.shape[-1] + max_lag))
+        cc += _correlate_block(x_chunk.ravel() - x_mean, start, y_chunk.ravel() - y_mean, y_start, lags)
+
+    return lags, cc/(n*x_std*y_std)
+
+
+def _correlate_block(x_block, x_start, y_block, y_start, lags):
+    ''' Sum of x[t]*y[t+lag] over the samples t of x_block, at the given lags. x_block and y_block start
+        at sample x_start and y_start, y_block has to contain every sample t+lag that exists.
+    '''
+    n_fft = 1 << int(np.ceil(np.log2(len(x_block) + len(y_block) + 2*np.abs(lags).max() + 1)))
+    r = np.fft.irfft(np.conj(np.fft.rfft(x_block, n_fft))*np.fft.rfft(y_block, n_fft), n_fft)
+    # r[j] is the sum of x_block[t]*y_block[t+j], negative j wrap around to the end
+    return r[(x_start + lags - y_start) % n_fft]
+
+
+def _streaming_moments(store, run_id, name, chunk_size):
+    ''' Mean, standard deviation and length of an array in a ResultStore.
+    '''
+    total, total_square, n = 0., 0., 0
+    for _, chunk in store.iter_chunks(run_id, name, chunk_size):
+        chunk = chunk.ravel().astype(np.float64)
+        total += chunk.sum()
+        total_square += np.dot(chunk, chunk)
+        n += len(chunk)
+    mean = total/n
+    return mean, np.sqrt(max(total_square/n - mean**2, 0.)), n
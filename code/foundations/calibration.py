@@ -0,0 +1,205 @@
+''' calibration.py
+
+    This file contains the persistent cache of input scales found by scale_to_freq. Calibrating
+    a scale takes many test simulations, so every calibration is stored together with the
+    measured firing frequency and ON/all ratio. A calibration is used again when the same model
+    neuron, clamp type, stimulus statistics, target and time step come up, and the nearest earlier
+    calibration is used to warm-start the search when the parameters shift slightly.
+
+    Calibrations are invalidated automatically when the model equations change.
+'''
+import os
+import json
+import hashlib
+import tempfile
+
+import numpy as np
+
+# Relative distance within which an earlier calibration is used to warm-start the search
+WARM_START_DISTANCE = 0.25
+
+
+def get_model_hash(neuron):
+    ''' Hash of the equations, threshold and refractoriness of a neuron model. The native engine
+        integrates the same model, so both engines share their calibrations; the source of the native
+        kernels is hashed as well, so a change of those also invalidates the calibrations.
+
+        INPUT
+        neuron (Class): neuron model as found in models/models.py
+
+        OUTPUT
+        model_hash (str): hexadecimal hash of the model definition
+    '''
+    from ..models import models, native
+
+    eqs_input = neuron.eqs_current if neuron.clamp_type == 'current' else neuron.eqs_dynamic
+    definition = [type(neuron).__name__, neuron.clamp_type, neuron.eqs, eqs_input,
+                  models.THRESHOLD, str(models.REFRACTORY), str(neuron.dt)]
+    with open(native.__file__, 'rb') as f:
+        definition.append(hashlib.sha1(f.read()).hexdigest())
+    if getattr(neuron, 'tabulate', None) is not None:
+        definition.append('tabulate %g' % neuron.tabulate)
+    return hashlib.sha1('\n'.join(definition).encode()).hexdigest()
+
+
+def get_stimulus_statistics(input_theory, hidden_state, clamp_type):
+    ''' Summary statistics of the stimulus that determine the scale.
+
+        INPUT
+        input_theory (array or tuple): theoretical input; (g_exc, g_inh) if dynamic
+        hidden_state (array): binary array representing the hidden state
+        clamp_type (str): 'current' or 'dynamic'
+
+        OUTPUT
+        statistics (dict): mean and standard deviation of the input, fraction of time in the ON state
+                           and the number of samples
+    '''
+    hidden_state = np.asarray(hidden_state)
+    statistics = {'p_on':float(np.mean(hidden_state)), 'n_samples':int(hidden_state.size)}
+    if clamp_type == 'current':
+        statistics['mean'] = float(np.mean(input_theory))
+        statistics['std'] = float(np.std(input_theory))
+    else:
+        g_exc, g_inh = input_theory
+        statistics['mean_exc'] = float(np.mean(g_exc))
+        statistics['std_exc'] = float(np.std(g_exc))
+        statistics['mean_inh'] = float(np.mean(g_inh))
+        statistics['std_inh'] = float(np.std(g_inh))
+    return statistics
+
+
+class CalibrationCache:
+    ''' Persistent cache of calibrations made by scale_to_freq, stored as a JSON file.
+
+        INPUT
+        path (str): path of the JSON file in which the calibrations are stored
+        precision (int): number of significant digits of the stimulus statistics in the cache key
+    '''
+    def __init__(self, path='calibration_cache.json', precision=3):
+        self.path = path
+        self.precision = precision
+        self.entries = {}
+        if os.path.isfile(path):
+            with open(path) as f:
+                self.entries = json.load(f)
+
+    def make_key(self, neuron, Ni, clamp_type, input_theory, hidden_state, target, on_all_ratio, dt, duration, scale_list):
+        ''' Describe a calibration problem. The description doubles as the key of the cache.
+
+            INPUT
+            see scale_to_freq
+
+            OUTPUT
+            key (dict): the description of the calibration problem
+        '''
+        statistics = get_stimulus_statistics(input_theory, hidden_state, clamp_type)
+        statistics = {name:float('%.*g' % (self.precision, value)) for name, value in statistics.items()}
+        key = {'model':type(neuron).__name__, 'model_hash':get_model_hash(neuron), 'Ni':None if Ni is None else int(Ni),
+               'clamp_type':clamp_type, 'dt':float(dt), 'duration':float(duration), 'target':float(target),
+               'on_all_ratio':float(on_all_ratio), 'statistics':statistics,
+               'scale_list':hashlib.sha1(np.asarray(scale_list, dtype=float).tobytes()).hexdigest()}
+        return key
+
+    def get(self, key):
+        ''' Get an earlier calibration.
+
+            INPUT
+            key (dict): description of the calibration problem as made by make_key
+
+            OUTPUT
+            calibration (dict or None): the calibration as returned by search_scale, None if not cached
+        '''
+        # A neuron without index picks random parameters, so the calibration can't be reused
+        if key['Ni'] is None:
+            return None
+        entry = self.entries.get(self._hash(key))
+        if entry is None:
+            return None
+        return entry['calibration']
+
+    def put(self, key, calibration):
+        ''' Store a calibration and remove calibrations of older versions of the same model.
+
+            INPUT
+            key (dict): description of the calibration problem as made by make_key
+            calibration (dict): the calibration as returned by search_scale
+        '''
+        if key['Ni'] is None:
+            return
+        self.invalidate(key['model'], key['clamp_type'], key['model_hash'])
+        self.entries[self._hash(key)] = {'key':key, 'calibration':calibration}
+        self.save()
+
+    def warm_start(self, key, scale_list):
+        ''' Find where to start the search based on the nearest earlier calibration of the same model neuron.
+
+            INPUT
+            key (dict): description of the calibration problem as made by make_key
+            scale_list (array): list of scales to try
+
+            OUTPUT
+            start (int): index in the scale list from which to start the search
+        '''
+        nearest = self.nearest(key)
+        if nearest is None:
+            return 0
+
+        # Start two scales below the earlier calibration: the nearest calibration was made for other stimulus
+        # statistics, so the scale found now may be one lower, and that scale still has to be compared with its
+        # predecessor. A start that is still too high is caught by the overshoot check of scale_to_freq
+        idx = int(np.searchsorted(np.asarray(scale_list, dtype=float), nearest['calibration']['scale']))
+        return max(0, idx - 2)
+
+    def nearest(self, key):
+        ''' Find the nearest earlier calibration of the same model neuron, clamp type and time step.
+
+            INPUT
+            key (dict): description of the calibration problem as made by make_key
+
+            OUTPUT
+            entry (dict or None): the nearest cached entry, None if none is within WARM_START_DISTANCE
+        '''
+        if key['Ni'] is None:
+            return None
+
+        best, best_distance = None, WARM_START_DISTANCE
+        for entry in self.entries.values():
+            other = entry['key']
+            if any(other[name] != key[name] for name in ['model', 'model_hash', 'Ni', 'clamp_type', 'dt']):
+                continue
+            if set(other['statistics']) != set(key['statistics']):
+                continue
+
+            # Largest relative difference of the target, duration and stimulus statistics
+            values = dict(key['statistics'], target=key['target'], duration=key['duration'])
+            other_values = dict(other['statistics'], target=other['target'], duration=other['duration'])
+            distance = max(abs(values[name] - other_values[name]) / max(abs(values[name]), abs(other_values[name]), 1e-12)
+                           for name in values)
+            if distance <= best_distance:
+                best, best_distance = entry, distance
+        return best
+
+    def invalidate(self, model, clamp_type, model_hash):
+        ''' Remove the calibrations of a model neuron that were made with different model equations.
+
+            INPUT
+            model (str): name of the model class
+            clamp_type (str): 'current' or 'dynamic'
+            model_hash (str): hash of the current model definition
+        '''
+        self.entries = {name:entry for name, entry in self.entries.items()
+                        if entry['key']['model'] != model or entry['key']['clamp_type'] != clamp_type
+                        or entry['key']['model_hash'] == model_hash}
+
+    def save(self):
+        ''' Write the cache to disk, the file is replaced atomically.
+        '''
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp_', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(self.entries, f, indent=1, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    @staticmethod
+    def _hash(key):
+        return hashlib.sha1(json.dumps(key, sort_keys=True).encode()).hexdigest()
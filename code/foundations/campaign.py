@@ -0,0 +1,138 @@
+''' campaign.py
+
+    This file contains the manifest of a simulation campaign, e.g. big_sim.py. Every task (a cell,
+    clamp type, run and seed) is registered in the manifest with its parameters and status. The
+    result of a task is committed to a ResultStore atomically, so after a crash a task is either
+    stored completely or not at all, and a restarted campaign only runs the tasks that are missing.
+    The manifest is rewritten atomically on every change.
+'''
+import os
+import json
+import time
+import tempfile
+
+from .result_store import ResultStore
+
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+
+class Campaign:
+    ''' Manifest of the tasks of a simulation campaign and the store of their results.
+
+        INPUT
+        root (str): directory of the campaign, contains manifest.json and the stored results
+        store (ResultStore, optional): store of the results, defaults to a ResultStore in root that
+                                       stores the pyramids of the traces for the viewer
+    '''
+    def __init__(self, root, store=None):
+        self.root = root
+        self.store = store if store is not None else ResultStore(root, pyramids=True)
+        self.path = os.path.join(root, 'manifest.json')
+        os.makedirs(root, exist_ok=True)
+
+        self.tasks = {}
+        if os.path.isfile(self.path):
+            with open(self.path) as f:
+                self.tasks = json.load(f)['tasks']
+
+        # Tasks that were running when the campaign stopped are run again
+        for task in self.tasks.values():
+            if task['status'] == 'running':
+                task['status'] = 'pending'
+        self._save()
+
+    def add(self, task_id, params):
+        ''' Register a task, a task that is already registered keeps its status.
+
+            INPUT
+            task_id (str): identifier of the task, also the run_id of its result
+            params (dict): JSON serializable parameters of the task
+
+            OUTPUT
+            task_id (str)
+        '''
+        params = json.loads(json.dumps(params, default=str))
+        if task_id in self.tasks:
+            if self.tasks[task_id]['params'] != params:
+                raise ValueError('Task %s is registered with other parameters' % task_id)
+            return task_id
+        self.tasks[task_id] = {'params':params, 'status':'done' if self.store.has(task_id) else 'pending',
+                               'attempts':0, 'error':None}
+        self._save()
+        return task_id
+
+    def params(self, task_id):
+        return self.tasks[task_id]['params']
+
+    def is_done(self, task_id):
+        ''' A task is done when its result is stored, whatever the manifest says.
+        '''
+        return self.store.has(task_id)
+
+    def pending(self):
+        ''' Identifiers of the tasks that have no stored result, in the order in which they were added.
+        '''
+        return [task_id for task_id in self.tasks if not self.is_done(task_id)]
+
+    def start(self, task_id):
+        task = self.tasks[task_id]
+        task.update(status='running', attempts=task['attempts'] + 1, started=time.time())
+        self._save()
+
+    def commit(self, task_id, arrays, meta=None):
+        ''' Store the result of a task and mark it done.
+
+            INPUT
+            task_id (str): identifier of the task
+            arrays (dict): arrays to store with their name as key
+            meta (dict): JSON serializable information about the result, the parameters are added
+        '''
+        meta = dict(meta or {}, params=self.params(task_id))
+        self.store.save(task_id, arrays, meta, overwrite=True)
+        self.tasks[task_id].update(status='done', finished=time.time(), error=None)
+        self._save()
+
+    def fail(self, task_id, error):
+        self.tasks[task_id].update(status='failed', error=repr(error))
+        self._save()
+
+    def run(self, task_id, func, *args):
+        ''' Run a task and commit its result. An exception fails the task and is printed, so the
+            campaign can continue with the other tasks.
+
+            INPUT
+            task_id (str): identifier of the task
+            func (function): returns the arrays and meta data of the task when called with args
+
+            OUTPUT
+            done (bool): whether the task succeeded
+        '''
+        self.start(task_id)
+        try:
+            arrays, meta = func(*args)
+        except Exception as error:
+            print('Task %s failed: %r' % (task_id, error))
+            self.fail(task_id, error)
+            return False
+        self.commit(task_id, arrays, meta)
+        return True
+
+    def summary(self):
+        ''' Number of tasks per status.
+        '''
+        counts = dict.fromkeys(STATUSES, 0)
+        for task_id, task in self.tasks.items():
+            if self.is_done(task_id):
+                counts['done'] += 1
+            elif task['status'] == 'done':
+                # The stored result was removed
+                counts['pending'] += 1
+            else:
+                counts[task['status']] += 1
+        return counts
+
+    def _save(self):
+        fd, tmp_path = tempfile.mkstemp(dir=self.root, prefix='.tmp_', suffix='.json')
+        with os.fdopen(fd, 'w') as f:
+            json.dump({'tasks':self.tasks}, f, indent=1, default=str)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,275 @@
+''' closed_loop.py
+
+    This file contains an emulator of the closed dynamic clamp loop. In a dynamic clamp rig the
+    injected current I = g_exc(t)*(Er_exc - v) + g_inh(t)*(Er_inh - v) has to be computed from
+    the measured voltage within every sampling period. The emulator steps a cell (a Barrel_PC or
+    Barrel_IN model neuron integrated by models/native.py, a passive model cell or a replayed
+    voltage trace) at the sampling rate of the rig, computes the current from the precomputed
+    conductances or from a look-up table (LUT), and records the compute latency of every step, so
+    the latency distribution and the deadline misses at 5-50 kHz can be checked before running on
+    hardware.
+
+    Units as in the rest of the protocol: time in ms, voltage in mV, conductance in mS and
+    current in uA.
+'''
+import time
+import numpy as np
+from ..models import native
+
+
+class ReplayedVoltage:
+    ''' Cell that replays a recorded voltage trace, the injected current is ignored.
+
+        INPUT
+        voltage (array): voltage of every sample in mV
+    '''
+    def __init__(self, voltage):
+        self.voltage = np.asarray(voltage, dtype=float).ravel()
+        self.reset()
+
+    def reset(self):
+        self.idx = 0
+        return self.voltage[0]
+
+    def step(self, I_inj, dt):
+        self.idx = min(self.idx + 1, len(self.voltage) - 1)
+        return self.voltage[self.idx]
+
+
+class PassiveCell:
+    ''' Passive RC membrane, like the model cell used to test a rig. Integrated exactly for
+        a current that is constant during a step.
+
+        INPUT
+        Cm (float): membrane capacitance in uF
+        gL (float): leak conductance in mS
+        EL (float): leak reversal potential in mV
+    '''
+    def __init__(self, Cm=2e-4, gL=1e-5, EL=-65.):
+        self.Cm = Cm
+        self.gL = gL
+        self.EL = EL
+        self.reset()
+
+    def reset(self):
+        self.v = self.EL
+        return self.v
+
+    def step(self, I_inj, dt):
+        v_inf = self.EL + I_inj/self.gL
+        self.v = v_inf + (self.v - v_inf)*np.exp(-dt*self.gL/self.Cm)
+        return self.v
+
+
+class NativeCell:
+    ''' Barrel cortex model neuron stepped one sample at a time with the native engine, so the
+        injected current of every step can depend on the voltage of the previous step.
+
+        INPUT
+        model (str): 'PC' or 'IN'
+        parameters (dict): fitted parameters in native units (see native.PARAMETERS), e.g. from
+                           models.get_native_parameters or NativeCell.from_model
+        tabulate (float, optional): interpolate the gating rates from tables with this voltage step in mV
+        refractory (float): refractory period in ms
+    '''
+    def __init__(self, model, parameters, tabulate=None, refractory=native.REFRACTORY):
+        if model not in native.PARAMETERS:
+            raise ValueError('Model must be \'PC\' or \'IN\'')
+        self.model = model
+        self.parameters = {name:np.atleast_1d(np.asarray(parameters[name], dtype=np.float64))
+                           for name in native.PARAMETERS[model]}
+        self.tables = None if tabulate is None else native.make_tables(model, self.parameters, tabulate)
+        self.dv = native.TABLE_DV if tabulate is None else tabulate
+        self.refractory = refractory
+        self.reset()
+
+    @classmethod
+    def from_model(cls, neuron, Ni=None):
+        ''' Cell with the fitted parameters and tabulation of a model neuron.
+
+            INPUT
+            neuron (Class): Barrel_PC or Barrel_IN
+            Ni (int): neuron index, a random neuron if None
+        '''
+        from ..models.models import get_native_parameters, REFRACTORY
+        Ni, parameters = get_native_parameters(neuron, Ni)
+        cell = cls(neuron.model_name, parameters, neuron.tabulate, REFRACTORY)
+        cell.Ni = Ni
+        return cell
+
+    def reset(self):
+        self.state = native.initial_state(self.model)
+        self.idx = 0
+        self.lastspike = None
+        self.spiketimes = []
+        return float(self.state['v'][0])
+
+    def step(self, I_inj, dt):
+        above = native.step(self.model, self.state, self.parameters, I_inj, dt, self.tables, self.dv)
+        # Spikes are detected as in native.simulate, outside the refractory period
+        if above[0] and (self.lastspike is None or self.idx - self.lastspike >= int(round(self.refractory/dt))):
+            self.lastspike = self.idx
+            self.spiketimes.append(self.idx*dt)
+        self.idx += 1
+        return float(self.state['v'][0])
+
+
+def make_LUT(conductance, Er, dv=0.1, v_min=-100., v_max=20.):
+    ''' Look-up table of the injected current for every voltage and time step.
+
+        INPUT
+        conductance (array): conductance of every sample in mS
+        Er (float): reversal potential in mV
+        dv (float): voltage resolution of the table in mV
+        v_min, v_max (float): voltage range of the table in mV
+
+        OUTPUT
+        volt_vec, table (array, array): voltages and current in uA, (len(volt_vec), len(conductance))
+    '''
+    volt_vec = np.arange(v_min, v_max + dv, dv).round(3)
+    table = np.asarray(conductance, dtype=float).ravel()[np.newaxis, :] * (Er - volt_vec[:, np.newaxis])
+    return volt_vec, table
+
+
+def LUT_to_array(input_LUT):
+    ''' Converts the dictionary of dynamic_clamp.get_input_LUT to an array indexed by voltage.
+
+        INPUT
+        input_LUT (dict): keys are the voltage and values the current over time
+
+        OUTPUT
+        volt_vec, table (array, array): sorted voltages and current, (len(volt_vec), number of samples)
+    '''
+    volt_vec = np.array(sorted(input_LUT))
+    table = np.array([np.ravel(input_LUT[v]) for v in volt_vec])
+    return volt_vec, table
+
+
+class ClosedLoop:
+    ''' Closed dynamic clamp loop: every step reads the voltage of the cell, computes the current
+        and injects it during the next sampling period.
+
+        INPUT
+        cell (object): cell with reset() returning the initial voltage and step(I_inj, dt)
+                       returning the voltage after a step, e.g. NativeCell, PassiveCell or ReplayedVoltage
+        g_exc, g_inh (array): conductances of every sample in mS, e.g. ScaledInput.scaled_values()
+        sampling_rate (float): sampling rate of the rig in kHz
+        Er_exc, Er_inh (float): reversal potentials in mV
+        LUTs (tuple, optional): ((volt_vec, table_exc), (volt_vec, table_inh)) from make_LUT or LUT_to_array,
+                                the current is looked up at the nearest voltage instead of computed
+    '''
+    def __init__(self, cell, g_exc, g_inh, sampling_rate, Er_exc=0., Er_inh=-75., LUTs=None):
+        self.cell = cell
+        self.g_exc = np.asarray(g_exc, dtype=float).ravel()
+        self.g_inh = np.asarray(g_inh, dtype=float).ravel()
+        if len(self.g_exc) != len(self.g_inh):
+            raise AssertionError('Excitatory and inhibitory conductance don\'t correspond')
+        self.sampling_rate = sampling_rate
+        self.dt = 1./sampling_rate
+        self.Er_exc = Er_exc
+        self.Er_inh = Er_inh
+        self.LUTs = LUTs
+        if LUTs is not None:
+            (volt_exc, table_exc), (volt_inh, table_inh) = LUTs
+            if not np.array_equal(volt_exc, volt_inh):
+                raise ValueError('The excitatory and inhibitory LUT must have the same voltages')
+            if table_exc.shape[1] < len(self.g_exc) or table_inh.shape[1] < len(self.g_inh):
+                raise AssertionError('LUT is shorter than the conductances')
+
+    def get_compute(self):
+        ''' The function that computes the current of a step from the voltage and the sample index.
+        '''
+        Er_exc, Er_inh = self.Er_exc, self.Er_inh
+        if self.LUTs is None:
+            g_exc, g_inh = self.g_exc, self.g_inh
+            def compute(v, t):
+                return g_exc[t]*(Er_exc - v) + g_inh[t]*(Er_inh - v)
+        else:
+            (volt_vec, table_exc), (_, table_inh) = self.LUTs
+            v_min = float(volt_vec[0])
+            dv = float(volt_vec[1] - volt_vec[0])
+            last = len(volt_vec) - 1
+            def compute(v, t):
+                idx = min(max(int(round((v - v_min)/dv)), 0), last)
+                return table_exc[idx, t] + table_inh[idx, t]
+        return compute
+
+    def run(self, n_steps=None, realtime=False):
+        ''' Runs the loop.
+
+            INPUT
+            n_steps (int): number of steps, defaults to the length of the conductances
+            realtime (bool): wait for the start of every sampling period as a rig would, then the
+                             lateness of every step (start after its scheduled time) is recorded too
+
+            OUTPUT
+            result (dict): 'voltage' (mV), 'current' (uA), 'latency_ns' of the computation of
+                           every step and, if realtime, 'lateness_ns'
+        '''
+        if n_steps is None:
+            n_steps = len(self.g_exc)
+        compute = self.get_compute()
+        step = self.cell.step
+        dt = self.dt
+        clock = time.perf_counter_ns
+
+        voltage = np.empty(n_steps)
+        current = np.empty(n_steps)
+        latency = np.empty(n_steps, dtype=np.int64)
+        lateness = np.zeros(n_steps, dtype=np.int64)
+        period_ns = int(round(1e6/self.sampling_rate))
+
+        v = self.cell.reset()
+        start_ns = clock()
+        for t in range(n_steps):
+            if realtime:
+                scheduled = start_ns + t*period_ns
+                while clock() < scheduled:
+                    pass
+                lateness[t] = clock() - scheduled
+
+            # The critical path: voltage in, current out
+            tic = clock()
+            I_inj = compute(v, t)
+            latency[t] = clock() - tic
+
+            voltage[t] = v
+            current[t] = I_inj
+            v = step(I_inj, dt)
+
+        result = {'voltage':voltage, 'current':current, 'latency_ns':latency}
+        if realtime:
+            result['lateness_ns'] = lateness
+        return result
+
+
+def latency_report(latency_ns, sampling_rates=(5, 10, 20, 50), lateness_ns=None, n_bins=50):
+    ''' Latency statistics and deadline misses of a closed loop run at several sampling rates.
+        A step misses its deadline when its lateness plus compute latency exceeds the sampling period.
+
+        INPUT
+        latency_ns (array): compute latency of every step in ns, from ClosedLoop.run
+        sampling_rates (tuple): sampling rates in kHz
+        lateness_ns (array, optional): lateness of every step in ns
+        n_bins (int): number of logarithmic bins of the histogram
+
+        OUTPUT
+        report (dict): percentiles, histogram (counts, edges in ns) and per sampling rate the
+                       period, the number and the fraction of deadline misses
+    '''
+    latency_ns = np.asarray(latency_ns)
+    total_ns = latency_ns if lateness_ns is None else latency_ns + np.asarray(lateness_ns)
+    edges = np.logspace(np.log10(max(latency_ns.min(), 1)), np.log10(max(latency_ns.max(), 2)), n_bins + 1)
+    counts, edges = np.histogram(latency_ns, bins=edges)
+
+    report = {'median_ns':float(np.median(latency_ns)),
+              'p99_ns':float(np.percentile(latency_ns, 99)),
+              'p99.9_ns':float(np.percentile(latency_ns, 99.9)),
+              'max_ns':int(latency_ns.max()),
+              'histogram':(counts, edges),
+              'deadlines':{}}
+    for rate in sampling_rates:
+        period_ns = 1e6/rate
+        misses = int(np.count_nonzero(total_ns > period_ns))
+        report['deadlines'][rate] = {'period_ns':period_ns, 'misses':misses, 'miss_fraction':misses/len(total_ns)}
+    return report
@@ -3,8 +3,7 @@
     File containing the functions used in make_dynamic_experiments when clamp type is dynamic.
 '''
 import numpy as np
-import matplotlib.pyplot as plt
-from foundations.input import Input
+from .input import Input
 
 def get_g0(v_rest, weights, Er_exc, Er_inh):
     ''' Creates a dictionary containing the 'base' conductance of each neuron
@@ -95,11 +94,13 @@ def get_input_LUT(sto_cond, dv, Er):
 
         OUTPUT
         input_LUT(dict): keys are the voltage and value the I(t). 
+
+        closed_loop.LUT_to_array converts the table to an array for fast look-ups.
     '''  
     # Make the vector for which voltages we want in the LUT
     volt_vec = np.arange(-100, 20+dv, dv).round(3)
     input_LUT = {}
     for v in volt_vec:
-        input_LUT[v] = sto_cond * (-v - Er)
+        input_LUT[v] = sto_cond * (Er - v)
 
     return input_LUT
@@ -2,16 +2,18 @@
     
     This file contains functions that scale the input theory, makes spiketrains and calculates the inter-spike interval. 
 ''' 
-import os,sys,inspect
-current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-parent_dir = os.path.dirname(current_dir)
-sys.path.insert(0, parent_dir)
-
+import os
+import copy
+import functools
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
-import brian2 as b2
-from models.models import Barrel_PC, Barrel_IN
+from . import profiler
+from . import precision
+from . import spike_statistics
+from .shared_arrays import SharedArrays, resolve
 
-def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, duration, hidden_state, scale_list, dt, Ni=None):
+@profiler.profiled('scale_to_freq')
+def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, duration, hidden_state, scale_list, dt, Ni=None, cache=None, n_workers=None):
     ''' Scales the theoretical input to an input that results in target firing frequence 
         by running test simulations. 
 
@@ -26,9 +28,11 @@ def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, durati
         scale_list (array): list of scales to try
         dt (float): time step of the simulation and hiddenstate
         Ni (int): index of the neuron to be simulated
+        cache (CalibrationCache, optional): cache of earlier calibrations, used to skip or warm-start the search
+        n_workers (int, optional): if larger than 1, test this many scales at once in a pool of worker processes
 
         OUTPUT
-        inj_input (brian2.TimedArray): the input that results in the target firing frequency
+        inj_input (ScaledInput): the input that results in the target firing frequency
     '''
     # Checks
     try:
@@ -44,54 +48,330 @@ def scale_to_freq(neuron, input_theory, target, on_all_ratio, clamp_type, durati
     elif clamp_type == 'dynamic':
         if len(input_theory[0]) != len(hidden_state):
             raise  AssertionError('Input and hidden state don\'t correspond')
+
+    # The unscaled input is shared by all candidate scales
+    base_input = ScaledInput(input_theory, clamp_type, dt)
+
+    # Use an earlier calibration or start the search close to the nearest one
+    start = 0
+    if cache is not None:
+        key = cache.make_key(neuron, Ni, clamp_type, input_theory, hidden_state, target, on_all_ratio, dt, duration, scale_list)
+        calibration = cache.get(key)
+        if calibration is not None:
+            if not calibration['accepted']:
+                return False
+            return base_input.with_scale(calibration['scale'])
+        start = cache.warm_start(key, scale_list)
+
+    if n_workers is not None and n_workers > 1:
+        search = functools.partial(search_scale_parallel, n_workers=n_workers)
+    elif getattr(neuron, 'engine', 'brian2') == 'native':
+        search = search_scale_batch
+    else:
+        search = search_scale
+    calibration = search(neuron, base_input, target, on_all_ratio, duration, hidden_state, scale_list[start:], dt, Ni)
+    if start > 0 and calibration['overshoot']:
+        # The warm start was too high, search all scales
+        calibration = search(neuron, base_input, target, on_all_ratio, duration, hidden_state, scale_list, dt, Ni)
+
+    if cache is not None:
+        cache.put(key, calibration)
     
-    freq_diff_list = []  # Containing the difference between target and actual frequency
+    if not calibration['accepted']:
+        return False
+    return base_input.with_scale(calibration['scale'])
+
+
+def search_scale(neuron, base_input, target, on_all_ratio, duration, hidden_state, scale_list, dt, Ni=None):
+    ''' Runs test simulations with increasing scales until the firing frequency exceeds the target.
+
+        INPUT
+        neuron (Class): neuron model as found in models/models.py
+        base_input (ScaledInput): the unscaled input
+        target (int): target frequency for the simulation
+        on_all_ratio (float): how much more does the neuron need to fire during the ON state
+        duration (int): duration of the simulation in miliseconds
+        hidden_state (array): binary array representing the hidden state
+        scale_list (array): list of scales to try
+        dt (float): time step of the simulation and hiddenstate
+        Ni (int): index of the neuron to be simulated
+
+        OUTPUT
+        calibration (dict): the chosen scale, its frequency and ON/all ratio, whether the ratio is accepted 
+                            and whether the first scale already overshot the target
+    '''
     freq_list = []       # Containing the actual frequencies
     on_freq_list = []    # Containing the frequency during ON-state
 
-    for idx, scale in enumerate(scale_list):
+    for scale in scale_list:
         neuron.restore()
 
         # Scale and run
-        inj = scale_input_theory(input_theory, clamp_type, 0, scale, dt)
+        inj = base_input.with_scale(scale)
         M, S = neuron.run(inj, duration, Ni)
 
-        # Compare against frequency target
+        # Frequency and frequency during the ON state
         freq = S.num_spikes/(duration/1000)
         freq_list.append(freq)
-        freq_diff = abs(freq - target)
-        freq_diff_list.append(freq_diff)
-
-        # Compare against on_frequency target
         spiketrain = make_spiketrain(S, duration, dt)
-        on_freq = get_on_freq(spiketrain, hidden_state, dt)
-        on_freq_list.append(on_freq)
+        on_freq_list.append(get_on_freq(spiketrain, hidden_state, dt))
+
+        calibration = select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio)
+        if calibration is not None:
+            neuron.restore()
+            return calibration
+
+    # When all scales have been tried
+    neuron.restore()
+    return select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio, exhausted=True)
+
+
+def search_scale_batch(neuron, base_input, target, on_all_ratio, duration, hidden_state, scale_list, dt, Ni=None, batch_size=16):
+    ''' Same as search_scale for a neuron with the native engine, which simulates a batch of scales
+        at once. The scale is chosen by the same rules, so the result equals that of search_scale.
+
+        INPUT
+        see search_scale
+        batch_size (int): number of scales simulated at once
+
+        OUTPUT
+        calibration (dict): see search_scale
+    '''
+    from ..models.models import run_native
+
+    freq_list = []       # Containing the actual frequencies
+    on_freq_list = []    # Containing the frequency during ON-state
+
+    for start in range(0, len(scale_list), batch_size):
+        batch = scale_list[start:start+batch_size]
+        for S in run_native(neuron, base_input, duration, Ni, scales=batch):
+            freq_list.append(S.num_spikes/(duration/1000))
+            spiketrain = make_spiketrain(S, duration, dt)
+            on_freq_list.append(get_on_freq(spiketrain, hidden_state, dt))
+
+        calibration = select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio)
+        if calibration is not None:
+            return calibration
+
+    # When all scales have been tried
+    return select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio, exhausted=True)
+
+
+def search_scale_parallel(neuron, base_input, target, on_all_ratio, duration, hidden_state, scale_list, dt, Ni=None, n_workers=None):
+    ''' Same as search_scale, but tests batches of scales at once. Every worker process builds its own
+        copy of the neuron model once and reads the input and hidden state from shared memory, after
+        which only the scales are sent to the workers.
+        The scale is chosen by the same rules, so the result equals that of search_scale.
+
+        INPUT
+        see search_scale
+        n_workers (int): number of worker processes, defaults to the number of CPUs
+
+        OUTPUT
+        calibration (dict): see search_scale
+    '''
+    if n_workers is None:
+        n_workers = os.cpu_count()
+
+    freq_list = []       # Containing the actual frequencies
+    on_freq_list = []    # Containing the frequency during ON-state
+
+    with SharedArrays() as shared:
+        initargs = (type(neuron), neuron.clamp_type, neuron.dt, shared.share(base_input.buffer), base_input.dt,
+                    duration, shared.share(np.asarray(hidden_state)), Ni, getattr(neuron, 'engine', 'brian2'),
+                    getattr(neuron, 'tabulate', None))
+        with ProcessPoolExecutor(n_workers, initializer=_init_scale_worker, initargs=initargs) as pool:
+            for start in range(0, len(scale_list), n_workers):
+                batch = scale_list[start:start+n_workers]
+                for freq, on_freq in pool.map(_evaluate_scale, batch):
+                    freq_list.append(freq)
+                    on_freq_list.append(on_freq)
+
+                calibration = select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio)
+                if calibration is not None:
+                    return calibration
+
+    # When all scales have been tried
+    return select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio, exhausted=True)
+
+
+# Neuron model and input of a worker process of search_scale_parallel
+_scale_worker = {}
+
+def _init_scale_worker(model_class, clamp_type, model_dt, buffer, dt, duration, hidden_state, Ni, engine='brian2',
+                       tabulate=None):
+    neuron = model_class(clamp_type, dt=model_dt, engine=engine, tabulate=tabulate)
+    neuron.store()
+    _scale_worker.update(neuron=neuron, base_input=ScaledInput(resolve(buffer), clamp_type, dt), dt=dt,
+                         duration=duration, hidden_state=resolve(hidden_state), Ni=Ni)
+
 
-        if freq > target and idx != 0:
+def _evaluate_scale(scale):
+    neuron = _scale_worker['neuron']
+    duration = _scale_worker['duration']
+    dt = _scale_worker['dt']
+
+    neuron.restore()
+    M, S = neuron.run(_scale_worker['base_input'].with_scale(scale), duration, _scale_worker['Ni'])
+    freq = S.num_spikes/(duration/1000)
+    spiketrain = make_spiketrain(S, duration, dt)
+    on_freq = get_on_freq(spiketrain, _scale_worker['hidden_state'], dt)
+    return freq, float(on_freq)
+
+
+def select_scale(scale_list, freq_list, on_freq_list, target, on_all_ratio, exhausted=False):
+    ''' Picks the scale closest to the target frequency from the scales that have been tried so far.
+
+        INPUT
+        scale_list (array): list of scales to try
+        freq_list (list): frequency of the scales that have been tried, in order
+        on_freq_list (list): frequency during the ON state of the scales that have been tried
+        target (int): target frequency for the simulation
+        on_all_ratio (float): how much more does the neuron need to fire during the ON state
+        exhausted (bool): whether all scales have been tried
+
+        OUTPUT
+        calibration (dict or None): the chosen scale, None if more scales have to be tried
+    '''
+    ideal = None
+    for idx in range(1, len(freq_list)):
+        if freq_list[idx] > target:
             # Check if prior or current scale is a better fit
-            if freq_diff_list[idx-1] <= freq_diff_list[idx]:
+            if abs(freq_list[idx-1] - target) <= abs(freq_list[idx] - target):
                 ideal = idx - 1
             else:
                 ideal = idx
+            break
+
+    if ideal is None:
+        if not exhausted:
+            return None
+        ideal = len(freq_list) - 1
+
+    # Check ON/All ratio
+    if freq_list[ideal] > 0:
+        ratio = on_freq_list[ideal]/freq_list[ideal]
+    else:
+        ratio = 0.
+    calibration = {'scale':float(scale_list[ideal]), 'freq':float(freq_list[ideal]), 'on_all_ratio':float(ratio),
+                   'accepted':bool(ratio >= on_all_ratio), 'overshoot':bool(freq_list[0] > target)}
+    return calibration
 
-            # Check ON/OFF ratio
-            if on_freq_list[ideal]/freq_list[ideal] >= on_all_ratio:
-                neuron.restore()
-                return scale_input_theory(input_theory, clamp_type, 0, scale_list[ideal], dt)
+
+class ScaledInput:
+    ''' Scaled input (current or conductance) that holds the unscaled input only once. The scale and
+        baseline are applied as parameters of the model neuron, so trying many scales doesn't copy
+        the input. Can be passed to the run function of the model neurons instead of a TimedArray.
+
+        INPUT
+        input_theory (array or tuple): theoretical input that has to be scaled; (g_exc, g_inh) if dynamic
+        clamp_type (str): 'current' or 'dynamic'
+        dt (float): time step of the simulation in milliseconds
+        scale (float): scaling factor
+        baseline (float): baseline in uA for current and mS for dynamic input
+    '''
+    def __init__(self, input_theory, clamp_type, dt, scale=1., baseline=0.):
+        dtype = precision.get_dtype()
+        if clamp_type == 'current':
+            buffer = np.asarray(input_theory, dtype=dtype)
+        elif clamp_type == 'dynamic':
+            buffer = tuple(np.asarray(g, dtype=dtype) for g in input_theory)
+        else:
+            raise ValueError('ClampType must be \'current\' or \'dynamic\'')
+
+        self.clamp_type = clamp_type
+        self.dt = dt
+        self.scale = scale
+        self.baseline = baseline
+
+        # Shared between all scaled copies of this input
+        self._shared = {'buffer':buffer, 'timed_arrays':None}
+
+    @property
+    def buffer(self):
+        ''' The unscaled input in the dtype of the precision policy; (g_exc, g_inh) if dynamic.
+        '''
+        return self._shared['buffer']
+
+    @property
+    def unit(self):
+        ''' Unit of the input, uA for current and mS for dynamic input.
+        '''
+        import brian2 as b2
+        if self.clamp_type == 'current':
+            return b2.uamp
+        return b2.mS
+
+    @property
+    def model_scale(self):
+        ''' Scale as injected in the model, including the conversion of the unit to SI.
+        '''
+        return self.scale * float(self.unit)
+
+    @property
+    def model_baseline(self):
+        ''' Baseline with its unit as injected in the model.
+        '''
+        return self.baseline * self.unit
+
+    def with_scale(self, scale, baseline=None):
+        ''' Get the same input with a different scale, without copying the input.
+
+            INPUT
+            scale (float): scaling factor
+            baseline (float): baseline, if None the current baseline is kept
+
+            OUTPUT
+            scaled_input (ScaledInput): input sharing the unscaled buffer and TimedArrays
+        '''
+        scaled_input = copy.copy(self)
+        scaled_input.scale = scale
+        if baseline is not None:
+            scaled_input.baseline = baseline
+        return scaled_input
+
+    def get_timed_arrays(self):
+        ''' Get the unscaled input as (a tuple of) brian2.TimedArray, which is only made once.
+            The TimedArray refers to the buffer without copying it, unless the buffer is float32:
+            Brian2 integrates in float64, so a float32 buffer is converted once.
+
+            OUTPUT
+            timed_arrays ((tuple of) brian2.TimedArray): inj_input or (g_exc, g_inh) without scaling
+        '''
+        if self._shared['timed_arrays'] is None:
+            import brian2 as b2
+            dim = b2.get_dimensions(self.unit)
+            if self.clamp_type == 'current':
+                timed_arrays = b2.TimedArray(b2.Quantity(np.asarray(self.buffer, dtype=np.float64), dim=dim),
+                                             dt=self.dt*b2.ms)
             else:
-                neuron.restore()
-                return False
-     
-    # When all scales have been tried
-    # Check for ON/All ratio
-    if on_freq/freq < on_all_ratio:
-        neuron.restore()
-        return False
+                timed_arrays = tuple(b2.TimedArray(b2.Quantity(np.asarray(g, dtype=np.float64), dim=dim), dt=self.dt*b2.ms)
+                                     for g in self.buffer)
+            self._shared['timed_arrays'] = timed_arrays
+        return self._shared['timed_arrays']
 
-    neuron.restore()
-    return scale_input_theory(input_theory, clamp_type, 0, scale_list[-1], dt)
-    
+    def scaled_values(self):
+        ''' Get the scaled input in uA for current and mS for dynamic input, in the dtype of the buffer.
+            This makes a copy.
 
+            OUTPUT
+            scaled_values (array or tuple): scaled input; (g_exc, g_inh) if dynamic
+        '''
+        if self.clamp_type == 'current':
+            return (self.baseline + self.buffer * self.scale).astype(self.buffer.dtype, copy=False)
+        return tuple((self.baseline + g * self.scale).astype(g.dtype, copy=False) for g in self.buffer)
+
+    def materialize(self):
+        ''' Get the scaled input as it would be returned by scale_input_theory.
+
+            OUTPUT
+            inj_input (brian2.TimedArray): the scaled input
+        '''
+        return scale_input_theory(self.buffer, self.clamp_type, self.baseline, self.scale, self.dt)
+
+
+
+@profiler.profiled('scale_input_theory')
 def scale_input_theory(input_theory, clamp_type, baseline, scale, dt):
     ''' Scales the theoretical current or dynamic input with a scaling factor. An unit is also added
         to the input uA for current and mS for dynamic input. 
@@ -104,15 +384,17 @@ def scale_input_theory(input_theory, clamp_type, baseline, scale, dt):
         dt (float): time step of the simulation in milliseconds
 
         OUTPUT
-        inj_input (brian2.TimedArray): the scaled input
+        inj_input (brian2.TimedArray): the scaled input, in float64 also for a reduced-precision input theory
     '''
+    import brian2 as b2
     if clamp_type == 'current':
+        input_theory = np.asarray(input_theory, dtype=np.float64)
         baseline = np.ones_like(input_theory, dtype=float)*baseline
         scaled_input = (baseline + input_theory * scale)*b2.uamp
         inject_input = b2.TimedArray(scaled_input, dt=dt*b2.ms)
 
     elif clamp_type == 'dynamic':
-        g_exc, g_inh = input_theory
+        g_exc, g_inh = (np.asarray(g, dtype=np.float64) for g in input_theory)
         g_inh = (baseline + g_inh * scale)*b2.mS
         g_exc = (baseline + g_exc * scale)*b2.mS
         g_exc = b2.TimedArray(g_exc, dt=dt*b2.ms)
@@ -138,7 +420,9 @@ def make_spiketrain(spikemon, duration, dt):
     spiketrain = np.zeros((1, int(duration/dt)), dtype=int)
 
     # Check the input and get index where a spike occured
-    if isinstance(spikemon, b2.SpikeMonitor):
+    if hasattr(spikemon, 't'):
+        # brian2.SpikeMonitor or a monitor of the native engine
+        import brian2 as b2
         spikeidx = np.array(spikemon.t/b2.ms/dt, dtype=int)
     elif isinstance(spikemon, (np.ndarray, list)):
         spikeidx = spikemon/dt
@@ -152,6 +436,47 @@ def make_spiketrain(spikemon, duration, dt):
     return spiketrain
 
 
+def run_chunked(neuron, inj_input, duration, chunk_duration, Ni, dt=None):
+    ''' Runs a model neuron in chunks and yields the spike train of every chunk, e.g. to feed an
+        OnlineMI estimator during long recordings. Only the spikes are recorded during the run, so
+        memory doesn't grow with the duration.
+
+        INPUT
+        neuron (Class): neuron model as found in models/models.py, with the brian2 engine
+        inj_input ((Tuple of) TimedArray or ScaledInput): input for the whole duration
+        duration (float): simulation time in milliseconds
+        chunk_duration (float): simulation time of a chunk in milliseconds
+        Ni (int): index of the neuron, the same neuron is used for every chunk
+        dt (float): time step in milliseconds, defaults to the time step of the neuron
+
+        OUTPUT
+        (start, spiketrain): index of the first time step and binary spike train of every chunk
+    '''
+    # Checks
+    if Ni is None:
+        raise ValueError('Ni must be given, every chunk has to simulate the same neuron')
+    if getattr(neuron, 'engine', 'brian2') != 'brian2':
+        raise ValueError('run_chunked needs the brian2 engine, '
+                         'the native engine starts every run from the initial state')
+    if dt is None:
+        dt = neuron.dt
+
+    import brian2 as b2
+
+    # The StateMonitor would record the whole duration
+    neuron.network.remove(neuron.M)
+    try:
+        n_spikes = 0
+        for start in np.arange(0, duration, chunk_duration):
+            chunk = min(chunk_duration, duration - start)
+            _, spikemon = neuron.run(inj_input, chunk, Ni)
+            spike_times = np.asarray(spikemon.t/b2.ms)[n_spikes:] - start
+            n_spikes = len(spikemon.t)
+            yield int(round(start/dt)), make_spiketrain(spike_times, chunk, dt)[0]
+    finally:
+        neuron.network.add(neuron.M)
+
+
 def get_spike_intervals(spikemon):
     ''' Determine the interval between all succesive spikes in milliseconds. 
 
@@ -161,18 +486,29 @@ def get_spike_intervals(spikemon):
         OUTPUT
         intervals (array): array containing all inter-spike intervals
     '''    
-    # Check the input and get the interval
-    intervals = []
-    if isinstance(spikemon, b2.SpikeMonitor):
-        for i in range(len(spikemon.t)-1):
-            intervals.append(abs(spikemon.t[i+1] - spikemon.t[i])/b2.ms)
-    elif isinstance(spikemon, (np.ndarray, list)):
-        for i in range(len(spikemon)-1):
-            intervals.append(abs(spikemon[i+1] - spikemon[i]))
-    else:
-        TypeError('Please provide SpikeMonitor or array of spiketimes')
+    return spike_statistics.get_isi(spikemon)
+
+
+def get_state_blocks(hidden_state):
+    ''' Run-length encoding of the hidden state into blocks of constant state.
+
+        INPUT
+        hidden_state (array): binary array representing the hidden state
+
+        OUTPUT
+        starts, stops, states (array, array, array): first and last (exclusive) index and the state of every block
+    '''
+    hidden_state = np.asarray(hidden_state).ravel()
+    if len(hidden_state) == 0:
+        empty = np.array([], dtype=int)
+        return empty, empty, hidden_state
 
-    return intervals
+    switches = np.flatnonzero(np.diff(hidden_state)) + 1
+    starts = np.concatenate(([0], switches))
+    stops = np.concatenate((switches, [len(hidden_state)]))
+    states = hidden_state[starts]
+
+    return starts, stops, states
 
 
 def get_on_index(hidden_state):
@@ -273,8 +609,8 @@ def get_on_freq(spiketrain, hidden_state, dt):
         on_freq (float): firing frequency of the neuron during the ON state
     '''
     on_spike_count = len(get_on_spikes(spiketrain, hidden_state))
-    on_duration = len(get_on_index(hidden_state))*dt*b2.ms
-    return (on_spike_count/on_duration)/b2.Hz
+    on_duration = len(get_on_index(hidden_state))*dt/1000
+    return on_spike_count/on_duration
     
 
 def get_on_off_isi(spikemon, hidden_state, dt):
@@ -288,47 +624,4 @@ def get_on_off_isi(spikemon, hidden_state, dt):
         OUPUT
         ON_isi, OFF_isi (array, array): two arrays containing the ISI during each block
     '''
-    # Check the input
-    if isinstance(spikemon, b2.SpikeMonitor):
-        spikemon = spikemon.t/b2.ms
-    spikemon = np.round(spikemon, 2)
-    
-    # Get hidden state indexes where a switch of state occurred
-    diff = np.diff(hidden_state)
-    switches = np.array([-1])
-    for idx, value in enumerate(diff):
-        if value != 0:
-            switches = np.append(switches, idx)
-    switches = np.append(switches, len(hidden_state) - 1)
-
-    # Seperate the hidden state in to blocks
-    block_array = []
-    for idx, switch in enumerate(switches[:-1]):        
-        start = switches[idx] + 1
-        stop = switches[idx + 1]
-        state = hidden_state[start]
-        block = (start, stop, state)
-        block_array.append(block)
-
-    # Check if a spike occured during a block
-    spikes_per_block = {1:[], 0:[]}
-    for block in block_array:
-        block_spikes = []
-        block_time = np.arange(block[0]*dt, block[1]*dt+dt, dt)
-        for t in block_time:
-            t = np.round(t, 2)
-            if t in spikemon:
-                block_spikes.append(t)
-        spikes_per_block[block[2]].append(block_spikes)
-
-    # Get the ISI for spikes in each block
-    on_isi = np.array([])
-    off_isi = np.array([])
-    for state in spikes_per_block:
-        for block in spikes_per_block[state]:
-            if state == 1:
-                on_isi = np.append(on_isi, np.diff(block))
-            elif state == 0:
-                off_isi = np.append(off_isi, np.diff(block))
-    
-    return on_isi, off_isi
+    return spike_statistics.get_state_isi(spikemon, hidden_state, dt)
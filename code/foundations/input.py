@@ -9,7 +9,7 @@
     Please cite this reference when using this method.
 '''
 import numpy as np
-import matplotlib.pyplot as plt
+from . import precision
 
 class Input():
     ''' Class that generates the input to the ANN (hidden state) and to the model neuron (input theory).
@@ -23,6 +23,7 @@ class Input():
         self.fHandle = [None, None]
         self.seed = None
         self.input = None
+        self.dtype = None      # float type of x and the input, None for the precision policy
 
         # For Markov models
         self.ron = None
@@ -233,13 +234,14 @@ class Input():
         else:
             xs = self.xfix
 
-        return xs
+        return precision.as_dtype(xs, self.dtype)
 
 
     def markov_input(self, dynamic=False):
         ''' Takes qon, qoff and hiddenstate and generates input.
             Optionally when dynamic is a dictinary of g0_values it
             generates a conductance over time based on the hidden state. 
+            The spikes are summed in float64, the input is returned in the dtype of the precision policy.
         '''
         xs = self.x
         nt = self.length 
@@ -291,7 +293,7 @@ class Input():
             stsum = np.convolve(stsum.flatten(), kernelf, mode='full')
 
         stsum = stsum[0:nt]
-        ip = stsum 
+        ip = precision.as_dtype(stsum, self.dtype)
 
         return ip
         
\ No newline at end of file
@@ -16,17 +16,19 @@
     NOTE Make sure that you save the hidden state & input theory with the experiments, it is
     essential for the information calculation!
 '''
-import os,sys,inspect
-current_dir = os.path.dirname(os.path.abspath(inspect.getfile(inspect.currentframe())))
-parent_dir = os.path.dirname(current_dir)
-sys.path.insert(0, parent_dir)
-
 import numpy as np
-import matplotlib.pyplot as plt
-from foundations.dynamic_clamp import get_g0
-from foundations.input import Input
-
-def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed=None):
+from .dynamic_clamp import get_g0
+from .input import Input
+from .population import Population
+from . import profiler
+from . import precision
+
+# From this many neurons the input is drawn with Population.markov_input, which bounds the memory of
+# the random numbers, instead of per neuron with Input.markov_input
+POPULATION_MIN_N = 10000
+
+@profiler.profiled('make_dynamic_experiments')
+def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean_firing_rate, sampling_rate, duration, seed=None, cache=None, N=1000, n_bins=None):
     ''' Make hidden state and let an ANN generate a theoretical input corresponding to that hidden state.
 
     INPUT
@@ -38,83 +40,165 @@ def make_dynamic_experiments(qon_qoff_type, baseline, tau, factor_ron_roff, mean
     sampling rate (int): Sampling rate of the experimental setup (injected current) in kilohertz
     duration (float): Length of the duration in milliseconds
     seed (optional): seed used in the random number generator
+    cache (StimulusCache, optional): cache in which the stimulus is looked up and stored, only used when a seed is provided
+    N (int): number of neurons in the ANN
+    n_bins (int, optional): generate the input with a Population whose neurons are merged in this many weight bins,
+                            for very large N. By default every neuron is drawn: with Input.markov_input below
+                            POPULATION_MIN_N neurons, and with Population.markov_input from POPULATION_MIN_N on
 
     OUTPUT
     [input_theory, dynamic_theory, hidden_state] (array): array containing theoretical input and hidden state
     input_theory (array): the theoretical current input
     dynamic_theory (array): the theoretical conductance input
     hidden_state: 1xN array with hidden state values 0=OFF 1=ON
+    The arrays have the dtype of the precision policy (foundations/precision.py).
     '''
+    # Look up the stimulus in the cache, only a seeded stimulus can be reproduced
+    use_cache = cache is not None and seed is not None
+    if use_cache:
+        cache_params = {'qon_qoff_type':qon_qoff_type, 'baseline':baseline, 'tau':tau,
+                        'factor_ron_roff':factor_ron_roff, 'mean_firing_rate':mean_firing_rate,
+                        'sampling_rate':sampling_rate, 'duration':duration, 'seed':seed, 'N':N, 'n_bins':n_bins,
+                        'dtype':precision.get_dtype().name}
+        stimulus = cache.get(cache_params)
+        if stimulus is not None:
+            return stimulus
+    
     # Set RNG seed, if no seed is provided
     if seed == None:
         np.random.seed()
         seed = np.random.randint(1000000000)
 
-    # Fixed parameters
-    N = 1000                            
-    dt = 1./sampling_rate
-    tau_exponential_kernel = 5 
-    alpha = np.sqrt(1/8)            # SEM * N
-    stdq = alpha*mean_firing_rate
-    ron = 1./(tau*(1+factor_ron_roff))
-    roff = factor_ron_roff*ron
-    v_rest = -65
-    Er_exc, Er_inh = (0, -75)
+    #Generate qon/qoff, hiddenstate and the input of the ANN
+    qon, qoff = make_qonqoff(qon_qoff_type, N, mean_firing_rate, seed)
+    hidden_state = make_hidden_state(tau, factor_ron_roff, sampling_rate, duration, seed)
+    input_theory, dynamic_theory = make_ann_input(qon, qoff, hidden_state, sampling_rate, duration, seed, n_bins)
+   
+    # #SanityCheck for input (Vm=-40) and hiddenstate
+    # fig, axs = plt.subplots(2, figsize=(12,12))
+    # fig.suptitle('Dynamic Clamp conductances')
+
+    # for idx, val in enumerate(hidden_state):
+    #     if val == 1:
+    #         axs[0].axvline(idx, c='lightgray')
+    #         axs[1].axvline(idx, c='lightgray')
+
+    # axs[0].plot(g_exc, c='red')
+    # axs[0].set(ylabel='Exc. conductance [mS]')
+
+    # axs[1].plot(g_inh, c='blue')
+    # axs[1].set(ylabel='Inh. conductance [mS]')
+    
+    # plt.show()
+
+    stimulus = [input_theory, dynamic_theory, hidden_state]
+    if use_cache:
+        cache.put(cache_params, stimulus)
+
+    return stimulus
+
 
-    #Create input from artifical network
+# Stages of make_dynamic_experiments, every stage seeds its own random number generator so the
+# stages can be computed separately (e.g. once for all sweep points that share them)
+def make_input_bayes(sampling_rate, duration, seed, tau=None, factor_ron_roff=None):
+    ''' Input object with the fixed parameters of the experiments.
+    '''
     input_bayes = Input()
-    input_bayes.dt = dt
+    input_bayes.dt = 1./sampling_rate
     input_bayes.T = duration
     input_bayes.kernel = 'exponential'
-    input_bayes.kerneltau = tau_exponential_kernel
-    input_bayes.ron = ron
-    input_bayes.roff = roff
+    input_bayes.kerneltau = 5
+    if tau is not None:
+        input_bayes.ron = 1./(tau*(1+factor_ron_roff))
+        input_bayes.roff = factor_ron_roff*input_bayes.ron
     input_bayes.seed = seed
     input_bayes.xseed = seed
+    return input_bayes
+
+
+def make_qonqoff(qon_qoff_type, N, mean_firing_rate, seed):
+    ''' Firing rates of the ANN neurons during the ON and OFF state.
+
+    INPUT
+    qon_qoff_type (str): The method of qon/qoff generation normal, balanced or balanced_uniform
+    N (int): number of neurons in the ANN
+    mean_firing_rate (int): Mean firing rate of the artificial neurons in kilohertz
+    seed (int): seed used in the random number generator
 
-    # Create qon/qoff
+    OUTPUT
+    qon, qoff (array, array): firing rates in kilohertz
+    '''
+    alpha = np.sqrt(1/8)            # SEM * N
     if qon_qoff_type == 'normal':
         mutheta = 1             #The summed difference between qon and qoff
-        alphan = alpha
         regime = 1
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff(mutheta, N, alphan, regime, seed)
+        return Input.create_qonqoff(mutheta, N, alpha, regime, seed)
     elif qon_qoff_type == 'balanced':
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff_balanced(N, mean_firing_rate, stdq, seed)
+        stdq = alpha*mean_firing_rate
+        return Input.create_qonqoff_balanced(N, mean_firing_rate, stdq, seed)
     elif qon_qoff_type == 'balanced_uniform':
         minq = 10                  
         maxq = 100
-        [input_bayes.qon, input_bayes.qoff] = input_bayes.create_qonqoff_balanced_uniform(N, minq, maxq, seed)
+        return Input.create_qonqoff_balanced_uniform(N, minq, maxq, seed)
     else: 
         raise SyntaxError('No qon/qoff creation type specified')
-    
-    #Generate weights and hiddenstate
-    input_bayes.get_all()
-    input_bayes.x = input_bayes.markov_hiddenstate()
-
-    #Generate exc and inh
-    g0_exc, g0_inh = get_g0(v_rest, input_bayes.w, Er_exc, Er_inh)
-    g_exc = input_bayes.markov_input(g0_exc)
-    g_inh = input_bayes.markov_input(g0_inh)
-    dynamic_theory = (g_exc, g_inh)
-
-    #Generate input_current for comparison
-    input_theory = input_bayes.markov_input()
-   
-    # #SanityCheck for input (Vm=-40) and hiddenstate
-    # fig, axs = plt.subplots(2, figsize=(12,12))
-    # fig.suptitle('Dynamic Clamp conductances')
 
-    # for idx, val in enumerate(input_bayes.x):
-    #     if val == 1:
-    #         axs[0].axvline(idx, c='lightgray')
-    #         axs[1].axvline(idx, c='lightgray')
 
-    # axs[0].plot(g_exc, c='red')
-    # axs[0].set(ylabel='Exc. conductance [mS]')
+def make_hidden_state(tau, factor_ron_roff, sampling_rate, duration, seed):
+    ''' Hidden state of the experiments.
 
-    # axs[1].plot(g_inh, c='blue')
-    # axs[1].set(ylabel='Inh. conductance [mS]')
-    
-    # plt.show()
+    INPUT
+    tau (ms): Switching speed of the hidden state in milliseconds
+    factor_ron_roff (float): ratio determining the occurance of the ON and OFF state
+    sampling rate (int): Sampling rate of the experimental setup in kilohertz
+    duration (float): Length of the duration in milliseconds
+    seed (int): seed used in the random number generator
+
+    OUTPUT
+    hidden_state: 1xN array with hidden state values 0=OFF 1=ON
+    '''
+    input_bayes = make_input_bayes(sampling_rate, duration, seed, tau, factor_ron_roff)
+    input_bayes.get_tvec()
+    return input_bayes.markov_hiddenstate()
+
+
+def make_ann_input(qon, qoff, hidden_state, sampling_rate, duration, seed, n_bins=None):
+    ''' Theoretical current and conductance input that the ANN generates for a hidden state.
+
+    INPUT
+    qon, qoff (array, array): firing rates of the ANN neurons in kilohertz, see make_qonqoff
+    hidden_state (array): hidden state, see make_hidden_state
+    sampling rate (int): Sampling rate of the experimental setup in kilohertz
+    duration (float): Length of the duration in milliseconds
+    seed (int): seed used in the random number generator
+    n_bins (int, optional): see make_dynamic_experiments
+
+    OUTPUT
+    input_theory, dynamic_theory (array, tuple): the theoretical current and conductance (g_exc, g_inh) input
+    '''
+    dt = 1./sampling_rate
+    v_rest = -65
+    Er_exc, Er_inh = (0, -75)
 
-    return [input_theory, dynamic_theory, input_bayes.x]
+    input_bayes = make_input_bayes(sampling_rate, duration, seed)
+    input_bayes.qon, input_bayes.qoff = qon, qoff
+    # Only the time vector and weights are needed, tau and p0 belong to the hidden state
+    input_bayes.get_tvec()
+    input_bayes.get_w()
+    input_bayes.x = hidden_state
+
+    if n_bins is not None or len(np.ravel(qon)) >= POPULATION_MIN_N:
+        #Generate current, exc and inh input from the same (binned) population
+        population = Population(input_bayes.qon, input_bayes.qoff)
+        g0_exc, g0_inh = population.get_g0(v_rest, Er_exc, Er_inh)
+        input_theory, g_exc, g_inh = population.markov_input(input_bayes.x, dt, [population.w, g0_exc, g0_inh], seed,
+                                                             input_bayes.kernel, input_bayes.kerneltau, n_bins)
+    else:
+        #Generate exc and inh
+        g0_exc, g0_inh = get_g0(v_rest, input_bayes.w, Er_exc, Er_inh)
+        g_exc = input_bayes.markov_input(g0_exc)
+        g_inh = input_bayes.markov_input(g0_inh)
+
+        #Generate input_current for comparison
+        input_theory = input_bayes.markov_input()
+    return input_theory, (g_exc, g_inh)
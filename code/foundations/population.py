@@ -0,0 +1,140 @@
+''' population.py
+
+    This file contains a flat-array representation of the artificial neural network (ANN), used to
+    generate the input of very large populations (1e5-1e6 neurons).
+
+    Input.markov_input draws the spikes of every neuron in a loop over neurons. Here the spikes are
+    drawn for blocks of neurons and time steps at once, within a fixed memory budget. Optionally,
+    neurons with similar weights are merged in weight bins: the summed spike count of the neurons of
+    a bin is drawn as a single Poisson source with the summed rate, so the cost no longer depends on
+    the number of neurons.
+'''
+import numpy as np
+from . import precision
+
+# Memory used for the random numbers of one block of neurons and time steps, in bytes
+MEMORY_BUDGET = 256*1024**2
+
+
+class Population:
+    ''' Population of ANN neurons stored as flat arrays.
+
+        INPUT
+        qon, qoff (array): firing rate of every neuron during the ON and OFF state in kHz, e.g. from Input.create_qonqoff*
+        dtype (numpy.dtype): float type of the arrays, float32 halves the memory. Defaults to the precision policy
+    '''
+    def __init__(self, qon, qoff, dtype=None):
+        self.dtype = precision.get_dtype(dtype)
+        self.qon = np.asarray(qon, dtype=self.dtype).ravel()
+        self.qoff = np.asarray(qoff, dtype=self.dtype).ravel()
+        if self.qon.shape != self.qoff.shape:
+            raise ValueError('qon and qoff must have the same number of neurons')
+        self.w = np.log(self.qon/self.qoff)
+
+    def __len__(self):
+        return len(self.qon)
+
+    def get_g0(self, v_rest, Er_exc, Er_inh):
+        ''' Base conductance of every neuron, split into excitatory and inhibitory neurons
+            as in dynamic_clamp.get_g0.
+
+            INPUT
+            v_rest(int): resting membrane potential of the neurons in mV.
+            Er_exc/inh(int): reversal potential of exc. and inh. neurons in mV.
+
+            OUTPUT
+            g0_exc, g0_inh (array, array): base conductance of every neuron, 0 for neurons of the other type
+        '''
+        excitatory = self.w > 0
+        g0_exc = np.where(excitatory, np.abs(self.w / (Er_exc - v_rest)), 0).astype(self.dtype)
+        g0_inh = np.where(excitatory, 0, np.abs(self.w / (Er_inh - v_rest))).astype(self.dtype)
+        return g0_exc, g0_inh
+
+    def aggregate(self, weights, n_bins):
+        ''' Merges neurons with similar weights into Poisson sources. The bins are spaced evenly
+            between the smallest and largest weight w, with a bin edge at 0 so that excitatory and
+            inhibitory neurons are never merged.
+
+            INPUT
+            weights (list of array): weights of every neuron, e.g. [w, g0_exc, g0_inh]
+            n_bins (int): number of weight bins
+
+            OUTPUT
+            bin_weights (array): mean of every weight over the neurons of every bin, (len(weights), n_bins)
+            rate_on, rate_off (array, array): summed firing rates of the neurons of every bin
+        '''
+        edges = np.linspace(self.w.min(), self.w.max(), n_bins + 1)
+        if edges[0] < 0 < edges[-1]:
+            edges[np.argmin(np.abs(edges))] = 0
+        bins = np.clip(np.searchsorted(edges, self.w, side='right') - 1, 0, n_bins - 1)
+
+        counts = np.bincount(bins, minlength=n_bins)
+        occupied = counts > 0
+        bin_weights = np.array([np.bincount(bins, weights=weight, minlength=n_bins)[occupied] / counts[occupied]
+                                for weight in weights])
+        rate_on = np.bincount(bins, weights=self.qon, minlength=n_bins)[occupied]
+        rate_off = np.bincount(bins, weights=self.qoff, minlength=n_bins)[occupied]
+        return bin_weights, rate_on, rate_off
+
+    def markov_input(self, x, dt, weights=None, seed=None, kernel='exponential', kerneltau=5, n_bins=None,
+                     memory_budget=MEMORY_BUDGET):
+        ''' Takes the hidden state and generates the weighted, filtered spike trains of the population.
+            All weights are applied to the same spike trains.
+
+            INPUT
+            x (array): binary array representing the hidden state
+            dt (float): time step in ms
+            weights (array or list of array): weights of every neuron, defaults to w (current input)
+            seed (int): seed of the random number generator
+            kernel (str): 'exponential', 'delta' or None
+            kerneltau (float): time constant of the exponential kernel in ms
+            n_bins (int): merge the neurons in this many weight bins, None to draw every neuron
+            memory_budget (int): bytes used for the random numbers of one block
+
+            OUTPUT
+            ip (array or list of array): input for every weight vector
+        '''
+        single = weights is None or not isinstance(weights, (list, tuple))
+        if weights is None:
+            weights = self.w
+        weights = [weights] if single else list(weights)
+        weights = np.array([np.asarray(weight, dtype=precision.ACCUMULATE).ravel() for weight in weights])
+
+        x = np.asarray(x).ravel()
+        nt = len(x)
+        rng = np.random.default_rng(seed)
+        stsum = np.zeros((len(weights), nt))
+
+        if n_bins is None:
+            # Draw every neuron, in blocks of neurons and time steps
+            chunk_t = min(nt, 65536)
+            chunk_n = int(max(1, memory_budget // (32*chunk_t)))
+            for t0 in range(0, nt, chunk_t):
+                on = x[t0:t0+chunk_t] == 1
+                for n0 in range(0, len(self), chunk_n):
+                    p_on = self.qon[n0:n0+chunk_n, np.newaxis]*dt
+                    p_off = self.qoff[n0:n0+chunk_n, np.newaxis]*dt
+                    spikes = rng.random((len(p_on), len(on)), dtype=self.dtype) < np.where(on, p_on, p_off)
+                    stsum[:, t0:t0+chunk_t] += weights[:, n0:n0+chunk_n] @ spikes
+        else:
+            # Draw the summed spike count of every weight bin
+            bin_weights, rate_on, rate_off = self.aggregate(weights, n_bins)
+            chunk_t = int(max(1, memory_budget // (16*len(rate_on))))
+            for t0 in range(0, nt, chunk_t):
+                on = x[t0:t0+chunk_t] == 1
+                lam = np.where(on, rate_on[:, np.newaxis]*dt, rate_off[:, np.newaxis]*dt)
+                stsum[:, t0:t0+chunk_t] = bin_weights @ rng.poisson(lam)
+
+        # Filter with the kernel
+        if kernel == 'exponential':
+            tfilt = np.arange(0, 5*kerneltau+dt, dt)
+            kernelf = np.exp(-tfilt/kerneltau)
+            kernelf = kernelf/(dt*sum(kernelf))
+            ip = [np.convolve(row, kernelf, mode='full')[0:nt] for row in stsum]
+        elif kernel == 'delta':
+            ip = list(stsum/dt)
+        else:
+            ip = list(stsum)
+
+        ip = [row.astype(self.dtype, copy=False) for row in ip]
+        return ip[0] if single else ip
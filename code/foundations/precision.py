@@ -0,0 +1,107 @@
+''' precision.py
+
+    This file contains the dtype policy for stimuli and recordings. By default all arrays are
+    float64; in reduced-precision mode the stimuli (input theory, conductances, hidden state), the
+    hidden state estimates and the stored recordings are float32, which halves memory and disk for
+    long sweeps. The integration of the log-likelihood L and the entropy sums of the mutual
+    information are always done in float64.
+
+    Set the policy with precision.set_dtype('float32') or with the DCIP_DTYPE environment variable.
+'''
+import os
+
+import numpy as np
+
+# Accumulations that the mutual information depends on
+ACCUMULATE = np.float64
+
+# Largest relative change of the MI estimates accepted in reduced precision, see validate_mi
+MI_TOLERANCE = 1e-3
+
+_state = {'dtype':np.dtype(np.float64)}
+
+
+def set_dtype(dtype):
+    ''' Set the float type of stimuli and recordings.
+
+        INPUT
+        dtype (str or numpy.dtype): 'float32' or 'float64'
+    '''
+    dtype = np.dtype(dtype)
+    if dtype not in (np.float32, np.float64):
+        raise ValueError('dtype must be float32 or float64')
+    _state['dtype'] = dtype
+
+
+def get_dtype(dtype=None):
+    ''' Get the float type of stimuli and recordings.
+
+        INPUT
+        dtype (str or numpy.dtype, optional): overrides the policy when given
+
+        OUTPUT
+        dtype (numpy.dtype)
+    '''
+    if dtype is not None:
+        return np.dtype(dtype)
+    return _state['dtype']
+
+
+def as_dtype(array, dtype=None):
+    ''' Converts a floating point array to the policy dtype, other arrays (spike counts,
+        booleans) are returned unchanged. Doesn't copy if the array already has the dtype.
+
+        INPUT
+        array (array): array to convert
+        dtype (str or numpy.dtype, optional): overrides the policy when given
+
+        OUTPUT
+        array (numpy.ndarray)
+    '''
+    array = np.asarray(array)
+    if not np.issubdtype(array.dtype, np.floating):
+        return array
+    return array.astype(get_dtype(dtype), copy=False)
+
+
+def validate_mi(ron, roff, x, input_theory, dt, theta, spiketrain, dtype=np.float32, tolerance=MI_TOLERANCE):
+    ''' Compares the mutual information estimated from a stimulus and spike train in float64
+        with the estimate from the same data stored in reduced precision.
+
+        INPUT
+        ron, roff (kHz): switching speed of the hidden state
+        x (array): hidden state
+        input_theory (array): unscaled input current
+        dt (float): time step in ms
+        theta (float): see analyze_exp
+        spiketrain (array): binary spike train
+        dtype (numpy.dtype): reduced precision type
+        tolerance (float): largest accepted relative change of MI_i and MI
+
+        OUTPUT
+        report (dict): MI_i and MI in both precisions, their relative change and 'passed'
+    '''
+    from .MI_calculation import analyze_exp
+
+    old_dtype = get_dtype()
+    try:
+        set_dtype(np.float64)
+        reference = analyze_exp(ron, roff, as_dtype(x), as_dtype(input_theory), dt, theta, np.atleast_2d(spiketrain))
+        set_dtype(dtype)
+        reduced = analyze_exp(ron, roff, as_dtype(x), as_dtype(input_theory), dt, theta, np.atleast_2d(spiketrain))
+    finally:
+        set_dtype(old_dtype)
+
+    report = {'dtype':np.dtype(dtype).name, 'passed':True}
+    for key in ('MI_i', 'MI'):
+        ref_value = float(reference[key][0])
+        value = float(reduced[key][0])
+        change = abs(value - ref_value) / max(abs(ref_value), np.finfo(float).tiny)
+        report[key] = (ref_value, value)
+        report[key + '_change'] = change
+        report['passed'] = report['passed'] and change <= tolerance
+    return report
+
+
+if os.environ.get('DCIP_DTYPE'):
+    set_dtype(os.environ['DCIP_DTYPE'])
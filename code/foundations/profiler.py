@@ -0,0 +1,231 @@
+''' profiler.py
+
+    This file contains a lightweight profiler for the stages of the protocol: input generation,
+    input scaling, simulation and mutual information estimation. Every profiled stage writes one
+    JSON record per call to a JSON lines file, with the wall and CPU time, the memory high-water
+    mark and, for simulations, the split between Brian2 code generation and running.
+
+    The profiler is disabled by default and then costs a single dictionary lookup per call. Enable
+    it with profiler.enable('profile.jsonl') or by setting the DCIP_PROFILE environment variable to
+    the path of the output file.
+'''
+import os
+import sys
+import json
+import time
+import functools
+try:
+    import resource
+except ImportError:
+    resource = None
+import tracemalloc
+
+_state = {'enabled':False, 'file':None, 'run_id':None, 'trace_memory':False, 'stack':[]}
+
+
+def enable(path='profile.jsonl', run_id=None, trace_memory=False):
+    ''' Start writing profiling records.
+
+        INPUT
+        path (str): JSON lines file to which the records are appended
+        run_id (str): identifier added to every record, defaults to the process id and start time
+        trace_memory (bool): also track the peak of Python allocations per stage with tracemalloc (slow)
+    '''
+    disable()
+    if run_id is None:
+        run_id = '%d-%d' % (os.getpid(), time.time())
+    _state['file'] = open(path, 'a')
+    _state['run_id'] = run_id
+    _state['trace_memory'] = trace_memory
+    if trace_memory and not tracemalloc.is_tracing():
+        tracemalloc.start()
+    _state['enabled'] = True
+
+
+def disable():
+    ''' Stop writing profiling records.
+    '''
+    _state['enabled'] = False
+    if _state['file'] is not None:
+        _state['file'].close()
+        _state['file'] = None
+    if _state['trace_memory'] and tracemalloc.is_tracing():
+        tracemalloc.stop()
+    _state['trace_memory'] = False
+
+
+def is_enabled():
+    return _state['enabled']
+
+
+def get_max_rss():
+    ''' Memory high-water mark of the process in megabytes, None when unavailable.
+    '''
+    if resource is None:
+        return None
+    max_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    if sys.platform == 'darwin':
+        return max_rss / 1024**2
+    return max_rss / 1024
+
+
+def record(stage, **info):
+    ''' Write a profiling record, does nothing when the profiler is disabled.
+
+        INPUT
+        stage (str): name of the stage
+        info: additional fields of the record, must be JSON serializable
+    '''
+    if not _state['enabled']:
+        return
+    entry = {'run_id':_state['run_id'], 'pid':os.getpid(), 'time':time.time(), 'stage':stage}
+    entry.update(info)
+    _state['file'].write(json.dumps(entry, default=str) + '\n')
+    _state['file'].flush()
+
+
+class _Timer:
+    ''' Context manager that times a stage and writes its record on exit.
+
+        tracemalloc keeps one peak for the whole process, so every timer on the stack keeps its own:
+        the peak is reset when a stage starts or ends, and the peak reached until then is added
+        to the stage that encloses it.
+    '''
+    def __init__(self, stage, info):
+        self.stage = stage
+        self.info = info
+        self.peak = 0
+
+    def __enter__(self):
+        parent = _state['stack'][-1] if _state['stack'] else None
+        self.parent = parent.stage if parent is not None else None
+        if _state['trace_memory']:
+            if parent is not None:
+                parent.peak = max(parent.peak, tracemalloc.get_traced_memory()[1])
+            tracemalloc.reset_peak()
+        _state['stack'].append(self)
+        self.cpu_start = time.process_time()
+        self.wall_start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall = time.perf_counter() - self.wall_start
+        cpu = time.process_time() - self.cpu_start
+        _state['stack'].pop()
+        if _state['trace_memory']:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            self.info['peak_traced_mb'] = self.peak / 1024**2
+            if _state['stack']:
+                _state['stack'][-1].peak = max(_state['stack'][-1].peak, self.peak)
+            tracemalloc.reset_peak()
+        record(self.stage, wall_s=wall, cpu_s=cpu, max_rss_mb=get_max_rss(), parent=self.parent,
+               failed=exc_type is not None, **self.info)
+        return False
+
+
+class _NullTimer:
+    ''' Context manager that does nothing, used when the profiler is disabled.
+    '''
+    def __init__(self):
+        self.info = {}
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+_null_timer = _NullTimer()
+
+
+def timed(stage, **info):
+    ''' Context manager that times the enclosed code.
+        Fields added to timer.info inside the block are included in the record.
+
+        INPUT
+        stage (str): name of the stage
+        info: additional fields of the record
+
+        OUTPUT
+        timer (context manager)
+    '''
+    if not _state['enabled']:
+        _null_timer.info.clear()
+        return _null_timer
+    return _Timer(stage, info)
+
+
+def profiled(stage=None):
+    ''' Decorator that times every call of a function.
+
+        INPUT
+        stage (str): name of the stage, defaults to the name of the function
+    '''
+    def decorator(func):
+        name = stage or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _state['enabled']:
+                return func(*args, **kwargs)
+            with _Timer(name, {}):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def brian2_split(network, wall):
+    ''' Split the wall time of a Brian2 run in code generation (including compilation and setup)
+        and the time spent running the simulation loop. The split is best-effort: Brian2 has no
+        public timing of a whole run, so the run time is read from the private attribute
+        Network._last_run_time. When a Brian2 version doesn't have it, the split is marked unavailable.
+
+        INPUT
+        network (brian2.Network): the network that has just been run
+        wall (float): wall time of the run in seconds
+
+        OUTPUT
+        split (dict): 'brian2_codegen_s' and 'brian2_run_s', or 'brian2_split':'unavailable'
+    '''
+    run_time = getattr(network, '_last_run_time', None)
+    if run_time is None:
+        return {'brian2_split':'unavailable'}
+    return {'brian2_codegen_s':max(wall - run_time, 0.), 'brian2_run_s':run_time}
+
+
+def read_records(path):
+    ''' Read the records of a profiling file.
+
+        INPUT
+        path (str): JSON lines file written by the profiler
+
+        OUTPUT
+        records (list of dict)
+    '''
+    with open(path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def summarize(records):
+    ''' Summarize profiling records per stage.
+
+        INPUT
+        records (list of dict): records as returned by read_records
+
+        OUTPUT
+        summary (dict): per stage the number of calls, total and mean wall time and the maximal memory high-water mark
+    '''
+    summary = {}
+    for entry in records:
+        stage = summary.setdefault(entry['stage'], {'calls':0, 'wall_s':0., 'max_rss_mb':0.})
+        stage['calls'] += 1
+        stage['wall_s'] += entry.get('wall_s', 0.)
+        stage['max_rss_mb'] = max(stage['max_rss_mb'], entry.get('max_rss_mb') or 0.)
+    for stage in summary.values():
+        stage['mean_wall_s'] = stage['wall_s'] / stage['calls']
+    return summary
+
+
+if os.environ.get('DCIP_PROFILE'):
+    enable(os.environ['DCIP_PROFILE'])
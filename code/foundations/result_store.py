@@ -0,0 +1,229 @@
+''' result_store.py
+
+    This file contains the result store, which saves the arrays of a simulation run (stimulus,
+    recordings and spike times) as .npy files in a directory per run. The arrays are read back
+    memory-mapped, so a window of a long recording can be read without loading the whole array.
+    Optionally a min/max pyramid of every trace is stored with a run, from which the viewer in
+    visualization/viewer.py reads a window at the resolution of the screen.
+'''
+import os
+import json
+import shutil
+import tempfile
+
+import numpy as np
+from . import precision
+
+# Every level of a pyramid combines PYRAMID_FACTOR bins of the previous level, the coarsest
+# level has at least PYRAMID_MIN_LENGTH bins
+PYRAMID_FACTOR = 4
+PYRAMID_MIN_LENGTH = 1024
+
+
+def build_pyramid(trace, factor=PYRAMID_FACTOR, min_length=PYRAMID_MIN_LENGTH):
+    ''' Builds the min/max pyramid of a trace.
+
+        INPUT
+        trace (array): values of every sample
+        factor (int): number of bins of a level that are combined in one bin of the next level
+        min_length (int): the coarsest level has at least this many bins
+
+        OUTPUT
+        levels (list): (mins, maxs) of level 1, 2, ...; level k has one bin per factor**k samples
+    '''
+    trace = np.asarray(trace).ravel()
+    levels = []
+    mins, maxs = trace, trace
+    while len(mins) >= factor*min_length:
+        n_bins = int(np.ceil(len(mins)/factor))
+        padding = n_bins*factor - len(mins)
+        # Pad with the last value so the last, incomplete, bin is correct
+        mins = np.pad(mins, (0, padding), mode='edge').reshape(n_bins, factor).min(axis=1)
+        maxs = np.pad(maxs, (0, padding), mode='edge').reshape(n_bins, factor).max(axis=1)
+        levels.append((mins, maxs))
+    return levels
+
+
+def pyramid_name(name, kind, level):
+    ''' Name under which level of the pyramid of a trace is stored, kind is 'min' or 'max'.
+    '''
+    return '%s_pyramid_%s_%d' % (name, kind, level)
+
+
+class ResultStore:
+    ''' Directory of simulation results with one sub-directory per run.
+
+        INPUT
+        root (str): directory in which the runs are stored
+        dtype (numpy.dtype): float type in which floating point arrays are stored, defaults to the
+                             precision policy. Integer and boolean arrays are stored unchanged.
+        exact (list): names of arrays that are always stored in float64. Spike times (names ending
+                      in 'spikes') are always exact, float32 can't resolve dt in recordings of hours.
+        pyramids (bool or list): store the min/max pyramid of these traces with every saved run, True
+                                 for every 1D array except spike times. Traces shorter than
+                                 PYRAMID_FACTOR*PYRAMID_MIN_LENGTH samples get none.
+    '''
+    def __init__(self, root='results', dtype=None, exact=(), pyramids=False):
+        self.root = root
+        self.dtype = dtype
+        self.exact = set(exact)
+        self.pyramids = pyramids
+        os.makedirs(root, exist_ok=True)
+
+    def _pyramid_names(self, arrays):
+        if self.pyramids is True:
+            return [name for name, array in arrays.items()
+                    if np.ndim(array) == 1 and not name.endswith('spikes')]
+        return [name for name in (self.pyramids or []) if name in arrays]
+
+    def _make_pyramids(self, arrays, names):
+        # The levels of the pyramids of the traces and their entry in the meta data
+        pyramid_arrays = {}
+        pyramids = {}
+        for name in names:
+            levels = build_pyramid(arrays[name])
+            for level, (mins, maxs) in enumerate(levels, start=1):
+                pyramid_arrays[pyramid_name(name, 'min', level)] = mins
+                pyramid_arrays[pyramid_name(name, 'max', level)] = maxs
+            pyramids[name] = {'factor':PYRAMID_FACTOR, 'levels':len(levels)}
+        return pyramid_arrays, pyramids
+
+    def _as_stored(self, name, array):
+        if name in self.exact or name.endswith('spikes'):
+            return precision.as_dtype(array, np.float64)
+        return precision.as_dtype(array, self.dtype)
+
+    def path(self, run_id, name=None):
+        if name is None:
+            return os.path.join(self.root, str(run_id))
+        return os.path.join(self.root, str(run_id), name + '.npy')
+
+    def save(self, run_id, arrays, meta=None, overwrite=False):
+        ''' Save the arrays of a run. The run is written to a temporary directory first and then
+            moved in place, so a run is either complete or absent.
+
+            INPUT
+            run_id (str): identifier of the run
+            arrays (dict): arrays to store with their name as key
+            meta (dict): JSON serializable information about the run (parameters, units, dt)
+            overwrite (bool): replace an existing run with the same identifier
+        '''
+        path = self.path(run_id)
+        if os.path.isdir(path) and not overwrite:
+            raise FileExistsError('Run %s already exists' % run_id)
+
+        meta = dict(meta or {})
+        pyramid_names = self._pyramid_names(arrays)
+        if pyramid_names:
+            pyramid_arrays, meta['pyramids'] = self._make_pyramids(arrays, pyramid_names)
+            arrays = dict(arrays, **pyramid_arrays)
+
+        tmp_path = tempfile.mkdtemp(dir=self.root, prefix='.tmp_')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp_path, name + '.npy'), self._as_stored(name, array))
+        with open(os.path.join(tmp_path, 'meta.json'), 'w') as f:
+            json.dump(meta, f, indent=1, default=str)
+
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.rename(tmp_path, path)
+
+    def add(self, run_id, arrays, meta=None):
+        ''' Add arrays (and meta data) to an existing run. Every file is replaced atomically.
+
+            INPUT
+            run_id (str): identifier of the run
+            arrays (dict): arrays to store with their name as key
+            meta (dict): entries added to the meta data of the run
+        '''
+        path = self.path(run_id)
+        for name, array in arrays.items():
+            fd, tmp_path = tempfile.mkstemp(dir=path, prefix='.tmp_', suffix='.npy')
+            with os.fdopen(fd, 'wb') as f:
+                np.save(f, self._as_stored(name, array))
+            os.replace(tmp_path, self.path(run_id, name))
+
+        if meta:
+            run_meta = self.meta(run_id)
+            run_meta.update(meta)
+            fd, tmp_path = tempfile.mkstemp(dir=path, prefix='.tmp_', suffix='.json')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(run_meta, f, indent=1, default=str)
+            os.replace(tmp_path, os.path.join(path, 'meta.json'))
+
+    def add_pyramids(self, run_id, names):
+        ''' Build and store the pyramids of traces of a run that was saved without them.
+
+            INPUT
+            run_id (str): identifier of the run
+            names (list): names of the traces
+        '''
+        arrays = {name:self.load(run_id, name) for name in names}
+        pyramid_arrays, pyramids = self._make_pyramids(arrays, names)
+        self.add(run_id, pyramid_arrays, {'pyramids':dict(self.meta(run_id).get('pyramids', {}), **pyramids)})
+
+    def has(self, run_id):
+        return os.path.isfile(os.path.join(self.path(run_id), 'meta.json'))
+
+    def runs(self):
+        ''' Identifiers of all stored runs.
+        '''
+        return sorted(run_id for run_id in os.listdir(self.root)
+                      if not run_id.startswith('.') and self.has(run_id))
+
+    def names(self, run_id, pyramids=False):
+        ''' Names of the arrays stored for a run, the levels of the pyramids only if pyramids is True.
+        '''
+        names = sorted(f[:-4] for f in os.listdir(self.path(run_id)) if f.endswith('.npy'))
+        if pyramids:
+            return names
+        return [name for name in names if '_pyramid_' not in name]
+
+    def meta(self, run_id):
+        with open(os.path.join(self.path(run_id), 'meta.json')) as f:
+            return json.load(f)
+
+    def load(self, run_id, name, mmap=True):
+        ''' Load an array of a run.
+
+            INPUT
+            run_id (str): identifier of the run
+            name (str): name of the array
+            mmap (bool): memory-map the array (read-only) instead of reading it into memory
+
+            OUTPUT
+            array (numpy.ndarray or numpy.memmap)
+        '''
+        return np.load(self.path(run_id, name), mmap_mode='r' if mmap else None)
+
+    def window(self, run_id, name, start, stop):
+        ''' Read samples start:stop of an array, only this window is read from disk.
+
+            INPUT
+            run_id (str): identifier of the run
+            name (str): name of the array
+            start, stop (int): first and last (exclusive) sample along the last axis
+
+            OUTPUT
+            window (numpy.ndarray)
+        '''
+        array = self.load(run_id, name)
+        return np.array(array[..., start:stop])
+
+    def iter_chunks(self, run_id, name, chunk_size):
+        ''' Iterate over an array in chunks along the last axis, for analyses that stream over long recordings.
+
+            INPUT
+            run_id (str): identifier of the run
+            name (str): name of the array
+            chunk_size (int): number of samples per chunk
+
+            OUTPUT
+            (start, chunk): first sample and samples of every chunk
+        '''
+        array = self.load(run_id, name)
+        for start in range(0, array.shape[-1], chunk_size):
+            yield start, np.array(array[..., start:start+chunk_size])
+
+    def delete(self, run_id):
+        shutil.rmtree(self.path(run_id), ignore_errors=True)
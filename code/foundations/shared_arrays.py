@@ -0,0 +1,161 @@
+''' shared_arrays.py
+
+    This file contains the distribution of large arrays (stimuli, hidden states, L traces) to worker
+    processes without copying. The runner publishes an array once in multiprocessing.shared_memory or
+    in a memory-mapped .npy file and sends the workers an ArrayHandle, which pickles to a few hundred
+    bytes. A worker opens the handle as a read-only NumPy view of the same memory, which can be passed
+    to ScaledInput, scale_input_theory or analyze_exp like any other array.
+'''
+import os
+import sys
+import shutil
+import tempfile
+from multiprocessing import shared_memory
+
+import numpy as np
+
+# Arrays smaller than this are sent to the workers as they are, in bytes
+MIN_SHARED_BYTES = 1024**2
+
+# Shared memory segments opened by this process, a view is only valid while its segment is open
+_opened = {}
+
+
+class ArrayHandle:
+    ''' Picklable reference to an array published by SharedArrays.
+
+        INPUT
+        shape (tuple): shape of the array
+        dtype (str): dtype of the array
+        shm_name (str): name of the shared memory segment, or
+        path (str): path of the .npy file
+    '''
+    def __init__(self, shape, dtype, shm_name=None, path=None):
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype).str
+        self.shm_name = shm_name
+        self.path = path
+
+    @property
+    def nbytes(self):
+        return int(np.prod(self.shape)) * np.dtype(self.dtype).itemsize
+
+    def open(self):
+        ''' Get the array as a read-only view of the shared memory or file, without copying.
+
+            OUTPUT
+            array (numpy.ndarray or numpy.memmap)
+        '''
+        if self.path is not None:
+            return np.load(self.path, mmap_mode='r')
+
+        if self.shm_name not in _opened:
+            _opened[self.shm_name] = _attach(self.shm_name)
+        array = np.ndarray(self.shape, dtype=self.dtype, buffer=_opened[self.shm_name].buf)
+        array.flags.writeable = False
+        return array
+
+
+class SharedArrays:
+    ''' Publishes arrays for worker processes and removes them again on close. Use as a context
+        manager around the worker pool:
+
+            with SharedArrays() as shared:
+                handle = shared.publish(input_theory)
+                pool.submit(func, handle)    # the worker calls resolve(handle)
+
+        INPUT
+        directory (str, optional): publish as memory-mapped .npy files in a temporary directory
+                                   in this directory instead of in shared memory, e.g. when
+                                   /dev/shm is small
+    '''
+    def __init__(self, directory=None):
+        self.segments = []
+        self.shared = {}
+        self.tmp_dir = None
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+            self.tmp_dir = tempfile.mkdtemp(dir=directory, prefix='.shared_')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.close()
+
+    def publish(self, array):
+        ''' Copy an array once to shared memory or a file.
+
+            INPUT
+            array (array): array to publish
+
+            OUTPUT
+            handle (ArrayHandle): reference for the workers
+        '''
+        array = np.ascontiguousarray(array)
+        if self.tmp_dir is not None:
+            path = os.path.join(self.tmp_dir, '%d.npy' % len(os.listdir(self.tmp_dir)))
+            np.save(path, array)
+            return ArrayHandle(array.shape, array.dtype, path=path)
+
+        segment = shared_memory.SharedMemory(create=True, size=max(array.nbytes, 1))
+        self.segments.append(segment)
+        np.ndarray(array.shape, dtype=array.dtype, buffer=segment.buf)[...] = array
+        return ArrayHandle(array.shape, array.dtype, shm_name=segment.name)
+
+    def share(self, obj, min_bytes=MIN_SHARED_BYTES):
+        ''' Replace the large arrays in (nested lists or tuples of) arguments by handles,
+            e.g. a stimulus [input_theory, (g_exc, g_inh), hidden_state].
+
+            INPUT
+            obj (object): array, or list or tuple of arguments
+            min_bytes (int): smaller arrays are left as they are
+
+            OUTPUT
+            obj (object): the same structure with ArrayHandles, see resolve
+        '''
+        if isinstance(obj, (list, tuple)):
+            return type(obj)(self.share(item, min_bytes) for item in obj)
+        if isinstance(obj, np.ndarray) and obj.nbytes >= min_bytes:
+            # An array that is an argument of many tasks is published once
+            if id(obj) not in self.shared:
+                self.shared[id(obj)] = (obj, self.publish(obj))
+            return self.shared[id(obj)][1]
+        return obj
+
+    def close(self):
+        ''' Remove the published arrays. Views that workers still hold remain valid until they
+            are closed, but new handles can't be opened.
+        '''
+        for segment in self.segments:
+            segment.close()
+            segment.unlink()
+        self.segments = []
+        self.shared = {}
+        if self.tmp_dir is not None:
+            shutil.rmtree(self.tmp_dir, ignore_errors=True)
+            self.tmp_dir = None
+
+
+def resolve(obj):
+    ''' Open the ArrayHandles in (nested lists or tuples of) arguments, the inverse of SharedArrays.share.
+    '''
+    if isinstance(obj, ArrayHandle):
+        return obj.open()
+    if isinstance(obj, (list, tuple)):
+        return type(obj)(resolve(item) for item in obj)
+    return obj
+
+
+def call_resolved(func, *args):
+    ''' Call a function with its ArrayHandle arguments opened, for use with a pool's map.
+    '''
+    return func(*resolve(args))
+
+
+def _attach(name):
+    # Only the publishing process unlinks a segment. Workers of a pool share the resource tracker
+    # of the publishing process, in which the segment is already registered
+    if sys.version_info >= (3, 13):
+        return shared_memory.SharedMemory(name=name, track=False)
+    return shared_memory.SharedMemory(name=name)
@@ -0,0 +1,258 @@
+''' spike_statistics.py
+
+    This file contains the spike statistics of a recording: inter-spike intervals, coefficient of variation,
+    local variation, Fano factor, bursts and the firing rate during the ON and OFF state. The spikes are
+    converted once to a float array of spike times in milliseconds, after which every statistic is an
+    np.diff or a reduction. Many trials are handled at once as a ragged array: the spike times of all
+    trials concatenated and the offsets of the trials, see pack_trials.
+'''
+import numpy as np
+
+
+def as_spike_times(spikes):
+    ''' Convert spikes to a float array of spike times in milliseconds.
+
+        INPUT
+        spikes (array, list or brian2.SpikeMonitor): spike times in ms, or a monitor of brian2 or the native engine
+
+        OUTPUT
+        spike_times (array): float64 array of the spike times in ms
+    '''
+    if hasattr(spikes, 't'):
+        # brian2.SpikeMonitor or a monitor of the native engine
+        import brian2 as b2
+        spikes = spikes.t/b2.ms
+    elif not isinstance(spikes, (np.ndarray, list, tuple)):
+        raise TypeError('Please provide SpikeMonitor or array of spiketimes')
+    return np.asarray(spikes, dtype=np.float64).ravel()
+
+
+def spiketrain_to_times(spiketrain, dt):
+    ''' Get the spike times of a binary spiketrain as made by make_spiketrain.
+
+        INPUT
+        spiketrain (array): binary array that's 1 when a spike occured
+        dt (float): time step of the spiketrain in milliseconds
+
+        OUTPUT
+        spike_times (array): spike times in ms
+    '''
+    return np.flatnonzero(np.asarray(spiketrain).ravel() == 1)*dt
+
+
+def get_isi(spikes):
+    ''' Inter-spike intervals of successive spikes in milliseconds.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+
+        OUTPUT
+        isi (array): array of len(spikes)-1 intervals
+    '''
+    return np.abs(np.diff(as_spike_times(spikes)))
+
+
+def get_cv(spikes):
+    ''' Coefficient of variation of the inter-spike intervals, NaN with less than two intervals.
+    '''
+    isi = get_isi(spikes)
+    if len(isi) < 2:
+        return np.nan
+    return isi.std()/isi.mean()
+
+
+def get_lv(spikes):
+    ''' Local variation of the inter-spike intervals (Shinomoto et al., 2003), which is 1 for a Poisson
+        process like the CV but insensitive to slow changes of the firing rate. NaN with less than two intervals.
+    '''
+    isi = get_isi(spikes)
+    if len(isi) < 2:
+        return np.nan
+    return 3*np.mean(((isi[:-1] - isi[1:])/(isi[:-1] + isi[1:]))**2)
+
+
+def get_spike_counts(spikes, duration, window):
+    ''' Number of spikes in successive windows.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+        duration (float): duration of the recording in ms
+        window (float): length of the windows in ms, a remainder shorter than a window is dropped
+
+        OUTPUT
+        counts (array): number of spikes in every window
+    '''
+    n_windows = int(duration//window)
+    windows = (as_spike_times(spikes)//window).astype(np.int64)
+    windows = windows[(windows >= 0) & (windows < n_windows)]
+    return np.bincount(windows, minlength=n_windows)
+
+
+def get_fano_factor(spikes, duration, window):
+    ''' Fano factor of the spike counts in windows of the given length in ms, NaN without spikes.
+    '''
+    counts = get_spike_counts(spikes, duration, window)
+    if counts.sum() == 0:
+        return np.nan
+    return counts.var()/counts.mean()
+
+
+def get_bursts(spikes, max_isi, min_spikes=2):
+    ''' Detect bursts: runs of at least min_spikes spikes that follow each other within max_isi.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+        max_isi (float): largest interval between two spikes of a burst in ms
+        min_spikes (int): smallest number of spikes in a burst
+
+        OUTPUT
+        starts, stops (array, array): index of the first and last (exclusive) spike of every burst
+    '''
+    within = np.concatenate(([False], get_isi(spikes) <= max_isi, [False]))
+    # Edges of the runs of short intervals, a run of n intervals is a burst of n+1 spikes
+    edges = np.flatnonzero(np.diff(within.astype(np.int8)))
+    starts, stops = edges[::2], edges[1::2] + 1
+    keep = stops - starts >= min_spikes
+    return starts[keep], stops[keep]
+
+
+def get_state_spikes(spikes, hidden_state, dt):
+    ''' Get the hidden state at every spike.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+        hidden_state (array): binary array representing the hidden state
+        dt (float): time step of the hidden state in milliseconds
+
+        OUTPUT
+        spike_times (array): spike times in ms, spikes outside the hidden state are dropped
+        index (array): time step of every spike
+    '''
+    hidden_state = np.asarray(hidden_state).ravel()
+    spike_times = as_spike_times(spikes)
+    index = np.round(spike_times/dt).astype(np.int64)
+    inside = (index >= 0) & (index < len(hidden_state))
+    return spike_times[inside], index[inside]
+
+
+def get_state_rates(spikes, hidden_state, dt):
+    ''' Firing rate during the ON and OFF state in Hertz (Hz), NaN if a state does not occur.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+        hidden_state (array): binary array representing the hidden state
+        dt (float): time step of the hidden state in milliseconds
+
+        OUTPUT
+        on_rate, off_rate (float, float)
+    '''
+    hidden_state = np.asarray(hidden_state).ravel()
+    _, index = get_state_spikes(spikes, hidden_state, dt)
+    on_spikes = np.count_nonzero(hidden_state[index] == 1)
+    on_steps = np.count_nonzero(hidden_state == 1)
+    off_steps = len(hidden_state) - on_steps
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        on_rate = np.float64(on_spikes)/(on_steps*dt/1000)
+        off_rate = np.float64(len(index) - on_spikes)/(off_steps*dt/1000)
+    return on_rate, off_rate
+
+
+def get_state_isi(spikes, hidden_state, dt):
+    ''' Get the inter-spike interval of successive spikes within the same block of the ON or OFF state.
+
+        INPUT
+        spikes (array or brian2.SpikeMonitor): see as_spike_times
+        hidden_state (array): binary array representing the hidden state
+        dt (float): time step of the hidden state in milliseconds
+
+        OUTPUT
+        on_isi, off_isi (array, array): intervals within the ON and within the OFF blocks
+    '''
+    hidden_state = np.asarray(hidden_state).ravel()
+    spike_times, index = get_state_spikes(spikes, hidden_state, dt)
+    order = np.argsort(spike_times, kind='stable')
+    spike_times, index = spike_times[order], index[order]
+
+    # Block of every spike, a block starts at every switch of the hidden state
+    block = np.cumsum(np.concatenate(([0], np.diff(hidden_state) != 0)))[index]
+    same_block = block[1:] == block[:-1]
+    isi = np.diff(spike_times)[same_block]
+    state = hidden_state[index[1:]][same_block]
+    return isi[state == 1], isi[state == 0]
+
+
+def pack_trials(trials):
+    ''' Pack the spikes of many trials into a ragged array.
+
+        INPUT
+        trials (list): spikes of every trial, see as_spike_times
+
+        OUTPUT
+        spike_times (array): spike times of all trials concatenated
+        offsets (array): the spikes of trial i are spike_times[offsets[i]:offsets[i+1]]
+    '''
+    trials = [as_spike_times(trial) for trial in trials]
+    offsets = np.zeros(len(trials) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(trial) for trial in trials])
+    if not trials:
+        return np.array([], dtype=np.float64), offsets
+    return np.concatenate(trials), offsets
+
+
+def unpack_trials(spike_times, offsets):
+    ''' Inverse of pack_trials, the trials are views of spike_times.
+    '''
+    return [spike_times[start:stop] for start, stop in zip(offsets[:-1], offsets[1:])]
+
+
+def batch_isi(spike_times, offsets):
+    ''' Inter-spike intervals of all trials of a ragged array at once.
+
+        INPUT
+        spike_times, offsets (array, array): ragged array of the trials, see pack_trials
+
+        OUTPUT
+        isi (array): intervals of all trials concatenated
+        trial (array): trial of every interval
+    '''
+    counts = np.diff(offsets)
+    trial = np.repeat(np.arange(len(counts)), counts)
+    same_trial = trial[1:] == trial[:-1]
+    return np.abs(np.diff(spike_times))[same_trial], trial[1:][same_trial]
+
+
+def batch_spike_statistics(spike_times, offsets, duration=None):
+    ''' Spike statistics of every trial of a ragged array with reductions over all trials at once.
+
+        INPUT
+        spike_times, offsets (array, array): ragged array of the trials, see pack_trials
+        duration (float, optional): duration of the trials in ms, to add the firing rate
+
+        OUTPUT
+        statistics (dict): array with a value per trial for 'n_spikes', 'mean_isi', 'cv', 'lv' and 'rate' (Hz),
+                           NaN where a trial has too few spikes
+    '''
+    spike_times = np.asarray(spike_times, dtype=np.float64)
+    offsets = np.asarray(offsets, dtype=np.int64)
+    n_trials = len(offsets) - 1
+    n_spikes = np.diff(offsets)
+    isi, trial = batch_isi(spike_times, offsets)
+
+    n_isi = np.bincount(trial, minlength=n_trials)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean_isi = np.bincount(trial, isi, minlength=n_trials)/n_isi
+        square_deviation = (isi - mean_isi[trial])**2
+        std_isi = np.sqrt(np.bincount(trial, square_deviation, minlength=n_trials)/n_isi)
+        cv = np.where(n_isi >= 2, std_isi/mean_isi, np.nan)
+
+        # Local variation over the pairs of successive intervals of the same trial
+        same_trial = trial[1:] == trial[:-1]
+        pairs = ((isi[:-1] - isi[1:])/(isi[:-1] + isi[1:]))[same_trial]**2
+        n_pairs = np.bincount(trial[1:][same_trial], minlength=n_trials)
+        lv = np.where(n_pairs >= 1, 3*np.bincount(trial[1:][same_trial], pairs, minlength=n_trials)/n_pairs, np.nan)
+
+    statistics = {'n_spikes':n_spikes, 'mean_isi':np.where(n_isi >= 1, mean_isi, np.nan), 'cv':cv, 'lv':lv}
+    if duration is not None:
+        statistics['rate'] = n_spikes/(duration/1000)
+    return statistics
@@ -0,0 +1,191 @@
+''' stimulus_cache.py
+
+    This file contains the cache that stores generated stimuli (input theory, dynamic theory and
+    hidden state) on disk, so that repeated experiments with the same generation parameters don't
+    have to regenerate the stimulus from scratch.
+
+    Every stimulus is stored as a set of memory-mappable .npy files in a directory named after the
+    hash of the generation parameters and the code version. The least recently used stimuli are
+    removed when the cache grows larger than its size limit. An in-process memo sits in front of
+    the disk cache, so a stimulus that was used recently is returned without touching the disk.
+'''
+import os
+import json
+import shutil
+import hashlib
+import tempfile
+from collections import OrderedDict
+
+import numpy as np
+
+# Bump when the stimulus generation changes in a way that is not visible in the source files below
+STIMULUS_VERSION = 1
+_SOURCE_FILES = ['input.py', 'dynamic_clamp.py', 'make_dynamic_experiments.py', 'population.py', 'precision.py']
+_ARRAYS = ['input_theory', 'g_exc', 'g_inh', 'hidden_state']
+
+
+def get_code_version():
+    ''' Hash of the source code that generates the stimulus, so that cached stimuli are
+        invalidated when the generation method changes.
+
+        OUTPUT
+        code_version (str): hexadecimal hash of STIMULUS_VERSION and the generating source files
+    '''
+    sha = hashlib.sha1(str(STIMULUS_VERSION).encode())
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    for file_name in _SOURCE_FILES:
+        with open(os.path.join(current_dir, file_name), 'rb') as f:
+            sha.update(f.read())
+    return sha.hexdigest()
+
+
+def to_json(obj):
+    ''' JSON encoder (the default of json.dumps) of the parameters that are hashed into a key, here
+        and in sweep.py. NumPy scalars hash like the equivalent Python number, other objects by their repr.
+    '''
+    if hasattr(obj, 'item'):
+        return obj.item()
+    return repr(obj)
+
+
+class StimulusCache:
+    ''' Content-addressed cache of stimuli generated by make_dynamic_experiments.
+
+        INPUT
+        cache_dir (str): directory in which the stimuli are stored
+        max_bytes (int): maximum size of the cache on disk in bytes, least recently used stimuli are evicted
+        memo_size (int): number of stimuli that are kept in the in-process memo
+        mmap (bool): if True the stored arrays are memory-mapped (read-only) instead of read into memory
+    '''
+    def __init__(self, cache_dir='stimulus_cache', max_bytes=2*1024**3, memo_size=8, mmap=True):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.memo_size = memo_size
+        self.mmap = mmap
+        self.code_version = get_code_version()
+        self.memo = OrderedDict()
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, params):
+        ''' Get the hash of the generation parameters and the code version.
+
+            INPUT
+            params (dict): generation parameters of make_dynamic_experiments
+
+            OUTPUT
+            key (str): hexadecimal hash that addresses the stimulus
+        '''
+        params = dict(params, code_version=self.code_version)
+        encoded = json.dumps(params, sort_keys=True, default=to_json).encode()
+        return hashlib.sha1(encoded).hexdigest()
+
+    def get(self, params):
+        ''' Get a stimulus from the memo or the disk.
+
+            INPUT
+            params (dict): generation parameters of make_dynamic_experiments
+
+            OUTPUT
+            [input_theory, dynamic_theory, hidden_state] or None when the stimulus is not cached
+        '''
+        key = self.key(params)
+        path = os.path.join(self.cache_dir, key)
+
+        # In-process memo, the entry on disk is touched so that eviction keeps the stimuli in use
+        if key in self.memo:
+            self.memo.move_to_end(key)
+            try:
+                os.utime(path)
+            except OSError:
+                # Evicted by another process, the memo still holds the arrays
+                pass
+            return self.memo[key]
+
+        # Disk
+        if not os.path.isdir(path):
+            return None
+        stimulus = self._load(path)
+        if stimulus is None:
+            # Incomplete or corrupted entry
+            shutil.rmtree(path, ignore_errors=True)
+            return None
+        os.utime(path)
+
+        self._memoize(key, stimulus)
+        return stimulus
+
+    def put(self, params, stimulus):
+        ''' Store a stimulus on disk and in the memo. The memo holds the read-only arrays read back from
+            disk, so changing the arrays of the caller doesn't change the cached stimulus.
+
+            INPUT
+            params (dict): generation parameters of make_dynamic_experiments
+            stimulus (list): [input_theory, dynamic_theory, hidden_state] as returned by make_dynamic_experiments
+        '''
+        key = self.key(params)
+        input_theory, (g_exc, g_inh), hidden_state = stimulus
+        arrays = {'input_theory': input_theory, 'g_exc': g_exc, 'g_inh': g_inh, 'hidden_state': hidden_state}
+
+        # Write to a temporary directory first, so that an entry is either complete or absent
+        path = os.path.join(self.cache_dir, key)
+        if not os.path.isdir(path):
+            tmp_path = tempfile.mkdtemp(dir=self.cache_dir, prefix='.tmp_')
+            for name in _ARRAYS:
+                np.save(os.path.join(tmp_path, name + '.npy'), np.asarray(arrays[name]))
+            with open(os.path.join(tmp_path, 'params.json'), 'w') as f:
+                json.dump(dict(params, code_version=self.code_version), f, sort_keys=True, default=to_json)
+            try:
+                os.rename(tmp_path, path)
+            except OSError:
+                # Another process stored the same stimulus in the meantime
+                shutil.rmtree(tmp_path, ignore_errors=True)
+            self.evict()
+
+        stored = self._load(path)
+        if stored is not None:
+            self._memoize(key, stored)
+
+    def evict(self):
+        ''' Remove the least recently used stimuli until the cache is smaller than max_bytes.
+        '''
+        entries = []
+        total = 0
+        for key in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, key)
+            if key.startswith('.') or not os.path.isdir(path):
+                continue
+            size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+            entries.append((os.path.getmtime(path), size, key))
+            total += size
+
+        for _, size, key in sorted(entries):
+            if total <= self.max_bytes:
+                break
+            shutil.rmtree(os.path.join(self.cache_dir, key), ignore_errors=True)
+            self.memo.pop(key, None)
+            total -= size
+
+    def clear(self):
+        ''' Remove all stimuli from the cache.
+        '''
+        self.memo.clear()
+        shutil.rmtree(self.cache_dir, ignore_errors=True)
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def _load(self, path):
+        # Memory-mapped arrays are opened read-only, arrays read into memory are made read-only
+        mmap_mode = 'r' if self.mmap else None
+        try:
+            arrays = {name: np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode)
+                      for name in _ARRAYS}
+        except (OSError, ValueError):
+            return None
+        for array in arrays.values():
+            array.flags.writeable = False
+        return [arrays['input_theory'], (arrays['g_exc'], arrays['g_inh']), arrays['hidden_state']]
+
+    def _memoize(self, key, stimulus):
+        self.memo[key] = stimulus
+        self.memo.move_to_end(key)
+        while len(self.memo) > self.memo_size:
+            self.memo.popitem(last=False)
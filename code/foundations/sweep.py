@@ -0,0 +1,355 @@
+''' sweep.py
+
+    This file contains the engine for parameter sweeps. A grid of parameters (e.g. tau,
+    factor_ron_roff, mean_firing_rate, Ni and clamp_type) is expanded into sweep points and every
+    point into the stages
+
+        hidden_state, qonqoff -> ann_input -> scale -> simulation -> MI
+
+    A stage only depends on its own parameters and those of the stages it uses, e.g. the hidden
+    state on (tau, factor_ron_roff, sampling_rate, duration, seed) and qon/qoff on (qon_qoff_type,
+    N, mean_firing_rate, seed). Sweep points that share a stage share one task, so every unique
+    intermediate result is computed once. Tasks are stored in a ResultStore and run in a pool of
+    worker processes as soon as the tasks they depend on are finished. Tasks that are already
+    stored are skipped, so a sweep that was interrupted continues where it stopped. The task ids
+    include the code version of a stage and the stages it uses, so results of changed code are not reused.
+'''
+import os
+import json
+import hashlib
+import itertools
+from concurrent.futures import ProcessPoolExecutor, wait, FIRST_COMPLETED
+
+import numpy as np
+from .make_dynamic_experiments import make_hidden_state, make_qonqoff, make_ann_input
+from .helpers import ScaledInput, scale_to_freq, make_spiketrain
+from .MI_calculation import analyze_exp
+from .result_store import ResultStore
+from .stimulus_cache import get_code_version, to_json
+from . import profiler
+
+# Parameters of a sweep point that are not given in the grid
+DEFAULTS = {'qon_qoff_type':'balanced', 'baseline':0., 'sampling_rate':5, 'duration':20000, 'seed':0,
+            'N':1000, 'n_bins':None, 'model':'PC', 'engine':'brian2', 'clamp_type':'current', 'Ni':0,
+            'scale':None, 'target':None, 'on_all_ratio':1.5, 'scale_list':None, 'theta':0}
+REQUIRED = ['tau', 'factor_ron_roff', 'mean_firing_rate']
+
+# Parameters whose value is a list, they are the same for every sweep point
+FIXED = ['scale_list']
+
+# Scales tried by scale_to_freq when the grid has no scale_list, as in big_sim.py
+SCALE_LIST = np.append([1], np.arange(2.5, 302.5, 2.5))
+
+# Own parameters and dependencies of every stage, in the order in which they are computed
+STAGES = {'hidden_state':(['tau', 'factor_ron_roff', 'sampling_rate', 'duration', 'seed'], []),
+          'qonqoff':(['qon_qoff_type', 'N', 'mean_firing_rate', 'seed'], []),
+          'ann_input':(['n_bins'], ['hidden_state', 'qonqoff']),
+          'scale':(['model', 'engine', 'clamp_type', 'Ni', 'scale', 'target', 'on_all_ratio', 'scale_list'],
+                   ['ann_input', 'hidden_state']),
+          'simulation':(['baseline'], ['scale', 'ann_input']),
+          'MI':(['theta'], ['scale', 'simulation', 'ann_input', 'hidden_state'])}
+
+# Source files of the model and analysis stages, relative to the code folder. The stimulus stages
+# have the code version of the StimulusCache
+STAGE_SOURCES = {'scale':['models/models.py', 'models/native.py', 'foundations/helpers.py'],
+                 'simulation':['models/models.py', 'models/native.py', 'foundations/helpers.py'],
+                 'MI':['foundations/MI_calculation.py']}
+
+# Arrays that are stored in float64 whatever the precision policy
+EXACT = ['qon', 'qoff', 'scale']
+
+
+def get_store(root):
+    ''' ResultStore in which the tasks of a sweep are stored.
+    '''
+    return ResultStore(root, exact=EXACT, pyramids=True)
+
+
+def get_stage_parameters(stage):
+    ''' Parameters that the result of a stage depends on: its own and those of the stages it uses.
+
+        INPUT
+        stage (str): name of the stage, see STAGES
+
+        OUTPUT
+        names (list): sorted parameter names
+    '''
+    names, dependencies = STAGES[stage]
+    names = set(names)
+    for dependency in dependencies:
+        names.update(get_stage_parameters(dependency))
+    return sorted(names)
+
+
+def get_code_versions():
+    ''' Code version of every stage: the hash of the stimulus code version, the source files of the
+        stage (STAGE_SOURCES) and the code versions of the stages it uses.
+
+        OUTPUT
+        versions (dict): hexadecimal hash of every stage
+    '''
+    stimulus_version = get_code_version()
+    code_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    versions = {}
+    for stage, (_, dependencies) in STAGES.items():
+        sha = hashlib.sha1(stimulus_version.encode())
+        for dependency in dependencies:
+            sha.update(versions[dependency].encode())
+        for file_name in STAGE_SOURCES.get(stage, []):
+            with open(os.path.join(code_dir, file_name), 'rb') as f:
+                sha.update(f.read())
+        versions[stage] = sha.hexdigest()
+    return versions
+
+
+def get_task_id(stage, params, code_version=None):
+    ''' Identifier of a task: the stage and the hash of its parameters and code version.
+    '''
+    params = dict(params, code_version=code_version)
+    encoded = json.dumps(params, sort_keys=True, default=to_json).encode()
+    return '%s_%s' % (stage, hashlib.sha1(encoded).hexdigest()[:16])
+
+
+def expand_grid(grid):
+    ''' Expands a grid into sweep points.
+
+        INPUT
+        grid (dict): parameter names with a list of values to sweep, or any other value that is used
+                     for every point. Parameters in FIXED (scale_list) take a list themselves, so they
+                     are never swept. See DEFAULTS and REQUIRED.
+
+        OUTPUT
+        points (list of dict): every combination of the listed values, completed with DEFAULTS
+    '''
+    unknown = set(grid) - set(DEFAULTS) - set(REQUIRED)
+    if unknown:
+        raise ValueError('Unknown sweep parameters: %s' % ', '.join(sorted(unknown)))
+    missing = set(REQUIRED) - set(grid)
+    if missing:
+        raise ValueError('Missing sweep parameters: %s' % ', '.join(sorted(missing)))
+
+    names = sorted(grid)
+    values = [grid[name] if isinstance(grid[name], list) and name not in FIXED else [grid[name]] for name in names]
+    points = []
+    for combination in itertools.product(*values):
+        point = dict(DEFAULTS)
+        point.update(zip(names, combination))
+        if point['scale_list'] is not None:
+            point['scale_list'] = [float(scale) for scale in point['scale_list']]
+        points.append(point)
+    return points
+
+
+def make_tasks(points, until='MI'):
+    ''' Expands sweep points into the tasks of their stages, tasks shared by several points only once.
+
+        INPUT
+        points (list of dict): sweep points, see expand_grid
+        until (str): last stage that is computed, e.g. 'ann_input' for the stimuli only
+
+        OUTPUT
+        tasks (dict): task id and its stage, parameters and the ids of the tasks it depends on, in an
+                      order in which every task comes after its dependencies
+        point_tasks (list of dict): the task id of every stage of every sweep point
+    '''
+    stages = _get_upstream(until)
+    versions = get_code_versions()
+    tasks = {}
+    point_tasks = []
+    for point in points:
+        if 'scale' in stages and point['scale'] is None and point['target'] is None:
+            raise ValueError('Every sweep point needs a scale or a target frequency')
+        if point['seed'] is None or point['Ni'] is None:
+            raise ValueError('The seed and Ni of a sweep point must be given, tasks have to be reproducible')
+
+        ids = {}
+        for stage in STAGES:
+            if stage not in stages:
+                continue
+            params = {name:point[name] for name in get_stage_parameters(stage)}
+            ids[stage] = get_task_id(stage, params, versions[stage])
+            if ids[stage] not in tasks:
+                tasks[ids[stage]] = {'stage':stage, 'params':params,
+                                     'deps':[ids[dependency] for dependency in STAGES[stage][1]]}
+        point_tasks.append(ids)
+    return tasks, point_tasks
+
+
+def run_tasks(tasks, root, n_workers=None):
+    ''' Runs the tasks that are not stored yet, every task as soon as its dependencies are stored.
+
+        INPUT
+        tasks (dict): see make_tasks
+        root (str): directory of the ResultStore of the sweep
+        n_workers (int): number of worker processes, defaults to the number of CPUs. With 1 the
+                         tasks are run in this process
+    '''
+    store = get_store(root)
+    pending = {task_id:task for task_id, task in tasks.items() if not store.has(task_id)}
+    done = set(tasks) - set(pending)
+    print('%d tasks, %d stored, %d to run' % (len(tasks), len(done), len(pending)))
+
+    if n_workers == 1:
+        for task_id, task in pending.items():
+            _run_task(root, task_id, task['stage'], task['params'], task['deps'])
+        return
+
+    with ProcessPoolExecutor(n_workers) as pool:
+        running = {}
+        while pending or running:
+            # Submit the tasks of which all dependencies are stored
+            for task_id, task in list(pending.items()):
+                if all(dependency in done for dependency in task['deps']):
+                    future = pool.submit(_run_task, root, task_id, task['stage'], task['params'], task['deps'])
+                    running[future] = task_id
+                    del pending[task_id]
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                future.result()
+                done.add(running.pop(future))
+
+
+def run_sweep(grid, root='sweep', until='MI', n_workers=None):
+    ''' Runs a parameter sweep.
+
+        INPUT
+        grid (dict): see expand_grid
+        root (str): directory in which the results of all tasks are stored
+        until (str): last stage that is computed
+        n_workers (int): number of worker processes, defaults to the number of CPUs
+
+        OUTPUT
+        results (list of dict): every sweep point with the meta data of its last stage (e.g. MI and
+                                MI_i) and the task ids of its stages under 'tasks'
+    '''
+    points = expand_grid(grid)
+    tasks, point_tasks = make_tasks(points, until)
+    run_tasks(tasks, root, n_workers)
+
+    store = get_store(root)
+    results = []
+    for point, ids in zip(points, point_tasks):
+        result = dict(point)
+        result.update((key, value) for key, value in store.meta(ids[until]).items() if key not in ('stage', 'params'))
+        result['tasks'] = ids
+        results.append(result)
+    return results
+
+
+def load_stage(root, task_id):
+    ''' Loads the arrays of a task, memory-mapped.
+
+        INPUT
+        root (str): directory of the ResultStore of the sweep
+        task_id (str): id of the task, e.g. from the 'tasks' of run_sweep
+
+        OUTPUT
+        arrays (dict): name and array of every stored array
+    '''
+    store = get_store(root)
+    return {name:store.load(task_id, name) for name in store.names(task_id)}
+
+
+def _get_upstream(stage):
+    stages = {stage}
+    for dependency in STAGES[stage][1]:
+        stages.update(_get_upstream(dependency))
+    return stages
+
+
+def _run_task(root, task_id, stage, params, deps):
+    inputs = {}
+    for dependency in deps:
+        inputs.update(load_stage(root, dependency))
+    with profiler.timed('sweep.' + stage, task=task_id):
+        arrays, meta = _STAGE_FUNCTIONS[stage](params, inputs)
+    meta = dict(meta, stage=stage, params=params)
+    get_store(root).save(task_id, arrays, meta, overwrite=True)
+
+
+# Neuron models of this process, every model is made (and compiled) once
+_models = {}
+
+def _get_model(params):
+    dt = 1./params['sampling_rate']
+    key = (params['model'], params['clamp_type'], params['engine'], dt)
+    if key not in _models:
+        from ..models.models import Barrel_PC, Barrel_IN
+        model_class = {'PC':Barrel_PC, 'IN':Barrel_IN}[params['model']]
+        neuron = model_class(params['clamp_type'], dt=dt, engine=params['engine'])
+        neuron.store()
+        _models[key] = neuron
+    return _models[key]
+
+
+def _get_theory(params, inputs):
+    if params['clamp_type'] == 'current':
+        return inputs['input_theory']
+    return (inputs['g_exc'], inputs['g_inh'])
+
+
+def _hidden_state(params, inputs):
+    hidden_state = make_hidden_state(params['tau'], params['factor_ron_roff'], params['sampling_rate'],
+                                     params['duration'], params['seed'])
+    return {'hidden_state':hidden_state}, {}
+
+
+def _qonqoff(params, inputs):
+    qon, qoff = make_qonqoff(params['qon_qoff_type'], params['N'], params['mean_firing_rate'], params['seed'])
+    return {'qon':qon, 'qoff':qoff}, {}
+
+
+def _ann_input(params, inputs):
+    input_theory, (g_exc, g_inh) = make_ann_input(np.array(inputs['qon']), np.array(inputs['qoff']),
+                                                  inputs['hidden_state'], params['sampling_rate'],
+                                                  params['duration'], params['seed'], params['n_bins'])
+    return {'input_theory':input_theory, 'g_exc':g_exc, 'g_inh':g_inh}, {}
+
+
+def _scale(params, inputs):
+    if params['scale'] is not None:
+        return {'scale':np.array(float(params['scale']))}, {'accepted':True}
+
+    scale_list = SCALE_LIST if params['scale_list'] is None else np.array(params['scale_list'])
+    inj_input = scale_to_freq(_get_model(params), _get_theory(params, inputs), params['target'],
+                              params['on_all_ratio'], params['clamp_type'], params['duration'],
+                              inputs['hidden_state'], scale_list, 1./params['sampling_rate'], params['Ni'])
+    if inj_input is False:
+        return {'scale':np.array(np.nan)}, {'accepted':False}
+    return {'scale':np.array(float(inj_input.scale))}, {'accepted':True}
+
+
+def _simulation(params, inputs):
+    import brian2 as b2
+
+    scale = float(inputs['scale'])
+    if np.isnan(scale):
+        # No scale meets the ON/all ratio
+        return {'spikes':np.array([])}, {'accepted':False}
+
+    neuron = _get_model(params)
+    neuron.restore()
+    inj_input = ScaledInput(_get_theory(params, inputs), params['clamp_type'], 1./params['sampling_rate'],
+                            scale, params['baseline'])
+    M, S = neuron.run(inj_input, params['duration'], params['Ni'])
+    return ({'voltage':np.asarray(M.v[0]/b2.mV), 'I_inj':np.asarray(M.I_inj[0]/b2.uA),
+             'spikes':np.asarray(S.t/b2.ms)}, {'accepted':True, 'num_spikes':int(S.num_spikes)})
+
+
+def _MI(params, inputs):
+    if np.isnan(float(inputs['scale'])):
+        return {}, {'accepted':False}
+
+    dt = 1./params['sampling_rate']
+    ron = 1./(params['tau']*(1+params['factor_ron_roff']))
+    roff = params['factor_ron_roff']*ron
+    spiketrain = make_spiketrain(np.asarray(inputs['spikes']), params['duration'], dt)
+    output = analyze_exp(ron, roff, np.asarray(inputs['hidden_state']), np.asarray(inputs['input_theory']),
+                         dt, params['theta'], spiketrain)
+    result = {key:float(output[key][0]) for key in ('MI_i', 'MI', 'MSE_i', 'MSE', 'qon', 'qoff')}
+    return {}, dict(result, accepted=True)
+
+
+_STAGE_FUNCTIONS = {'hidden_state':_hidden_state, 'qonqoff':_qonqoff, 'ann_input':_ann_input,
+                    'scale':_scale, 'simulation':_simulation, 'MI':_MI}
@@ -13,9 +13,16 @@
     in inhibitory and excitatory neurons of rat barrel cortex, but shows no clear inﬂuence on neuronal 
     parameters. Bsc. University of Amsterdam. Available at: https://scripties.uba.uva.nl/search?id=715234.
 '''
+import os
+import time
 import brian2 as b2
-import matplotlib.pyplot as plt
 import numpy as np
+from ..foundations import profiler
+from . import native
+
+# Spike threshold and refractory period in ms of Barrel_PC and Barrel_IN, in both engines
+THRESHOLD = 'm > 0.5'
+REFRACTORY = 2.
 
 def simulate_Wang_Buszaki(inj_input, simulation_time, clamp_type='current'):
     ''' Hodgkin-Huxley model of a hippocampal (CA1) interneuron.
@@ -92,31 +99,19 @@ class Barrel_PC:
         INPUT:
         clamp_type (str): type of input, ['current' or 'dynamic']
         dt (float): time step of the simulation in miliseconds.
+        engine (str): 'brian2' or 'native', the integrator of models/native.py that doesn't use Brian2.
+                      A native run always starts from the initial state, as after restore.
+        tabulate (float): native engine only, interpolate the gating rates from tables with this
+                          voltage step in mV (e.g. native.TABLE_DV) instead of computing them
 
         OUTPUT:
         StateMonitor, SpikeMonitor: Brian2 StateMonitor with recorded fields
         ['v', 'input' or 'conductance'] and SpikeMonitor which records spikes
 
     '''
-    def __init__(self, clamp_type, dt=0.5):
-        self.clamp_type = clamp_type
-        self.dt = dt
-        self.stored = False
-        self.make_model()
-    
-    def make_model(self):
-        # Determine the simulation
-        if self.clamp_type == 'current':
-            eqs_input = '''I_inj = inj_input(t) : amp'''
-
-        elif self.clamp_type =='dynamic':
-            eqs_input = '''I_exc = g_exc(t) * (Er_e - v) : amp
-                    I_inh = g_inh(t) * (Er_i - v) : amp
-                    I_inj = I_exc + I_inh : amp'''
-        tracking = ['v', 'I_inj']
-        
-        # Model the neuron with differential equations
-        eqs = '''
+    # Model the neuron with differential equations, the fitted parameters are shared variables
+    # that are set by run, so the same model (and compiled code) is used for every neuron
+    eqs = '''
             Vh_m = 3.583881 * k_m - 53.294454*mV : volt
             m = 1 / (1 + exp(-(v - Vh_m) / k_m)) : 1
             h = 1 / (1 + exp((v - Vh_h) / k_h)) : 1
@@ -130,16 +125,58 @@ class Barrel_PC:
             I_K = -gK * n**4 * (v - EK) : amp
 
             dv/dt = (I_leak + I_Na + I_K + I_inj) / Cm : volt
-            '''    
 
-        # Neuron & parameter initialization
-        neuron = b2.NeuronGroup(1, model=eqs+eqs_input, method='exponential_euler',
-                            threshold ='m > 0.5', refractory=2*b2.ms, reset=None, dt=self.dt*b2.ms)
+            Cm : farad (shared, constant)
+            gL : siemens (shared, constant)
+            gNa : siemens (shared, constant)
+            gK : siemens (shared, constant)
+            k_m : volt (shared, constant)
+            k_h : volt (shared, constant)
+            Vh_h : volt (shared, constant)
+            '''
+    eqs_current = '''I_inj = input_baseline + input_scale * inj_input(t) : amp
+                    input_baseline : amp (shared, constant)
+                    input_scale : 1 (shared, constant)'''
+    eqs_dynamic = '''I_exc = (input_baseline + input_scale * g_exc(t)) * (Er_e - v) : amp
+                    I_inh = (input_baseline + input_scale * g_inh(t)) * (Er_i - v) : amp
+                    I_inj = I_exc + I_inh : amp
+                    input_baseline : siemens (shared, constant)
+                    input_scale : 1 (shared, constant)'''
+    parameter_file = 'code/models/parameters/PC_parameters.csv'
+
+    model_name = 'PC'
+
+    def __init__(self, clamp_type, dt=0.5, engine='brian2', tabulate=None):
+        if engine not in ('brian2', 'native'):
+            raise ValueError('Engine must be \'brian2\' or \'native\'')
+        if tabulate is not None and engine != 'native':
+            raise ValueError('Tabulated gating rates need the native engine')
+        self.clamp_type = clamp_type
+        self.dt = dt
+        self.engine = engine
+        self.tabulate = tabulate
+        self.stored = False
+        if engine == 'brian2':
+            self.make_model()
+    
+    def make_model(self):
+        # Determine the simulation
+        if self.clamp_type == 'current':
+            eqs_input = self.eqs_current
+        elif self.clamp_type =='dynamic':
+            eqs_input = self.eqs_dynamic
+        tracking = ['v', 'I_inj']
+
+        # Neuron & parameter initialization, fixed names so a checkpoint can be restored in another process
+        name = '%s_%s' % (self.model_name, self.clamp_type)
+        neuron = b2.NeuronGroup(1, model=self.eqs+eqs_input, method='exponential_euler',
+                            threshold=THRESHOLD, refractory=REFRACTORY*b2.ms, reset=None, dt=self.dt*b2.ms, name=name)
         neuron.v = -65*b2.mV
+        neuron.input_scale = 1
 
         # Track the parameters during simulation
-        self.M = b2.StateMonitor(neuron, tracking, record=True)
-        self.S = b2.SpikeMonitor(neuron, record=True)
+        self.M = b2.StateMonitor(neuron, tracking, record=True, name=name + '_statemonitor')
+        self.S = b2.SpikeMonitor(neuron, record=True, name=name + '_spikemonitor')
         self.neuron = neuron
 
         net = b2.Network(neuron)
@@ -147,49 +184,80 @@ class Barrel_PC:
         self.network = net
         
     def store(self):
-        self.network.store()
+        if self.engine == 'brian2':
+            self.network.store()
         self.stored = True
 
     def restore(self):
-        self.network.restore()
+        if self.engine == 'brian2':
+            self.network.restore()
+
+    def get_parameters(self, Ni=None):
+        ''' Get the fitted parameters of a neuron.
+
+            INPUT
+            Ni (int): neuron index, a random neuron if None
+
+            OUTPUT
+            Ni, parameters (int, dict): neuron index and the values of the shared variables of the model
+        '''
+        ## Pick a random set of parameters
+        parameters = np.loadtxt(self.parameter_file, delimiter=',')
+        if Ni == None:
+            Ni = np.random.randint(np.shape(parameters)[1])
+
+        area = 20000*b2.umetre**2
+        return Ni, {'Cm':parameters[2][Ni]*b2.farad/area * b2.cm**2,
+                    'gL':parameters[0][Ni]*b2.siemens/area * b2.cm**2,
+                    'gNa':parameters[3][Ni]*b2.siemens/area * b2.cm**2,
+                    'gK':parameters[1][Ni]*b2.siemens/area * b2.cm**2,
+                    'k_m':parameters[4][Ni]*b2.volt,
+                    'k_h':parameters[5][Ni]*b2.volt,
+                    'Vh_h':parameters[6][Ni]*b2.volt}
 
     def run(self, inj_input, simulation_time, Ni=None):
         ''' Run simulation.
 
             INPUT
-            inj_input ((Tuple of) TimedArray): input current or conductances (g_exc, g_inh)
+            inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
             simulation_time (float): simulation time [milliseconds]
             Ni (int): neuron index
 
             OUTPUT
             StateMonitor, SpikeMonitor: brian2 classes containing neuron information
         '''
+        if self.engine == 'native':
+            return run_native(self, inj_input, simulation_time, Ni)
+
         # Neuron parameters
-        ## Pick a random set of parameters
-        parameters = np.loadtxt('code/models/parameters/PC_parameters.csv', delimiter=',')
-        if Ni == None:
-            Ni = np.random.randint(np.shape(parameters)[1])
+        Ni, parameters = self.get_parameters(Ni)
+        for name, value in parameters.items():
+            setattr(self.neuron, name, value)
         
+        # Unpack a ScaledInput, its scale and baseline are set as model parameters
+        if hasattr(inj_input, 'get_timed_arrays'):
+            self.neuron.input_scale = inj_input.model_scale
+            self.neuron.input_baseline = inj_input.model_baseline
+            inj_input = inj_input.get_timed_arrays()
+        else:
+            self.neuron.input_scale = 1
+            self.neuron.input_baseline = 0*b2.amp if self.clamp_type == 'current' else 0*b2.siemens
+
         if self.clamp_type =='dynamic':
             g_exc, g_inh = inj_input
 
-        ## Initiate parameters
-        area = 20000*b2.umetre**2
-        Cm = parameters[2][Ni]*b2.farad/area * b2.cm**2 
-        gL = parameters[0][Ni]*b2.siemens/area * b2.cm**2 
-        gNa = parameters[3][Ni]*b2.siemens/area * b2.cm**2 
-        gK = parameters[1][Ni]*b2.siemens/area * b2.cm**2 
+        ## Constants of the equations
         EL = -65*b2.mV
         ENa = 50*b2.mV
         EK = -90*b2.mV
         Er_e = 0*b2.mV
         Er_i = -75*b2.mV
-        k_m = parameters[4][Ni]*b2.volt
-        k_h = parameters[5][Ni]*b2.volt
-        Vh_h = parameters[6][Ni]*b2.volt
         VT = -63*b2.mV
    
-        self.network.run(simulation_time*b2.ms)
+        with profiler.timed('Barrel_PC.run', clamp_type=self.clamp_type, Ni=Ni, duration_ms=simulation_time) as timer:
+            run_start = time.perf_counter()
+            self.network.run(simulation_time*b2.ms)
+            timer.info.update(profiler.brian2_split(self.network, time.perf_counter() - run_start))
 
         return self.M, self.S
 
@@ -200,6 +268,10 @@ class Barrel_IN:
         INPUT:
             clamp_type (str): type of input, ['current' or 'dynamic']
             dt (float): time step of the simulation in miliseconds.
+            engine (str): 'brian2' or 'native', the integrator of models/native.py that doesn't use Brian2.
+                          A native run always starts from the initial state, as after restore.
+            tabulate (float): native engine only, interpolate the gating rates from tables with this
+                              voltage step in mV (e.g. native.TABLE_DV) instead of computing them
 
         OUTPUT:
             StateMonitor, SpikeMonitor: Brian2 StateMonitor with recorded fields
@@ -211,25 +283,9 @@ class Barrel_IN:
         transfer in inhibitory and excitatory neurons of rat barrel cortex, but shows no clear
         influence on neuronal parameters. (Unpublished bachelor's thesis)
     '''
-    def __init__(self, clamp_type, dt=0.5):
-        self.clamp_type = clamp_type
-        self.dt = dt
-        self.stored = False
-        self.make_model()
-    
-    def make_model(self):
-        # Determine the simulation
-        if self.clamp_type == 'current':
-            eqs_input = '''I_inj = inj_input(t) : amp'''
-
-        elif self.clamp_type =='dynamic':
-            eqs_input = '''I_exc = g_exc(t) * (Er_e - v) : amp
-                    I_inh = g_inh(t) * (Er_i - v) : amp
-                    I_inj = I_exc + I_inh : amp'''
-        tracking = ['v', 'I_inj']
-        
-        # Model the neuron with differential equations
-        eqs = '''
+    # Model the neuron with differential equations, the fitted parameters are shared variables
+    # that are set by run, so the same model (and compiled code) is used for every neuron
+    eqs = '''
                 # Activation gates Na channel
                 m = 1. / (1. + exp(-(v - Vh) / k)) : 1
                 Vh = 3.223725 * k - 62.615488*mV : volt
@@ -255,16 +311,52 @@ class Barrel_IN:
                 I_K = -gK * n**4 * (v - EK) : amp
                 I_K3 = -gK3 * n3**4 * (v - EK) : amp
                 dv/dt = (I_leak + I_Na + I_K + I_K3 + I_inj) / Cm : volt
-             '''    
 
-        # Neuron & parameter initialization
-        neuron = b2.NeuronGroup(1, model=eqs+eqs_input, method='exponential_euler',
-                            threshold ='m > 0.5', refractory=2*b2.ms, reset=None, dt=self.dt*b2.ms)
+                # Fitted parameters
+                Cm : farad (shared, constant)
+                gL : siemens (shared, constant)
+                gNa : siemens (shared, constant)
+                gK : siemens (shared, constant)
+                gK3 : siemens (shared, constant)
+                k : volt (shared, constant)
+             '''
+    eqs_current = Barrel_PC.eqs_current
+    eqs_dynamic = Barrel_PC.eqs_dynamic
+    parameter_file = 'code/models/parameters/IN_parameters.csv'
+
+    model_name = 'IN'
+
+    def __init__(self, clamp_type, dt=0.5, engine='brian2', tabulate=None):
+        if engine not in ('brian2', 'native'):
+            raise ValueError('Engine must be \'brian2\' or \'native\'')
+        if tabulate is not None and engine != 'native':
+            raise ValueError('Tabulated gating rates need the native engine')
+        self.clamp_type = clamp_type
+        self.dt = dt
+        self.engine = engine
+        self.tabulate = tabulate
+        self.stored = False
+        if engine == 'brian2':
+            self.make_model()
+    
+    def make_model(self):
+        # Determine the simulation
+        if self.clamp_type == 'current':
+            eqs_input = self.eqs_current
+        elif self.clamp_type =='dynamic':
+            eqs_input = self.eqs_dynamic
+        tracking = ['v', 'I_inj']
+
+        # Neuron & parameter initialization, fixed names so a checkpoint can be restored in another process
+        name = '%s_%s' % (self.model_name, self.clamp_type)
+        neuron = b2.NeuronGroup(1, model=self.eqs+eqs_input, method='exponential_euler',
+                            threshold=THRESHOLD, refractory=REFRACTORY*b2.ms, reset=None, dt=self.dt*b2.ms, name=name)
         neuron.v = -65*b2.mV
+        neuron.input_scale = 1
 
         # Track the parameters during simulation
-        self.M = b2.StateMonitor(neuron, tracking, record=True)
-        self.S = b2.SpikeMonitor(neuron, record=True)
+        self.M = b2.StateMonitor(neuron, tracking, record=True, name=name + '_statemonitor')
+        self.S = b2.SpikeMonitor(neuron, record=True, name=name + '_spikemonitor')
         self.neuron = neuron
 
         net = b2.Network(neuron)
@@ -272,47 +364,383 @@ class Barrel_IN:
         self.network = net
         
     def store(self):
-        self.network.store()
+        if self.engine == 'brian2':
+            self.network.store()
         self.stored = True
 
     def restore(self):
-        self.network.restore()
+        if self.engine == 'brian2':
+            self.network.restore()
+
+    def get_parameters(self, Ni=None):
+        ''' Get the fitted parameters of a neuron.
+
+            INPUT
+            Ni (int): neuron index, a random neuron if None
+
+            OUTPUT
+            Ni, parameters (int, dict): neuron index and the values of the shared variables of the model
+        '''
+        ## Pick a random set of parameters
+        parameters = np.loadtxt(self.parameter_file, delimiter=',')
+        if Ni == None:
+            Ni = np.random.randint(np.shape(parameters)[1])
+
+        area = 20000*b2.umetre**2
+        return Ni, {'Cm':parameters[2][Ni]*b2.farad/area * b2.cm**2,
+                    'gL':parameters[0][Ni]*b2.siemens/area * b2.cm**2,
+                    'gNa':parameters[3][Ni]*b2.siemens/area * b2.cm**2,
+                    'gK':parameters[1][Ni]*b2.siemens/area * b2.cm**2,
+                    'gK3':parameters[5][Ni]*b2.siemens/area * b2.cm**2,
+                    'k':parameters[4][Ni]*b2.volt}
 
     def run(self, inj_input, simulation_time, Ni=None):
         ''' Run simulation.
 
             INPUT
-            inj_input ((Tuple of) TimedArray): input current or conductances (g_exc, g_inh)
+            inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
             simulation_time (float): simulation time [milliseconds]
             Ni (int): neuron index
 
             OUTPUT
             StateMonitor, SpikeMonitor: brian2 classes containing neuron information
         '''
-        # Neuron parameters
-        ## Pick a random set of parameters
-        parameters = np.loadtxt('code/models/parameters/IN_parameters.csv', delimiter=',')
+        if self.engine == 'native':
+            return run_native(self, inj_input, simulation_time, Ni)
 
-        if Ni == None:
-            Ni = np.random.randint(np.shape(parameters)[1])
+        # Neuron parameters
+        Ni, parameters = self.get_parameters(Ni)
+        for name, value in parameters.items():
+            setattr(self.neuron, name, value)
+
+        # Unpack a ScaledInput, its scale and baseline are set as model parameters
+        if hasattr(inj_input, 'get_timed_arrays'):
+            self.neuron.input_scale = inj_input.model_scale
+            self.neuron.input_baseline = inj_input.model_baseline
+            inj_input = inj_input.get_timed_arrays()
+        else:
+            self.neuron.input_scale = 1
+            self.neuron.input_baseline = 0*b2.amp if self.clamp_type == 'current' else 0*b2.siemens
 
         if self.clamp_type =='dynamic':
             g_exc, g_inh = inj_input
 
-        ## Initiate parameters
+        ## Constants of the equations
         param = np.log(10)
-        area = 20000*b2.umetre**2
-        Cm = parameters[2][Ni]*b2.farad/area * b2.cm**2 
-        gL = parameters[0][Ni]*b2.siemens/area * b2.cm**2 
-        gNa = parameters[3][Ni]*b2.siemens/area * b2.cm**2 
-        gK = parameters[1][Ni]*b2.siemens/area * b2.cm**2 
-        gK3 = parameters[5][Ni]*b2.siemens/area * b2.cm**2 
         EL = -65*b2.mV
         ENa = 50*b2.mV
         EK = -90*b2.mV
         Er_e = 0*b2.mV
         Er_i = -75*b2.mV
-        k = parameters[4][Ni]*b2.volt
         
-        self.network.run(simulation_time*b2.ms)
+        with profiler.timed('Barrel_IN.run', clamp_type=self.clamp_type, Ni=Ni, duration_ms=simulation_time) as timer:
+            run_start = time.perf_counter()
+            self.network.run(simulation_time*b2.ms)
+            timer.info.update(profiler.brian2_split(self.network, time.perf_counter() - run_start))
         return self.M, self.S
+
+
+# Units of the fitted parameters in the native engine
+NATIVE_UNITS = {'Cm':b2.uF, 'gL':b2.mS, 'gNa':b2.mS, 'gK':b2.mS, 'gK3':b2.mS,
+                'k_m':b2.mV, 'k_h':b2.mV, 'Vh_h':b2.mV, 'k':b2.mV}
+
+
+class NativeStateMonitor:
+    ''' Recording of a native run with the attributes of a brian2.StateMonitor: t, v and I_inj.
+    '''
+    def __init__(self, t, v, I_inj):
+        self.t = t*b2.ms
+        self.v = v*b2.mV
+        self.I_inj = I_inj*b2.uamp
+
+
+class NativeSpikeMonitor:
+    ''' Spikes of a native run with the attributes of a brian2.SpikeMonitor: t, i, count and num_spikes.
+    '''
+    def __init__(self, spiketimes):
+        self.t = np.asarray(spiketimes)*b2.ms
+        self.i = np.zeros(len(spiketimes), dtype=int)
+        self.num_spikes = len(spiketimes)
+        self.count = np.array([self.num_spikes])
+
+
+def get_native_input(neuron, inj_input, n_steps):
+    ''' Unpacks the input of a model neuron for the native engine.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN
+        inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
+        n_steps (int): number of time steps of the run
+
+        OUTPUT
+        buffer, scale, baseline: unscaled input in uA or mS, its scale and baseline
+    '''
+    if hasattr(inj_input, 'get_timed_arrays'):
+        buffers = inj_input.buffer
+        scale, baseline = inj_input.scale, inj_input.baseline
+    else:
+        # TimedArrays hold SI values
+        unit = b2.uamp if neuron.clamp_type == 'current' else b2.mS
+        if neuron.clamp_type == 'current':
+            buffers = inj_input.values / float(unit)
+        else:
+            buffers = tuple(timed_array.values / float(unit) for timed_array in inj_input)
+        scale, baseline = 1., 0.
+
+    # Like a TimedArray, the last value is held after the end of the input
+    buffers = [buffers] if neuron.clamp_type == 'current' else list(buffers)
+    buffers = [np.pad(np.asarray(buffer, dtype=np.float64)[:n_steps], (0, max(n_steps - len(buffer), 0)), mode='edge')
+               for buffer in buffers]
+    if neuron.clamp_type == 'current':
+        return buffers[0], scale, baseline
+    return tuple(buffers), scale, baseline
+
+
+def get_native_parameters(neuron, Ni=None):
+    ''' Get the fitted parameters of a neuron in the units of the native engine.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN
+        Ni (int): neuron index, a random neuron if None
+
+        OUTPUT
+        Ni, parameters (int, dict): neuron index and the parameters as floats, see native.PARAMETERS
+    '''
+    Ni, parameters = neuron.get_parameters(Ni)
+    return Ni, {name:float(value/NATIVE_UNITS[name]) for name, value in parameters.items()}
+
+
+def run_native(neuron, inj_input, simulation_time, Ni=None, scales=None):
+    ''' Runs a model neuron with the native engine.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN
+        inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
+        simulation_time (float): simulation time [milliseconds]
+        Ni (int): neuron index
+        scales (array, optional): simulate a batch of scales of the input at once
+
+        OUTPUT
+        StateMonitor, SpikeMonitor: recordings with the attributes of the brian2 monitors, or a list
+                                    of SpikeMonitors (one per scale) if scales are given
+    '''
+    Ni, parameters = get_native_parameters(neuron, Ni)
+    n_steps = int(round(simulation_time/neuron.dt))
+    buffer, scale, baseline = get_native_input(neuron, inj_input, n_steps)
+
+    with profiler.timed('%s.run' % type(neuron).__name__, clamp_type=neuron.clamp_type, Ni=Ni,
+                        duration_ms=simulation_time, engine='native'):
+        result = native.simulate(neuron.model_name, neuron.clamp_type, buffer, neuron.dt, parameters,
+                                 scale if scales is None else scales, baseline, record=scales is None,
+                                 tabulate=neuron.tabulate, refractory=REFRACTORY)
+
+    if scales is not None:
+        return [NativeSpikeMonitor(spiketimes) for spiketimes in result['spiketimes']]
+    M = NativeStateMonitor(np.arange(n_steps)*neuron.dt, result['voltage'], result['I_inj'])
+    return M, NativeSpikeMonitor(result['spiketimes'][0])
+
+
+def save_checkpoint(neuron, filename):
+    ''' Snapshots the state of a Brian2 model neuron, including its monitors, to a file with
+        network.store. The file is replaced atomically, so a crash leaves the previous snapshot.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN with the brian2 engine
+        filename (str): file of the snapshot
+    '''
+    if neuron.engine != 'brian2':
+        raise ValueError('Only Brian2 models can be snapshotted')
+    tmp_filename = filename + '.tmp'
+    neuron.network.store('checkpoint', filename=tmp_filename)
+    os.replace(tmp_filename, filename)
+
+
+def load_checkpoint(neuron, filename):
+    ''' Restores a snapshot of save_checkpoint. The model must be made in the same way (model class,
+        clamp type and dt) as the snapshotted model, e.g. in a new process after a crash. The snapshot
+        is matched on the names of the Brian2 objects, so these must not depend on the other objects
+        in the process: make_model names them after model_name and clamp_type.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN with the brian2 engine
+        filename (str): file of the snapshot
+
+        OUTPUT
+        t (float): simulated time of the snapshot in milliseconds
+    '''
+    neuron.network.restore('checkpoint', filename=filename)
+    return float(neuron.network.t/b2.ms)
+
+
+def run_checkpointed(neuron, inj_input, simulation_time, Ni, filename, interval):
+    ''' Runs a model neuron from its initial state in segments and snapshots it after every segment,
+        so a long run that is interrupted continues from the last snapshot when it is started again
+        with the same arguments.
+
+        INPUT
+        neuron (Class): Barrel_PC or Barrel_IN with the brian2 engine, restored to its initial state
+        inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
+        simulation_time (float): simulation time [milliseconds]
+        Ni (int): neuron index, has to be given so the same neuron is resumed
+        filename (str): file of the snapshot. It is kept after the run, so a complete run is only
+                        restored when it is started again; remove it once the result is stored
+        interval (float): simulation time between snapshots [milliseconds]
+
+        OUTPUT
+        StateMonitor, SpikeMonitor: brian2 classes containing neuron information of the whole run
+    '''
+    if Ni is None:
+        raise ValueError('Ni must be given, a resumed run has to simulate the same neuron')
+
+    if os.path.exists(filename):
+        t = load_checkpoint(neuron, filename)
+    else:
+        t = float(neuron.network.t/b2.ms)
+        if t > 0:
+            raise ValueError('Restore the neuron before a checkpointed run')
+
+    while t < simulation_time - neuron.dt/2:
+        neuron.run(inj_input, min(interval, simulation_time - t), Ni)
+        t = float(neuron.network.t/b2.ms)
+        save_checkpoint(neuron, filename)
+    return neuron.M, neuron.S
+
+
+def validate_native(model_class, clamp_type, inj_input, simulation_time, Ni, dt=0.5, tabulate=None):
+    ''' Compares a native run with a Brian2 run of the same neuron and input.
+
+        INPUT
+        model_class (class): Barrel_PC or Barrel_IN
+        clamp_type (str): type of input, ['current' or 'dynamic']
+        inj_input ((Tuple of) TimedArray or ScaledInput): input current or conductances (g_exc, g_inh)
+        simulation_time (float): simulation time [milliseconds]
+        Ni (int): neuron index
+        dt (float): time step of the simulation in miliseconds
+        tabulate (float, optional): run the native engine with tabulated gating rates, see native.table_accuracy
+
+        OUTPUT
+        report (dict): spike counts of both engines, the largest difference of matched spike times
+                       (ms) and of the voltage before the first spike time difference (mV)
+    '''
+    M_b2, S_b2 = model_class(clamp_type, dt=dt).run(inj_input, simulation_time, Ni)
+    M_nat, S_nat = model_class(clamp_type, dt=dt, engine='native', tabulate=tabulate).run(inj_input, simulation_time, Ni)
+
+    t_b2 = np.asarray(S_b2.t/b2.ms)
+    t_nat = np.asarray(S_nat.t/b2.ms)
+    n_matched = min(len(t_b2), len(t_nat))
+    differences = np.abs(t_b2[:n_matched] - t_nat[:n_matched])
+
+    # Once a spike shifts by a time step the traces diverge, compare the voltage up to there
+    v_b2 = np.asarray(M_b2.v[0]/b2.mV)
+    v_nat = np.asarray(M_nat.v[0]/b2.mV)
+    n_samples = min(len(v_b2), len(v_nat))
+    shifted = np.flatnonzero(differences > dt/2)
+    if len(shifted):
+        n_samples = min(n_samples, int(t_b2[shifted[0]]/dt))
+    return {'spikes_brian2':len(t_b2), 'spikes_native':len(t_nat),
+            'max_spike_time_difference':float(differences.max()) if n_matched else 0.,
+            'max_voltage_difference':float(np.max(np.abs(v_b2[:n_samples] - v_nat[:n_samples]))) if n_samples else 0.}
+
+
+class Standalone:
+    ''' Runs a Barrel_PC or Barrel_IN model in Brian2 standalone mode: the model is compiled to a
+        C++ program once and every run only executes that program, with the input and the neuron
+        parameters passed as run arguments. Needs Brian2 2.7 or newer and a local C++ compiler.
+
+        Standalone mode applies to the whole process, so only one Standalone model can be built
+        per process (use worker processes for more models). The length of the input is compiled
+        into the program, so a model is built per (model, clamp_type, dt, duration).
+
+        INPUT
+        model_class (class): Barrel_PC or Barrel_IN
+        clamp_type (str): type of input, ['current' or 'dynamic']
+        dt (float): time step of the simulation in miliseconds
+        duration (float): simulation time of every run in miliseconds
+        directory (str): directory of the C++ project, defaults to standalone/<model>_<clamp_type>_<dt>_<duration>
+    '''
+    def __init__(self, model_class, clamp_type, dt, duration, directory=None):
+        if directory is None:
+            directory = os.path.join('standalone', '%s_%s_%s_%s' % (model_class.__name__, clamp_type, dt, duration))
+        self.model_class = model_class
+        self.clamp_type = clamp_type
+        self.dt = dt
+        self.duration = duration
+        self.directory = directory
+        self.n_samples = int(round(duration/dt))
+        self.model = None
+        self.build_time = None
+        self.run_times = []
+
+    def build(self):
+        ''' Generates and compiles the C++ project. Compilation is incremental, an unchanged
+            project in the same directory is not recompiled. Every run starts from the initial
+            state of the model, so store and restore are not needed.
+        '''
+        b2.set_device('cpp_standalone', directory=self.directory, build_on_run=False)
+
+        build_start = time.perf_counter()
+        self.model = self.model_class(self.clamp_type, dt=self.dt)
+
+        # Placeholder input, replaced by the run arguments
+        self.dim = b2.get_dimensions(b2.amp if self.clamp_type == 'current' else b2.siemens)
+        n_inputs = 1 if self.clamp_type == 'current' else 2
+        self.timed_arrays = [b2.TimedArray(b2.Quantity(np.zeros(self.n_samples), dim=self.dim), dt=self.dt*b2.ms)
+                             for _ in range(n_inputs)]
+        placeholder = self.timed_arrays[0] if self.clamp_type == 'current' else tuple(self.timed_arrays)
+        self.model.run(placeholder, self.duration, Ni=0)
+        b2.device.build(directory=self.directory, run=False)
+        self.build_time = time.perf_counter() - build_start
+
+        profiler.record('Standalone.build', model=self.model_class.__name__, clamp_type=self.clamp_type,
+                        dt=self.dt, duration_ms=self.duration, wall_s=self.build_time)
+
+    def run(self, inj_input, Ni=None):
+        ''' Runs the compiled program with a new input and neuron.
+
+            INPUT
+            inj_input (ScaledInput, array or tuple): input current or conductances (g_exc, g_inh),
+                                                     arrays in uA or mS
+            Ni (int): neuron index
+
+            OUTPUT
+            StateMonitor, SpikeMonitor: brian2 classes containing neuron information
+        '''
+        if self.model is None:
+            self.build()
+        neuron = self.model.neuron
+
+        # Input, its scale and baseline
+        if hasattr(inj_input, 'get_timed_arrays'):
+            buffers = inj_input.buffer
+            scale, baseline = inj_input.model_scale, inj_input.model_baseline
+        else:
+            buffers = inj_input
+            unit = b2.uamp if self.clamp_type == 'current' else b2.mS
+            scale, baseline = float(unit), 0*unit
+        if self.clamp_type == 'current':
+            buffers = (buffers,)
+        if any(len(buffer) != self.n_samples for buffer in buffers):
+            raise AssertionError('Input length doesn\'t match the duration the model was built for')
+
+        # Run arguments
+        Ni, parameters = self.model.get_parameters(Ni)
+        run_args = {getattr(neuron, name):value for name, value in parameters.items()}
+        run_args[neuron.input_scale] = scale
+        run_args[neuron.input_baseline] = baseline
+        for timed_array, buffer in zip(self.timed_arrays, buffers):
+            run_args[timed_array] = b2.Quantity(np.asarray(buffer, dtype=np.float64), dim=self.dim)
+
+        run_start = time.perf_counter()
+        b2.device.run(run_args=run_args)
+        run_time = time.perf_counter() - run_start
+        self.run_times.append(run_time)
+
+        profiler.record('Standalone.run', model=self.model_class.__name__, clamp_type=self.clamp_type,
+                        Ni=Ni, duration_ms=self.duration, wall_s=run_time)
+        return self.model.M, self.model.S
+
+    def report(self):
+        ''' Build time and run times in seconds.
+        '''
+        return {'build_s':self.build_time, 'runs':len(self.run_times), 'run_s':list(self.run_times),
+                'mean_run_s':float(np.mean(self.run_times)) if self.run_times else None}
@@ -0,0 +1,406 @@
+''' native.py
+
+    Exponential-Euler integrator of the Barrel_PC and Barrel_IN models without Brian2. The
+    equations, integration method, threshold (m > 0.5) and refractory period (2 ms) are those of
+    the Brian2 models in models.py, so the traces agree up to floating point differences.
+
+    The integration is vectorized over a batch of cells: every cell can have its own parameters,
+    scale and baseline, so many neurons or many scales of one input are simulated at once. The
+    kernels are compiled with numba when it is installed and run as NumPy code otherwise.
+
+    Optionally the gating rates are tabulated on a fine voltage grid and linearly interpolated
+    during the integration, which replaces the exp and exprel calls of every step by a table
+    look-up. Cells with the same fitted parameters (e.g. one neuron at many scales) share a table.
+    table_accuracy reports the interpolation error against the analytic rates.
+
+    Units: time in ms, voltage in mV, current in uA, conductance in mS and capacitance in uF.
+'''
+import numpy as np
+try:
+    import numba
+except ImportError:
+    numba = None
+
+# Constants of the equations in mV
+EL = -65.
+ENa = 50.
+EK = -90.
+Er_e = 0.
+Er_i = -75.
+VT = -63.
+V_INIT = -65.
+REFRACTORY = 2.
+
+# Fitted parameters of the models, see get_parameters in models.py
+PARAMETERS = {'PC':['Cm', 'gL', 'gNa', 'gK', 'k_m', 'k_h', 'Vh_h'],
+              'IN':['Cm', 'gL', 'gNa', 'gK', 'gK3', 'k']}
+
+# Gating rates of the models and the fitted parameters they depend on
+RATES = {'PC':['m', 'h', 'alpha_n', 'beta_n'],
+         'IN':['m', 'alpha_h', 'beta_h', 'alpha_n', 'beta_n', 'alphan3', 'betan3']}
+RATE_PARAMETERS = {'PC':['k_m', 'k_h', 'Vh_h'],
+                   'IN':['k']}
+
+# Gating variables of the models, the state of a cell is its voltage and these
+GATES = {'PC':['n'],
+         'IN':['h', 'n', 'n3']}
+
+# Voltage grid of the rate tables in mV, outside the grid the rates of its ends are used
+TABLE_DV = 0.01
+TABLE_V_MIN = -120.
+TABLE_V_MAX = 60.
+
+
+def _jit(func):
+    if numba is None:
+        return func
+    return numba.njit(cache=True)(func)
+
+
+@_jit
+def _exprel(x):
+    nonzero = np.abs(x) > 1e-8
+    safe_x = np.where(nonzero, x, 1.)
+    return np.where(nonzero, np.expm1(safe_x) / safe_x, 1.)
+
+
+@_jit
+def _exp_euler(x, A, B, dt):
+    # Exact step of dx/dt = A + B*x for A and B constant during the step
+    return -A/B + (x + A/B) * np.exp(B*dt)
+
+
+@_jit
+def _rates_PC(v, k_m, k_h, Vh_h):
+    rates = np.empty((4, len(v)))
+    Vh_m = 3.583881 * k_m - 53.294454
+    rates[0] = 1 / (1 + np.exp(-(v - Vh_m) / k_m))
+    rates[1] = 1 / (1 + np.exp((v - Vh_h) / k_h))
+    rates[2] = 0.032 * 5. / _exprel((15. - v + VT) / 5.)
+    rates[3] = 0.5 * np.exp((10. - v + VT) / 40.)
+    return rates
+
+
+@_jit
+def _rates_IN(v, k):
+    rates = np.empty((7, len(v)))
+    Vh = 3.223725 * k - 62.615488
+    param = np.log(10.)
+    rates[0] = 1. / (1. + np.exp(-(v - Vh) / k))
+    rates[1] = 0.07 * np.exp(-(v + 58.) / 20.)
+    rates[2] = 1. / (np.exp(-0.1 * (v + 28.)) + 1.)
+    rates[3] = 0.01 * 10. / _exprel(-(v + 34.) / 10.)
+    rates[4] = 0.125 * np.exp(-(v + 44.) / 80.)
+    rates[5] = 1. / np.exp(param * (-0.029 * v + 1.9))
+    rates[6] = 1. / np.exp(param * (0.021 * v + 1.1))
+    return rates
+
+
+@_jit
+def _interpolate(tables, offsets, v, v_min, dv):
+    # The table of cell i starts at column offsets[i] of the tables laid out one after the other
+    n_grid = tables.shape[2]
+    flat = tables.reshape((tables.shape[0], tables.shape[1] * n_grid))
+    position = np.minimum(np.maximum((v - v_min) / dv, 0.), n_grid - 1.)
+    idx = np.minimum(position.astype(np.int64), n_grid - 2)
+    fraction = position - idx
+    columns = idx + offsets
+    return flat[:, columns] + fraction * (flat[:, columns + 1] - flat[:, columns])
+
+
+@_jit
+def _step_PC(v, n, A_inj, B_inj, Cm, gL, gNa, gK, k_m, k_h, Vh_h, dt, tables, offsets, v_min, dv):
+    # Gating with the voltage at the start of the step
+    tabulated = tables.shape[2] > 0
+    if tabulated:
+        rates = _interpolate(tables, offsets, v, v_min, dv)
+    else:
+        rates = _rates_PC(v, k_m, k_h, Vh_h)
+    m, h, alpha_n, beta_n = rates[0], rates[1], rates[2], rates[3]
+    g_Na = gNa * m**3 * h
+    g_K = gK * n**4
+
+    A_v = (gL * EL + g_Na * ENa + g_K * EK + A_inj) / Cm
+    B_v = -(gL + g_Na + g_K + B_inj) / Cm
+    n = _exp_euler(n, alpha_n, -(alpha_n + beta_n), dt)
+    v = _exp_euler(v, A_v, B_v, dt)
+
+    # Threshold on the updated voltage. m > 0.5 exactly where v > Vh_m, which the tabulated
+    # run uses instead of interpolating m
+    Vh_m = 3.583881 * k_m - 53.294454
+    if tabulated:
+        above = v > Vh_m
+    else:
+        above = 1 / (1 + np.exp(-(v - Vh_m) / k_m)) > 0.5
+    return v, n, above
+
+
+@_jit
+def _run_PC(Cm, gL, gNa, gK, k_m, k_h, Vh_h, inputs, scale, baseline, dynamic, dt, refractory_steps,
+            tables, offsets, v_min, dv, voltage, current, spikes):
+    n_cells = len(Cm)
+    v = np.full(n_cells, V_INIT)
+    n = np.zeros(n_cells)
+    lastspike = np.full(n_cells, -refractory_steps)
+    record = voltage.shape[1] > 0
+
+    for step in range(inputs.shape[1]):
+        # Injected current A_inj - B_inj*v
+        if dynamic:
+            g_exc = baseline + scale * inputs[0, step]
+            g_inh = baseline + scale * inputs[1, step]
+            A_inj = g_exc * Er_e + g_inh * Er_i
+            B_inj = g_exc + g_inh
+        else:
+            A_inj = baseline + scale * inputs[0, step]
+            B_inj = np.zeros(n_cells)
+        if record:
+            voltage[:, step] = v
+            current[:, step] = A_inj - B_inj * v
+
+        v, n, above = _step_PC(v, n, A_inj, B_inj, Cm, gL, gNa, gK, k_m, k_h, Vh_h, dt, tables, offsets, v_min, dv)
+
+        # Spikes outside the refractory period
+        spiking = above & (step - lastspike >= refractory_steps)
+        spikes[:, step] = spiking
+        lastspike = np.where(spiking, step, lastspike)
+
+
+@_jit
+def _step_IN(v, h, n, n3, A_inj, B_inj, Cm, gL, gNa, gK, gK3, k, dt, tables, offsets, v_min, dv):
+    # Gating with the voltage at the start of the step
+    tabulated = tables.shape[2] > 0
+    if tabulated:
+        rates = _interpolate(tables, offsets, v, v_min, dv)
+    else:
+        rates = _rates_IN(v, k)
+    m, alpha_h, beta_h, alpha_n, beta_n, alphan3, betan3 = (rates[0], rates[1], rates[2], rates[3],
+                                                            rates[4], rates[5], rates[6])
+    g_Na = gNa * m**3 * h
+    g_K = gK * n**4
+    g_K3 = gK3 * n3**4
+
+    A_v = (gL * EL + g_Na * ENa + (g_K + g_K3) * EK + A_inj) / Cm
+    B_v = -(gL + g_Na + g_K + g_K3 + B_inj) / Cm
+    h = _exp_euler(h, 5. * alpha_h, -5. * (alpha_h + beta_h), dt)
+    n = _exp_euler(n, 5. * alpha_n, -5. * (alpha_n + beta_n), dt)
+    n3 = _exp_euler(n3, alphan3, -(alphan3 + betan3), dt)
+    v = _exp_euler(v, A_v, B_v, dt)
+
+    # Threshold on the updated voltage. m > 0.5 exactly where v > Vh, which the tabulated
+    # run uses instead of interpolating m
+    Vh = 3.223725 * k - 62.615488
+    if tabulated:
+        above = v > Vh
+    else:
+        above = 1. / (1. + np.exp(-(v - Vh) / k)) > 0.5
+    return v, h, n, n3, above
+
+
+@_jit
+def _run_IN(Cm, gL, gNa, gK, gK3, k, inputs, scale, baseline, dynamic, dt, refractory_steps,
+            tables, offsets, v_min, dv, voltage, current, spikes):
+    n_cells = len(Cm)
+    v = np.full(n_cells, V_INIT)
+    h = np.zeros(n_cells)
+    n = np.zeros(n_cells)
+    n3 = np.zeros(n_cells)
+    lastspike = np.full(n_cells, -refractory_steps)
+    record = voltage.shape[1] > 0
+
+    for step in range(inputs.shape[1]):
+        # Injected current A_inj - B_inj*v
+        if dynamic:
+            g_exc = baseline + scale * inputs[0, step]
+            g_inh = baseline + scale * inputs[1, step]
+            A_inj = g_exc * Er_e + g_inh * Er_i
+            B_inj = g_exc + g_inh
+        else:
+            A_inj = baseline + scale * inputs[0, step]
+            B_inj = np.zeros(n_cells)
+        if record:
+            voltage[:, step] = v
+            current[:, step] = A_inj - B_inj * v
+
+        v, h, n, n3, above = _step_IN(v, h, n, n3, A_inj, B_inj, Cm, gL, gNa, gK, gK3, k, dt, tables, offsets,
+                                      v_min, dv)
+
+        # Spikes outside the refractory period
+        spiking = above & (step - lastspike >= refractory_steps)
+        spikes[:, step] = spiking
+        lastspike = np.where(spiking, step, lastspike)
+
+
+def get_grid(dv=TABLE_DV, v_min=TABLE_V_MIN, v_max=TABLE_V_MAX):
+    ''' Voltage grid of the rate tables in mV.
+    '''
+    return v_min + dv * np.arange(int(round((v_max - v_min)/dv)) + 1)
+
+
+def make_tables(model, parameters, dv=TABLE_DV, v_min=TABLE_V_MIN, v_max=TABLE_V_MAX):
+    ''' Tabulates the gating rates of a batch of cells on a voltage grid. Every distinct set of
+        parameters is tabulated once, cells with the same parameters share its table.
+
+        INPUT
+        model (str): 'PC' or 'IN'
+        parameters (dict): fitted parameters (see RATE_PARAMETERS), scalars or one value per cell
+        dv (float): voltage step of the grid in mV
+        v_min, v_max (float): voltage range of the grid in mV
+
+        OUTPUT
+        tables (array): rates (see RATES) of every table and grid voltage, (number of rates, tables, grid voltages)
+        table_index (array): table of every cell
+    '''
+    grid = get_grid(dv, v_min, v_max)
+    values = np.broadcast_arrays(*[np.atleast_1d(np.asarray(parameters[name], dtype=np.float64))
+                                   for name in RATE_PARAMETERS[model]])
+    unique, table_index = np.unique(np.column_stack(values), axis=0, return_inverse=True)
+    v = np.tile(grid, len(unique))
+    rates = _rates_PC if model == 'PC' else _rates_IN
+    tables = rates(v, *[np.repeat(value, len(grid)) for value in unique.T])
+    return tables.reshape(len(RATES[model]), len(unique), len(grid)), table_index.ravel().astype(np.int64)
+
+
+def table_accuracy(model, parameters, dv=TABLE_DV, v_min=TABLE_V_MIN, v_max=TABLE_V_MAX):
+    ''' Error of the interpolated gating rates against the analytic rates, evaluated halfway
+        between the grid voltages where the error of linear interpolation is largest.
+
+        INPUT
+        model (str): 'PC' or 'IN'
+        parameters (dict): fitted parameters (see RATE_PARAMETERS), scalars
+        dv (float): voltage step of the grid in mV
+        v_min, v_max (float): voltage range of the grid in mV
+
+        OUTPUT
+        report (dict): per rate the largest absolute and relative error and the voltage (mV) of the
+                       largest relative error, and the size of the tables in bytes
+    '''
+    parameters = {name:float(parameters[name]) for name in RATE_PARAMETERS[model]}
+    tables, _ = make_tables(model, parameters, dv, v_min, v_max)
+    v = get_grid(dv, v_min, v_max)[:-1] + dv/2
+
+    rates = _rates_PC if model == 'PC' else _rates_IN
+    exact = rates(v, *[np.full(len(v), parameters[name]) for name in RATE_PARAMETERS[model]])
+    interpolated = [np.interp(v, get_grid(dv, v_min, v_max), table[0]) for table in tables]
+
+    report = {'dv':dv, 'table_bytes':tables.nbytes}
+    for name, exact_rate, rate in zip(RATES[model], exact, interpolated):
+        error = np.abs(rate - exact_rate)
+        relative = error / np.maximum(np.abs(exact_rate), np.finfo(float).tiny)
+        report[name] = {'max_error':float(error.max()), 'max_relative_error':float(relative.max()),
+                        'v_max_relative_error':float(v[np.argmax(relative)])}
+    return report
+
+
+def initial_state(model, n_cells=1):
+    ''' State of a batch of cells at the start of a run, see step.
+
+        OUTPUT
+        state (dict): voltage 'v' in mV and the gating variables (see GATES) of every cell
+    '''
+    state = {'v':np.full(n_cells, V_INIT)}
+    state.update((gate, np.zeros(n_cells)) for gate in GATES[model])
+    return state
+
+
+def step(model, state, parameters, I_inj, dt, tables=None, dv=TABLE_DV):
+    ''' Advances a batch of cells one time step, with the step of the kernels of simulate. For
+        stepping a cell sample by sample, e.g. in the closed loop emulator of foundations/closed_loop.py.
+
+        INPUT
+        model (str): 'PC' or 'IN'
+        state (dict): state of the cells from initial_state, updated in place
+        parameters (dict): fitted parameters (see PARAMETERS) in native units, float arrays with one value per cell
+        I_inj (float or array): injected current during the step in uA
+        dt (float): time step in ms
+        tables (tuple, optional): rate tables and table index of the cells from make_tables
+        dv (float): voltage step of the tables in mV
+
+        OUTPUT
+        above (array): whether every cell is above the threshold after the step, the refractory
+                       period is left to the caller
+    '''
+    n_cells = len(state['v'])
+    A_inj = np.broadcast_to(np.asarray(I_inj, dtype=np.float64), (n_cells,)).copy()
+    B_inj = np.zeros(n_cells)
+    if tables is None:
+        tables, table_index = np.empty((len(RATES[model]), 0, 0)), np.zeros(n_cells, dtype=np.int64)
+    else:
+        tables, table_index = tables
+    offsets = table_index * tables.shape[2]
+    values = [parameters[name] for name in PARAMETERS[model]]
+
+    if model == 'PC':
+        state['v'], state['n'], above = _step_PC(state['v'], state['n'], A_inj, B_inj, *values, dt,
+                                                 tables, offsets, TABLE_V_MIN, dv)
+    else:
+        state['v'], state['h'], state['n'], state['n3'], above = _step_IN(state['v'], state['h'], state['n'], state['n3'],
+                                                                         A_inj, B_inj, *values, dt, tables, offsets,
+                                                                         TABLE_V_MIN, dv)
+    return above
+
+
+def simulate(model, clamp_type, inj_input, dt, parameters, scale=1., baseline=0., record=True, tabulate=None,
+             refractory=REFRACTORY):
+    ''' Simulates a batch of cells with the same input.
+
+        INPUT
+        model (str): 'PC' or 'IN'
+        clamp_type (str): 'current' or 'dynamic'
+        inj_input (array or tuple): unscaled input of every time step in uA; (g_exc, g_inh) in mS if dynamic
+        dt (float): time step in ms, equal to the time step of the input
+        parameters (dict): fitted parameters (see PARAMETERS) in native units, scalars or one value per cell
+        scale (float or array): scale of the input, one value per cell to simulate a batch of scales
+        baseline (float or array): baseline in uA or mS
+        record (bool): record the voltage and injected current
+        tabulate (float, optional): interpolate the gating rates from tables with this voltage step in mV
+        refractory (float): refractory period in ms
+
+        OUTPUT
+        result (dict): 'voltage' (mV) and 'I_inj' (uA) of every cell and time step if recorded,
+                       'spiketimes' (list of arrays in ms) and 'num_spikes' of every cell
+    '''
+    # Checks
+    if model not in PARAMETERS:
+        raise ValueError('Model must be \'PC\' or \'IN\'')
+    if clamp_type == 'current':
+        inputs = np.atleast_2d(np.asarray(inj_input, dtype=np.float64))
+        dynamic = False
+    elif clamp_type == 'dynamic':
+        inputs = np.array([np.asarray(g, dtype=np.float64).ravel() for g in inj_input])
+        dynamic = True
+    else:
+        raise ValueError('ClampType must be \'current\' or \'dynamic\'')
+
+    # Broadcast the parameters, scales and baselines to the batch
+    values = [np.atleast_1d(np.asarray(parameters[name], dtype=np.float64)) for name in PARAMETERS[model]]
+    values += [np.atleast_1d(np.asarray(scale, dtype=np.float64)), np.atleast_1d(np.asarray(baseline, dtype=np.float64))]
+    values = [np.ascontiguousarray(value) for value in np.broadcast_arrays(*values)]
+    n_cells = len(values[0])
+    n_steps = inputs.shape[1]
+
+    voltage = np.empty((n_cells, n_steps if record else 0))
+    current = np.empty_like(voltage)
+    spikes = np.zeros((n_cells, n_steps), dtype=np.bool_)
+    refractory_steps = int(round(refractory/dt))
+
+    if tabulate is None:
+        tables, table_index = np.empty((len(RATES[model]), 0, 0)), np.zeros(n_cells, dtype=np.int64)
+        dv = TABLE_DV
+    else:
+        # One table per distinct neuron, e.g. one table for a batch of scales
+        tables, table_index = make_tables(model, dict(zip(PARAMETERS[model], values)), tabulate)
+        dv = tabulate
+    # First column of the table of every cell, computed once instead of every step
+    offsets = table_index * tables.shape[2]
+
+    kernel = _run_PC if model == 'PC' else _run_IN
+    kernel(*values[:-2], inputs, values[-2], values[-1], dynamic, dt, refractory_steps,
+           tables, offsets, TABLE_V_MIN, dv, voltage, current, spikes)
+
+    spiketimes = [np.flatnonzero(row) * dt for row in spikes]
+    result = {'spiketimes':spiketimes, 'num_spikes':np.array([len(times) for times in spiketimes])}
+    if record:
+        result['voltage'] = voltage
+        result['I_inj'] = current
+    return result
@@ -0,0 +1,136 @@
+''' batch_render.py
+
+    Renders the current and dynamic clamp figures of many runs to PNG/PDF files, without a display,
+    in a pool of worker processes. Every worker uses the Agg backend and keeps one figure per clamp
+    type that is cleared and reused for every run. A figure is skipped when its output files exist
+    and its input has not changed since it was rendered.
+'''
+import os
+import json
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+
+def jobs_from_store(store, run_ids=None):
+    ''' Makes render jobs of runs in a ResultStore, the workers read the arrays themselves. The clamp
+        type of a run is read from its meta data; runs without one (e.g. the stimulus of a campaign)
+        and runs that were not accepted are left out.
+
+        INPUT
+        store (ResultStore): store containing the runs
+        run_ids (list): identifiers of the runs, all runs by default
+
+        OUTPUT
+        jobs (list of dict)
+    '''
+    if run_ids is None:
+        run_ids = store.runs()
+    jobs = []
+    for run_id in run_ids:
+        meta = store.meta(run_id)
+        if meta.get('clamp_type') is None or not meta.get('accepted', True):
+            continue
+        jobs.append({'name':str(run_id), 'clamp_type':meta['clamp_type'], 'store':store.root, 'run_id':run_id,
+                     'stimulus':meta.get('stimulus')})
+    return jobs
+
+
+def render_batch(jobs, out_dir, formats=('png',), n_workers=None, window=None, n_bins=2000, dpi=100, force=False):
+    ''' Renders the figures of many runs in parallel.
+
+        INPUT
+        jobs (list of dict): jobs as made by jobs_from_store, or of runs in memory with the keys 'name',
+                             'clamp_type', 'dt', 'inj_input', 'voltage' and 'hidden_state'
+        out_dir (str): directory in which the figures are written
+        formats (tuple): file formats, e.g. ('png', 'pdf')
+        n_workers (int): number of worker processes, defaults to the number of CPUs
+        window (array): [start, stop] in samples, None for the whole run
+        n_bins (int): number of bins the traces are decimated to
+        dpi (int): resolution of the figures
+        force (bool): also render figures of which the input is unchanged
+
+        OUTPUT
+        status (dict): 'rendered' or 'skipped' per job name
+    '''
+    os.makedirs(out_dir, exist_ok=True)
+    options = {'out_dir':out_dir, 'formats':tuple(formats), 'window':window, 'n_bins':n_bins, 'dpi':dpi, 'force':force}
+
+    with ProcessPoolExecutor(n_workers, initializer=_init_render_worker) as pool:
+        statuses = pool.map(_render_job, jobs, [options]*len(jobs), chunksize=max(1, len(jobs)//(4*(n_workers or os.cpu_count()))))
+        return dict(zip([job['name'] for job in jobs], statuses))
+
+
+def get_job_hash(job, options):
+    ''' Hash of the input of a job and the options that change its figure.
+    '''
+    sha = hashlib.sha1(json.dumps([job['clamp_type'], options['window'], options['n_bins'], options['dpi']]).encode())
+    if 'store' in job:
+        # Stored runs are written once, their file sizes and modification times identify them. The
+        # hidden state is read from the stimulus run
+        for run_id in [job['run_id'], job.get('stimulus')]:
+            if run_id is None:
+                continue
+            run_dir = os.path.join(job['store'], str(run_id))
+            for file_name in sorted(os.listdir(run_dir)):
+                stat = os.stat(os.path.join(run_dir, file_name))
+                sha.update(('%s %d %d' % (file_name, stat.st_size, stat.st_mtime_ns)).encode())
+    else:
+        sha.update(repr(job['dt']).encode())
+        for array in _flatten([job['inj_input'], job['voltage'], job['hidden_state']]):
+            sha.update(np.ascontiguousarray(array).tobytes())
+    return sha.hexdigest()
+
+
+def _flatten(arrays):
+    for array in arrays:
+        if isinstance(array, (tuple, list)):
+            yield from _flatten(array)
+        else:
+            yield np.asarray(array)
+
+
+# Figures of a worker process, reused for every job
+_figures = {}
+
+def _init_render_worker():
+    import matplotlib.pyplot as plt
+    plt.switch_backend('Agg')
+
+
+def _render_job(job, options):
+    import matplotlib.pyplot as plt
+    from . import plotter
+    from ..foundations.result_store import ResultStore
+
+    # Skip when the figure is up to date
+    paths = [os.path.join(options['out_dir'], '%s.%s' % (job['name'], fmt)) for fmt in options['formats']]
+    hash_path = os.path.join(options['out_dir'], '.%s.hash' % job['name'])
+    job_hash = get_job_hash(job, options)
+    if not options['force'] and all(os.path.isfile(path) for path in paths) and os.path.isfile(hash_path):
+        with open(hash_path) as f:
+            if f.read() == job_hash:
+                return 'skipped'
+
+    # Reuse the figure of this clamp type
+    n_axes = 2 if job['clamp_type'] == 'current' else 3
+    if job['clamp_type'] not in _figures:
+        _figures[job['clamp_type']] = plt.subplots(n_axes, figsize=(12,12))[1]
+    axs = _figures[job['clamp_type']]
+
+    if 'store' in job:
+        fig = plotter.plot_stored_run(ResultStore(job['store']), job['run_id'], job['clamp_type'], options['window'],
+                                      options['n_bins'], show=False, axs=axs)
+    elif job['clamp_type'] == 'current':
+        fig = plotter.plot_currentclamp(job['inj_input'], job['voltage'], job['hidden_state'], job['dt'],
+                                        options['window'], options['n_bins'], show=False, axs=axs)
+    else:
+        fig = plotter.plot_dynamicclamp(job['inj_input'], job['voltage'], job['hidden_state'], job['dt'],
+                                        options['window'], options['n_bins'], show=False, axs=axs)
+
+    for path in paths:
+        fig.savefig(path, dpi=options['dpi'])
+    with open(hash_path, 'w') as f:
+        f.write(job_hash)
+    return 'rendered'
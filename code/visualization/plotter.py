@@ -2,12 +2,15 @@
 
     visualises one of the .csv files in the results folder that
     have been generated by the main.py code.
+
+    Long traces are decimated to the resolution of the screen (minimum and maximum per pixel) and
+    the ON state is drawn as one span per block, so recordings of minutes render quickly.
 '''
 import numpy as np
 import matplotlib.pyplot as plt
-from brian2.units.stdunits import mV, ms, mS, uA, nA, namp
+from ..foundations.helpers import get_state_blocks
 
-def plot_dynamicclamp(inj_dynamic, voltage, hidden_state, dt, window=None):
+def plot_dynamicclamp(inj_dynamic, voltage, hidden_state, dt, window=None, n_bins=2000, show=True, axs=None):
     ''' Plots the injected conductance and voltage trace.
 
        INPUT
@@ -16,6 +19,9 @@ def plot_dynamicclamp(inj_dynamic, voltage, hidden_state, dt, window=None):
        hidden_state (array): binary array representing the hidden state
        dt (float): time step of the simulation in milliseconds
        window (array): [start, stop] in ms
+       n_bins (int): number of bins the traces are decimated to, None to plot every sample
+       show (bool): show the figure
+       axs (array of matplotlib.axes): existing axes to draw in, they are cleared first
 
        OUTPUT
        matplotlib.figure
@@ -36,38 +42,37 @@ def plot_dynamicclamp(inj_dynamic, voltage, hidden_state, dt, window=None):
         time = np.arange(start, len(hidden_state))*dt
 
     # Plot
-    fig, axs = plt.subplots(3, figsize=(12,12))
+    fig, axs = get_axes(3, axs)
     fig.suptitle('Dynamic Clamp')
-    for idx, val in enumerate(hidden_state):
-        idx += start
-        if val == 1:
-            axs[0].axvline(idx*dt, c='lightgray')
-            axs[1].axvline(idx*dt, c='lightgray')
-            axs[2].axvline(idx*dt, c='lightgray')
-
-    axs[0].plot(time, abs(g_exc), c='red')
+    plot_hidden_state(axs, hidden_state, dt, start)
+
+    axs[0].plot(*decimate_minmax(time, np.abs(g_exc), n_bins), c='red')
     axs[0].set(ylabel='Exc. conductance [mS]')
 
-    axs[1].plot(time, abs(g_inh), c='blue')
+    axs[1].plot(*decimate_minmax(time, np.abs(g_inh), n_bins), c='blue')
     axs[1].set(ylabel='Inh. conductance [mS]')
 
-    axs[2].plot(time, voltage, c='black')
+    axs[2].plot(*decimate_minmax(time, voltage, n_bins), c='black')
     axs[2].set(ylabel='Voltage [mV]', xlabel='Time [ms]')
-    plt.show()
+    if show:
+        plt.show()
 
-    return
+    return fig
 
 
-def plot_currentclamp(inj_current, voltage, hidden_state, dt, window=None):
+def plot_currentclamp(inj_current, voltage, hidden_state, dt, window=None, n_bins=2000, show=True, axs=None):
     '''Plots the injected current and voltage trace.
 
-        
+
        INPUT
        inj_dynamic (tuple): (g_exc, g_inh) input injected into the neuron.
        voltage (array): voltage of the model during the stimulation
        hidden_state (array): binary array representing the hidden state
        dt (float): time step of the simulation in milliseconds
        window (array): [start, stop] in ms
+       n_bins (int): number of bins the traces are decimated to, None to plot every sample
+       show (bool): show the figure
+       axs (array of matplotlib.axes): existing axes to draw in, they are cleared first
 
        OUTPUT
        matplotlib.figure
@@ -84,18 +89,123 @@ def plot_currentclamp(inj_current, voltage, hidden_state, dt, window=None):
         start = 0
         time = np.arange(start, len(hidden_state))*dt
 
-    fig, axs = plt.subplots(2, figsize=(12,12))
+    fig, axs = get_axes(2, axs)
     fig.suptitle('Current Clamp')
-    for idx, val in enumerate(hidden_state):
-        idx += start
-        if val == 1:
-            axs[0].axvline(idx*dt, c='lightgray')
-            axs[1].axvline(idx*dt, c='lightgray')
-    axs[0].plot(time, inj_current, c='red')
+    plot_hidden_state(axs, hidden_state, dt, start)
+
+    axs[0].plot(*decimate_minmax(time, inj_current, n_bins), c='red')
     axs[0].set(ylabel='Input current [uA]')
-  
-    axs[1].plot(time, voltage, c='black')
+
+    axs[1].plot(*decimate_minmax(time, voltage, n_bins), c='black')
     axs[1].set(ylabel='Voltage [mV]', xlabel='Time [ms]')
-    plt.show()
+    if show:
+        plt.show()
+
+    return fig
 
-    return
+
+def plot_stored_run(store, run_id, clamp_type=None, window=None, n_bins=2000, show=True, axs=None):
+    ''' Plots a run from a ResultStore. The arrays are memory-mapped, so only the window is read from disk.
+        The run is expected to contain 'inj_current' and 'current_volt' (current clamp) or 'g_exc', 'g_inh'
+        and 'dynamic_volt' (dynamic clamp), as stored by big_sim.py, and 'dt' in its meta data. The hidden
+        state is read from the run in meta['stimulus'] if it has one, else from the run itself.
+
+        INPUT
+        store (ResultStore): store containing the run
+        run_id (str): identifier of the run
+        clamp_type (str): 'current' or 'dynamic', read from the meta data of the run by default
+        window (array): [start, stop] in samples
+        n_bins (int): number of bins the traces are decimated to
+        show (bool): show the figure
+        axs (array of matplotlib.axes): existing axes to draw in
+
+        OUTPUT
+        matplotlib.figure
+    '''
+    meta = store.meta(run_id)
+    dt = meta.get('dt', 1)
+    if clamp_type is None:
+        clamp_type = meta.get('clamp_type')
+    hidden_state = store.load(meta.get('stimulus', run_id), 'hidden_state')
+    if clamp_type == 'current':
+        return plot_currentclamp(store.load(run_id, 'inj_current'), store.load(run_id, 'current_volt'),
+                                 hidden_state, dt, window, n_bins, show, axs)
+    elif clamp_type == 'dynamic':
+        inj_dynamic = (store.load(run_id, 'g_exc'), store.load(run_id, 'g_inh'))
+        return plot_dynamicclamp(inj_dynamic, store.load(run_id, 'dynamic_volt'), hidden_state, dt, window, n_bins, show, axs)
+    raise ValueError('ClampType must be \'current\' or \'dynamic\'')
+
+
+def get_axes(n_axes, axs=None):
+    ''' Makes a figure with n_axes axes, or clears and reuses existing axes.
+
+        INPUT
+        n_axes (int): number of axes
+        axs (array of matplotlib.axes): axes to reuse, None to make a new figure
+
+        OUTPUT
+        fig, axs (matplotlib.figure, array of matplotlib.axes)
+    '''
+    if axs is None:
+        return plt.subplots(n_axes, figsize=(12,12))
+    for ax in axs:
+        ax.cla()
+    return axs[0].figure, axs
+
+
+def plot_hidden_state(axs, hidden_state, dt, start=0, color='lightgray'):
+    ''' Shades the ON state of the hidden state, one span per ON block on every axis.
+
+        INPUT
+        axs (array of matplotlib.axes): axes to shade
+        hidden_state (array): binary array representing the hidden state
+        dt (float): time step of the simulation in milliseconds
+        start (int): index of the first sample of the hidden state
+        color (str): color of the shading
+
+        OUTPUT
+        artists (list): the shading of every axis, e.g. to remove it when redrawing
+    '''
+    starts, stops, states = get_state_blocks(hidden_state)
+    on = states == 1
+    xranges = [((block_start + start)*dt, (block_stop - block_start)*dt)
+               for block_start, block_stop in zip(starts[on], stops[on])]
+    return [ax.broken_barh(xranges, (0, 1), transform=ax.get_xaxis_transform(), color=color, linewidth=0)
+            for ax in np.atleast_1d(axs)]
+
+
+def decimate_minmax(time, trace, n_bins=2000):
+    ''' Decimates a trace to n_bins bins, keeping the minimum and maximum of every bin so that
+        peaks (e.g. spikes) remain visible.
+
+        INPUT
+        time (array): time of every sample
+        trace (array): values of every sample
+        n_bins (int): number of bins, None to keep every sample
+
+        OUTPUT
+        time, trace (array, array): decimated time and trace with two samples per bin
+    '''
+    trace = np.asarray(trace).ravel()
+    time = np.asarray(time).ravel()
+    if n_bins is None or len(trace) <= 2*n_bins:
+        return time, trace
+
+    bin_size = len(trace) // n_bins
+    n_samples = bin_size * n_bins
+    bins = trace[:n_samples].reshape(n_bins, bin_size)
+    bin_time = time[:n_samples].reshape(n_bins, bin_size)
+
+    # Minimum and maximum of every bin in the order in which they occur
+    idx_min = bins.argmin(axis=1)
+    idx_max = bins.argmax(axis=1)
+    first = np.minimum(idx_min, idx_max)
+    last = np.maximum(idx_min, idx_max)
+    rows = np.arange(n_bins)
+    decimated_time = np.column_stack((bin_time[rows, first], bin_time[rows, last])).ravel()
+    decimated_trace = np.column_stack((bins[rows, first], bins[rows, last])).ravel()
+
+    # Samples that don't fill a whole bin
+    decimated_time = np.concatenate((decimated_time, time[n_samples:]))
+    decimated_trace = np.concatenate((decimated_trace, trace[n_samples:]))
+    return decimated_time, decimated_trace
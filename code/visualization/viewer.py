@@ -0,0 +1,153 @@
+''' viewer.py
+
+    Interactive viewer of long recordings in a ResultStore. When a run is saved in a store with
+    pyramids (as the stores of a Campaign and a sweep), a multi-resolution pyramid of every trace is
+    stored with it: level k holds the minimum and maximum of every factor**k samples. On zoom or pan
+    the viewer only reads the part of the coarsest level that still has enough points for the
+    visible window and decimates it with plotter.decimate_minmax, so drawing costs the same for
+    seconds or hours of data. Runs saved without pyramids get them with ResultStore.add_pyramids.
+'''
+import numpy as np
+import matplotlib.pyplot as plt
+from ..foundations.result_store import pyramid_name, PYRAMID_FACTOR
+from . import plotter
+
+
+def fetch(store, run_id, name, start, stop, max_points=2000):
+    ''' Reads the samples start:stop of a trace at the coarsest resolution that has at least max_points bins.
+
+        INPUT
+        store (ResultStore): store containing the run
+        run_id (str): identifier of the run
+        name (str): name of the trace
+        start, stop (int): first and last (exclusive) sample of the window
+        max_points (int): number of bins needed in the window
+
+        OUTPUT
+        index, mins, maxs (array, array, array): first sample, minimum and maximum of every bin in the window
+    '''
+    pyramid = store.meta(run_id).get('pyramids', {}).get(name, {'factor':PYRAMID_FACTOR, 'levels':0})
+    factor = pyramid['factor']
+
+    # Coarsest level that still has max_points bins in the window
+    level = 0
+    while level < pyramid['levels'] and (stop - start) / factor**(level + 1) >= max_points:
+        level += 1
+
+    if level == 0:
+        values = store.window(run_id, name, max(start, 0), stop)
+        index = np.arange(max(start, 0), max(start, 0) + len(values))
+        return index, values, values
+
+    bin_size = factor**level
+    first = max(start // bin_size, 0)
+    last = -(-stop // bin_size)
+    mins = store.window(run_id, pyramid_name(name, 'min', level), first, last)
+    maxs = store.window(run_id, pyramid_name(name, 'max', level), first, last)
+    index = (first + np.arange(len(mins))) * bin_size
+    return index, mins, maxs
+
+
+class TraceViewer:
+    ''' Interactive viewer of the traces, spike times and hidden state of a stored run. Only the
+        visible window is read from disk, at a resolution matching the width of the axes.
+
+        INPUT
+        store (ResultStore): store containing the run
+        run_id (str): identifier of the run
+        traces (list): names of the traces to show, e.g. ['g_exc', 'g_inh', 'dynamic_volt']
+        spikes (str): name of the array with spike times in ms, e.g. 'dynamic_spikes', None to show no raster
+        hidden_state (str): name of the hidden state, None to show no hidden state. It is read from the
+                            run in meta['stimulus'] if the run has one (as a simulation of big_sim.py)
+        dt (float): time step in ms, read from the meta data of the run by default
+        max_points (int): number of bins drawn per trace
+    '''
+    def __init__(self, store, run_id, traces, spikes=None, hidden_state='hidden_state', dt=None, max_points=2000):
+        self.store = store
+        self.run_id = run_id
+        self.traces = traces
+        self.spikes = store.load(run_id, spikes) if spikes else None
+        meta = store.meta(run_id)
+        self.hidden_state = hidden_state
+        self.hidden_state_run = meta.get('stimulus', run_id)
+        self.dt = dt if dt is not None else meta.get('dt', 1)
+        self.max_points = max_points
+        self.n_samples = store.load(run_id, traces[0]).shape[-1]
+
+        n_axes = len(traces) + (spikes is not None)
+        self.fig, axs = plt.subplots(n_axes, sharex=True, figsize=(12, 2.5*n_axes), squeeze=False)
+        self.axs = axs[:, 0]
+        self.lines = {}
+        self.shading = []
+        self.raster = None
+        for ax, name in zip(self.axs, traces):
+            self.lines[name] = ax.plot([], [], color='black', linewidth=0.5)[0]
+            ax.set(ylabel=name)
+        if spikes is not None:
+            self.axs[-1].set(ylabel='spikes', yticks=[])
+        self.axs[-1].set(xlabel='Time [ms]')
+
+        self.set_window(0, self.n_samples)
+        self.axs[0].callbacks.connect('xlim_changed', self._on_xlim_changed)
+
+    def set_window(self, start, stop):
+        ''' Shows the samples start:stop.
+        '''
+        self._updating = True
+        self.axs[0].set_xlim(start*self.dt, stop*self.dt)
+        self._updating = False
+        self.update(start, stop)
+
+    def update(self, start, stop):
+        ''' Reads and draws the samples start:stop of every trace, the hidden state and the spikes.
+        '''
+        start = int(np.clip(start, 0, self.n_samples))
+        stop = int(np.clip(stop, start, self.n_samples))
+
+        for ax, name in zip(self.axs, self.traces):
+            index, mins, maxs = fetch(self.store, self.run_id, name, start, stop, self.max_points)
+            if mins is maxs:
+                time, trace = index*self.dt, mins
+            else:
+                # The minimum and maximum of every bin as two samples
+                time = np.repeat(index*self.dt, 2)
+                trace = np.column_stack((mins, maxs)).ravel()
+            self.lines[name].set_data(*plotter.decimate_minmax(time, trace, self.max_points))
+            if len(mins):
+                margin = 0.05*(np.max(maxs) - np.min(mins)) or 1
+                ax.set_ylim(np.min(mins) - margin, np.max(maxs) + margin)
+
+        if self.hidden_state:
+            self._draw_hidden_state(start, stop)
+        if self.spikes is not None:
+            self._draw_spikes(start, stop)
+        self.fig.canvas.draw_idle()
+
+    def show(self):
+        plt.show()
+
+    def _draw_hidden_state(self, start, stop):
+        # At a coarse level a bin is shaded when the hidden state is ON anywhere in the bin
+        index, _, maxs = fetch(self.store, self.hidden_state_run, self.hidden_state, start, stop, self.max_points)
+        bin_size = index[1] - index[0] if len(index) > 1 else 1
+        for artist in self.shading:
+            artist.remove()
+        self.shading = plotter.plot_hidden_state(self.axs, maxs, bin_size*self.dt, index[0]//bin_size if len(index) else 0)
+
+    def _draw_spikes(self, start, stop):
+        spikes = self.spikes[np.searchsorted(self.spikes, start*self.dt):np.searchsorted(self.spikes, stop*self.dt)]
+        if self.raster is not None:
+            self.raster.remove()
+        ax = self.axs[-1]
+        if len(spikes) > self.max_points:
+            # Too many spikes to draw individually, show the spike count per bin
+            counts, edges = np.histogram(spikes, bins=self.max_points, range=(start*self.dt, stop*self.dt))
+            self.raster = ax.fill_between(edges[:-1], 0, counts/max(counts.max(), 1), step='post', color='black')
+        else:
+            self.raster = ax.vlines(spikes, 0, 1, color='black')
+
+    def _on_xlim_changed(self, ax):
+        if self._updating:
+            return
+        left, right = ax.get_xlim()
+        self.update(int(np.floor(left/self.dt)), int(np.ceil(right/self.dt)) + 1)